@@ -3,6 +3,7 @@ from django.conf import settings
 from django.core.cache import cache
 from django.http import HttpRequest
 from typing import Optional, Dict, Any
+from wdg_core_auth.clients import get_http_client
 
 
 class UserRest:
@@ -10,7 +11,7 @@ class UserRest:
 
     def __init__(self, request: Optional[HttpRequest] = None):
         self.request = request
-        self.session = httpx.Client(timeout=5)
+        self.session = get_http_client(self.AUTH_URL)
 
     def _fetch_data(self, endpoint: str) -> Optional[Dict[str, Any]]:
         """Fetch data from API and cache it for 5 minutes."""
@@ -44,6 +45,3 @@ class UserRest:
     def user_detail(self, id: int) -> Optional[Dict[str, Any]]:
         """Fetch current user with caching."""
         return self._fetch_data(f"user/{id}")
-
-    def __del__(self):
-        self.session.close()
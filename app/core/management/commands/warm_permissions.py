@@ -0,0 +1,142 @@
+import json
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from wdg_core_auth.warmup import get_role_members, warm_permissions
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-populates the permission cache for the given users and/or roles, "
+        "e.g. after a deploy or a Redis flush."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", action="append", default=[], help="User id to warm (repeatable)."
+        )
+        parser.add_argument(
+            "--role",
+            action="append",
+            default=[],
+            help="Role id whose users are warmed (repeatable).",
+        )
+        parser.add_argument(
+            "--file",
+            help="JSON array or JSON lines of token claims, one identity each ('-' for stdin).",
+        )
+        parser.add_argument(
+            "--claims",
+            default="{}",
+            help=(
+                "Claims added to every identity. Every cache key claim is required "
+                '(null if tokens do not carry it), e.g. \'{"company_id": 1, "branch_id": 2}\'.'
+            ),
+        )
+        parser.add_argument(
+            "--token", help="Service token for the auth service (default: AUTH_WARMUP_TOKEN)."
+        )
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent fetches.")
+        parser.add_argument(
+            "--rate", type=float, help="Maximum fetches per second (default: unlimited)."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=100, help="Entries written per Redis pipeline."
+        )
+        parser.add_argument(
+            "--force", action="store_true", help="Refetch identities that are already cached."
+        )
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        token = options["token"] or getattr(settings, "AUTH_WARMUP_TOKEN", None)
+        if not token:
+            raise CommandError("A service token is required (--token or AUTH_WARMUP_TOKEN).")
+
+        try:
+            extra_claims = json.loads(options["claims"])
+        except ValueError as e:
+            raise CommandError(f"--claims is not valid JSON: {e}")
+
+        identities = self._load_identities(options, token)
+        if not identities:
+            raise CommandError("Nothing to warm: pass --user, --role or --file.")
+        identities = [{**extra_claims, **claims} for claims in identities]
+
+        report = warm_permissions(
+            identities,
+            token,
+            workers=options["workers"],
+            rate=options["rate"],
+            batch_size=options["batch_size"],
+            force=options["force"],
+            progress=self._progress if options["verbosity"] > 1 else None,
+        )
+        stats = report.stats()
+
+        if options["json"]:
+            self.stdout.write(json.dumps({**stats, "failures": report.failures}, default=str))
+            return
+
+        for failure in report.failures:
+            self.stdout.write(
+                self.style.ERROR(f"Failed {failure['identity']}: {failure['error']}")
+            )
+        if report.aborted:
+            self.stdout.write(
+                self.style.WARNING("Stopped early: the auth service circuit breaker is open.")
+            )
+        style = self.style.SUCCESS if not report.failed else self.style.WARNING
+        self.stdout.write(
+            style(
+                f"Warmed {stats['written']} of {stats['requested']} identities "
+                f"({stats['skipped']} already cached, {stats['failed']} failed, "
+                f"{stats['empty']} empty) in {stats['elapsed_s']}s, "
+                f"{stats['fetches_per_s']} fetches/s."
+            )
+        )
+
+    def _load_identities(self, options, token):
+        user_id_claim = getattr(settings, "AUTH_PERMISSION_USER_ID_CLAIM", "user_id")
+        identities = [{user_id_claim: self._parse_id(user_id)} for user_id in options["user"]]
+
+        for role_id in options["role"]:
+            try:
+                identities.extend(get_role_members(self._parse_id(role_id), token))
+            except Exception as e:
+                raise CommandError(f"Could not list the users of role {role_id}: {e}")
+
+        if options["file"]:
+            identities.extend(self._read_file(options["file"]))
+        return identities
+
+    @staticmethod
+    def _parse_id(value):
+        return int(value) if str(value).isdigit() else value
+
+    @staticmethod
+    def _read_file(path):
+        if path == "-":
+            content = sys.stdin.read()
+        else:
+            try:
+                with open(path) as file:
+                    content = file.read()
+            except OSError as e:
+                raise CommandError(f"Could not read {path}: {e}")
+
+        try:
+            if content.lstrip().startswith("["):
+                return json.loads(content)
+            return [json.loads(line) for line in content.splitlines() if line.strip()]
+        except ValueError as e:
+            raise CommandError(f"{path} is not valid JSON: {e}")
+
+    def _progress(self, report):
+        stats = report.stats()
+        self.stdout.write(
+            f"{stats['written']} written, {stats['failed']} failed, "
+            f"{stats['fetches_per_s']} fetches/s"
+        )
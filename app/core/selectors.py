@@ -4,6 +4,7 @@ from django.conf import settings
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
 from typing import Any, Dict, Optional
 from django.core.cache import cache
+from wdg_core_auth.clients import get_http_client
 
 
 class CompanySelector:
@@ -17,7 +18,7 @@ class CompanySelector:
             )
 
         self.request = request
-        self.session = httpx.Client(timeout=5)
+        self.session = get_http_client(self.BASE_URL)
 
     def _fetch_data(self, endpoint: str) -> Optional[Dict[str, Any]]:
         """Fetches data from the company service with the authenticated user's token and caches it for 5 minutes."""
@@ -1,15 +1,16 @@
 import jwt
 from django.conf import settings
+from wdg_core_auth.keys import decode_token, load_pem_key
+from wdg_core_auth.utils import parse_verify_key  # noqa: F401
 
 
-def parse_verify_key(key: str):
-    if not key:
-        return None
-    return key.replace(r"\n", "\n")
-
-
-def jwt_decode_rs256_token(token, public_key):
+def jwt_decode_rs256_token(token, public_key=None):
     try:
+        if public_key is None:
+            # Cached key objects from JWT_VERIFYING_KEY(S) / JWKS, selected by `kid`
+            return decode_token(token)
+        if isinstance(public_key, str):
+            public_key = load_pem_key(public_key)
         decoded_token = jwt.decode(token, public_key, algorithms=["RS256"])
         return decoded_token
     except jwt.ExpiredSignatureError:
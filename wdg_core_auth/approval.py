@@ -0,0 +1,186 @@
+import hashlib
+import json
+import time
+from typing import Any, Dict, Optional
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from jwt import ExpiredSignatureError, InvalidTokenError
+
+from wdg_core_auth import metrics
+from wdg_core_auth.cache import LocalCache
+from wdg_core_auth.keys import KEY_SETTINGS, decode_token
+from wdg_core_auth.utils import get_redis_client
+
+CACHE_KEY_PREFIX = "approval-token:"
+DEFAULT_TTL = 300  # tokens without an `exp` claim
+
+EXPIRED = "expired"
+INVALID = "invalid"
+
+_verified_cache: Optional[LocalCache] = None
+
+
+def get_verified_cache() -> LocalCache:
+    global _verified_cache
+    if _verified_cache is None:
+        _verified_cache = LocalCache(
+            maxsize=getattr(settings, "AUTH_APPROVAL_TOKEN_CACHE_SIZE", 4096),
+            ttl=DEFAULT_TTL,
+        )
+    return _verified_cache
+
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _raise_for(error: str):
+    if error == EXPIRED:
+        raise ExpiredSignatureError("Signature has expired")
+    raise InvalidTokenError("Invalid token")
+
+
+def _shared_cache_enabled() -> bool:
+    return getattr(settings, "AUTH_APPROVAL_TOKEN_CACHE_REDIS", False)
+
+
+def _get_shared(key: str) -> Optional[Dict[str, Any]]:
+    try:
+        value = get_redis_client().get(f"{CACHE_KEY_PREFIX}{key}")
+        return json.loads(value) if value else None
+    except (json.JSONDecodeError, redis.RedisError):
+        return None
+
+
+def _set_shared(key: str, entry: Dict[str, Any], ttl: float):
+    try:
+        get_redis_client().set(f"{CACHE_KEY_PREFIX}{key}", json.dumps(entry), px=int(ttl * 1000))
+    except redis.RedisError:
+        pass
+
+
+def _load_entry(cache: LocalCache, key: str, token: str) -> Dict[str, Any]:
+    """
+    The cache entry for a token missing from `cache`: from Redis when shared,
+    else by verifying it. May block (Redis, JWKS download).
+    """
+    entry = None
+    if _shared_cache_enabled():
+        entry = _get_shared(key)
+        if entry is not None:
+            ttl = entry.get("expires_at", 0) - time.time()
+            if ttl > 0:
+                cache.set(key, entry, ttl=ttl)
+            else:
+                entry = None
+    metrics.increment("wdg_auth_token_cache_total", result="miss" if entry is None else "hit")
+    if entry is not None:
+        return entry
+
+    negative_ttl = getattr(settings, "AUTH_APPROVAL_TOKEN_NEGATIVE_TTL", 5)
+    try:
+        payload = decode_token(token)
+    except ExpiredSignatureError:
+        entry = {"error": EXPIRED, "expires_at": time.time() + negative_ttl}
+    except InvalidTokenError:
+        entry = {"error": INVALID, "expires_at": time.time() + negative_ttl}
+    else:
+        exp = payload.get("exp")
+        expires_at = exp if isinstance(exp, (int, float)) else time.time() + DEFAULT_TTL
+        entry = {"payload": payload, "expires_at": expires_at}
+
+    ttl = entry["expires_at"] - time.time()
+    if ttl > 0:
+        cache.set(key, entry, ttl=ttl)
+        if _shared_cache_enabled():
+            _set_shared(key, entry, ttl)
+    return entry
+
+
+def _get_payload(entry: Dict[str, Any]) -> Dict[str, Any]:
+    if "error" in entry:
+        _raise_for(entry["error"])
+    return dict(entry["payload"])
+
+
+def verify_token(token: str) -> Dict[str, Any]:
+    """
+    Verify a JWT signed with the configured keys, caching the outcome by token hash.
+
+    Valid tokens are cached until their `exp`, so a burst of calls with the same
+    token costs one RSA verification. Invalid and expired tokens are cached for
+    AUTH_APPROVAL_TOKEN_NEGATIVE_TTL seconds. Set AUTH_APPROVAL_TOKEN_CACHE_REDIS
+    to share the cache between workers.
+
+    Raises ExpiredSignatureError or InvalidTokenError like `jwt.decode`.
+    """
+    cache = get_verified_cache()
+    key = _hash_token(token)
+
+    entry = cache.get(key)
+    if entry is None:
+        entry = _load_entry(cache, key, token)
+    else:
+        metrics.increment("wdg_auth_token_cache_total", result="hit")
+    return _get_payload(entry)
+
+
+async def averify_token(token: str) -> Dict[str, Any]:
+    """
+    Async `verify_token`: a token missing from the in-process cache is looked up
+    and verified in a worker thread, off the event loop.
+    """
+    cache = get_verified_cache()
+    key = _hash_token(token)
+
+    entry = cache.get(key)
+    if entry is None:
+        entry = await sync_to_async(_load_entry, thread_sensitive=False)(cache, key, token)
+    else:
+        metrics.increment("wdg_auth_token_cache_total", result="hit")
+    return _get_payload(entry)
+
+
+def verify_approval_token(token: str) -> Dict[str, Any]:
+    """
+    Verify an `X-Approval-Token`. See `verify_token`.
+    """
+    with metrics.timer("wdg_auth_approval_verify_seconds") as timer:
+        try:
+            payload = verify_token(token)
+        except ExpiredSignatureError:
+            timer.labels["outcome"] = EXPIRED
+            raise
+        except InvalidTokenError:
+            timer.labels["outcome"] = INVALID
+            raise
+        timer.labels["outcome"] = "valid"
+    return payload
+
+
+async def averify_approval_token(token: str) -> Dict[str, Any]:
+    """
+    Async `verify_approval_token`.
+    """
+    with metrics.timer("wdg_auth_approval_verify_seconds") as timer:
+        try:
+            payload = await averify_token(token)
+        except ExpiredSignatureError:
+            timer.labels["outcome"] = EXPIRED
+            raise
+        except InvalidTokenError:
+            timer.labels["outcome"] = INVALID
+            raise
+        timer.labels["outcome"] = "valid"
+    return payload
+
+
+def _reset_verified_cache(setting, **kwargs):
+    if setting in KEY_SETTINGS and _verified_cache is not None:
+        _verified_cache.clear()
+
+
+setting_changed.connect(_reset_verified_cache)
@@ -0,0 +1,584 @@
+"""
+Micro-benchmarks for the permission pipeline.
+
+Run with `python -m wdg_core_auth.benchmarks [name ...] [--output results.json]`.
+Uses the project settings when DJANGO_SETTINGS_MODULE is set, otherwise a
+minimal in-memory configuration. Results are printed (or written) as JSON, so
+runs of different versions can be diffed.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+def setup_django():
+    import django
+    from django.conf import settings
+
+    if not settings.configured and not os.environ.get("DJANGO_SETTINGS_MODULE"):
+        settings.configure(
+            AUTH_SERVICE_BASE_URL="http://127.0.0.1",
+            CACHE_REDIS_LOCATION="redis://127.0.0.1:6379/0",
+            JWT_VERIFYING_KEY="",
+        )
+    django.setup()
+
+
+def timeit(func: Callable[[], Any], iterations: int) -> Dict[str, float]:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    return {
+        "iterations": iterations,
+        "total_s": round(elapsed, 6),
+        "per_call_us": round(elapsed / iterations * 1e6, 3),
+    }
+
+
+def build_tree(nodes: int, fanout: int = 10) -> list:
+    """
+    Synthetic permission tree with `nodes` dotted codenames, `fanout` children
+    per node, cycling through the three permission types.
+    """
+    from .constants import PermissionOption
+
+    types = (
+        PermissionOption.ALLOWED,
+        PermissionOption.APPROVAL_REQUIRED,
+        PermissionOption.DENIED,
+    )
+    roots: list = []
+    queue = deque([(roots, "perm")])
+    created = 0
+    while created < nodes:
+        siblings, prefix = queue.popleft()
+        for i in range(min(fanout, nodes - created)):
+            codename = f"{prefix}.{i}"
+            node = {
+                "codename": codename,
+                "name": f"Permission {codename}",
+                "type": types[created % len(types)],
+                "permission_type": "menu" if created % 4 == 0 else "permission",
+                "children": [],
+            }
+            siblings.append(node)
+            queue.append((node["children"], codename))
+            created += 1
+    return roots
+
+
+def iter_nodes(tree: list) -> Iterator[Dict[str, Any]]:
+    """
+    Nodes in depth-first order, the order the legacy evaluators search them.
+    """
+    stack = [iter(tree)]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            continue
+        yield node
+        if node.get("children"):
+            stack.append(iter(node["children"]))
+
+
+def tree_depth(tree: list) -> int:
+    depth, level = 0, tree
+    while level:
+        depth += 1
+        level = [child for node in level for child in node.get("children") or ()]
+    return depth
+
+
+def pick_codenames(tree: list) -> Dict[str, str]:
+    """
+    Codenames at the start, middle and end of the depth-first search, plus one
+    that is not in the tree (the worst case for the legacy evaluators).
+    """
+    codenames = [node["codename"] for node in iter_nodes(tree)]
+    return {
+        "first": codenames[0],
+        "middle": codenames[len(codenames) // 2],
+        "last": codenames[-1],
+        "missing": "perm.missing",
+    }
+
+
+def scaled_iterations(nodes: int, budget: int = 2_000_000, maximum: int = 2000) -> int:
+    # Keep large trees from dominating the run time of the linear evaluators.
+    return max(3, min(maximum, budget // max(nodes, 1)))
+
+
+def swallow_denied(func: Callable[..., Any]) -> Callable[..., Any]:
+    def call(*args):
+        try:
+            return func(*args)
+        except PermissionError:
+            return None  # denied and missing codenames are results too
+
+    return call
+
+
+@contextlib.contextmanager
+def redis_stand_in() -> Iterator[Optional[str]]:
+    """
+    The configured Redis when it answers, else an in-process fakeredis server
+    (if installed). Yields "redis", "fakeredis" or None.
+    """
+    import redis
+
+    from . import utils
+
+    try:
+        utils.get_redis_client().ping()
+        available = True
+    except redis.RedisError:
+        available = False
+    if available:
+        yield "redis"
+        return
+
+    try:
+        import fakeredis
+    except ImportError:
+        yield None
+        return
+
+    server = fakeredis.FakeServer()
+    build_redis_client = utils.build_redis_client
+    utils.build_redis_client = lambda asyncio_client=False: (
+        fakeredis.FakeAsyncRedis(server=server)
+        if asyncio_client
+        else fakeredis.FakeRedis(server=server)
+    )
+    utils.reset_redis_clients()
+    try:
+        yield "fakeredis"
+    finally:
+        utils.build_redis_client = build_redis_client
+        utils.reset_redis_clients()
+
+
+class StubAuthHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+    payload = b"[]"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(payload: Any = ()) -> ThreadingHTTPServer:
+    handler = type("Handler", (StubAuthHandler,), {"payload": json.dumps(list(payload)).encode()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_http_client(iterations: int = 500) -> Dict[str, Any]:
+    """
+    New httpx.Client per call (the old `_fetch_data`) against the pooled client.
+    """
+    import httpx
+
+    from .clients import get_http_client
+
+    server = start_stub_server()
+    url = f"http://127.0.0.1:{server.server_port}/api/v1/user/permissions"
+    try:
+        def new_client():
+            with httpx.Client() as client:
+                client.get(url, timeout=5).json()
+
+        def pooled_client():
+            get_http_client(url).get(url).json()
+
+        return {
+            "new_client_per_call": timeit(new_client, iterations),
+            "pooled_client": timeit(pooled_client, iterations),
+        }
+    finally:
+        server.shutdown()
+
+
+def bench_jwt_verify(iterations: int = 2000) -> Dict[str, Any]:
+    """
+    Approval-token verification: PEM parsed per call against cached key objects.
+    """
+    import jwt
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    from .keys import KeyProvider, load_pem_key
+    from .utils import parse_verify_key
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    token = jwt.encode(
+        {"user_id": 1, "permissions": ["product.read"], "exp": int(time.time()) + 3600},
+        private_key,
+        algorithm="RS256",
+    )
+
+    provider = KeyProvider()
+    provider._keys = {None: load_pem_key(public_pem)}
+    provider._loaded_at = time.monotonic()
+
+    def pem_per_call():
+        jwt.decode(token, parse_verify_key(public_pem), algorithms=["RS256"])
+
+    def cached_key():
+        provider.decode(token)
+
+    return {
+        "pem_per_call": timeit(pem_per_call, iterations),
+        "cached_key": timeit(cached_key, iterations),
+    }
+
+
+def bench_codecs(nodes: int = 10000, iterations: int = 20) -> Dict[str, Any]:
+    """
+    Encode/decode cost and size of a large tree for each cache codec, with and
+    without compression, against the legacy `json.dumps` text.
+    """
+    from django.test import override_settings
+
+    from .utils import CACHE_CODECS, decode_value, encode_value
+
+    tree = build_tree(nodes)
+    results: Dict[str, Any] = {"nodes": nodes}
+
+    legacy = json.dumps(tree)
+    results["legacy_json"] = {
+        "bytes": len(legacy),
+        "encode": timeit(lambda: json.dumps(tree), iterations),
+        "decode": timeit(lambda: json.loads(legacy), iterations),
+    }
+
+    for name, codec in CACHE_CODECS.items():
+        for label, threshold in (("", None), ("+zlib", 4096)):
+            with override_settings(AUTH_CACHE_COMPRESS_THRESHOLD=threshold):
+                encoded = encode_value(tree, codec)
+                results[f"{name}{label}"] = {
+                    "bytes": len(encoded),
+                    "encode": timeit(lambda: encode_value(tree, codec), iterations),
+                    "decode": timeit(lambda: decode_value(encoded), iterations),
+                }
+    return results
+
+
+def bench_shared_cache(nodes: int = 300, iterations: int = 2000) -> Dict[str, Any]:
+    """
+    Snapshot lookup through the shared-memory cache against a Redis GET of the
+    same encoded tree (skipped when Redis is unreachable).
+    """
+    import hashlib
+    import tempfile
+
+    import redis
+
+    from .shm import SharedSnapshotCache
+    from .utils import decode_value, encode_value, get_redis_client
+
+    tree = build_tree(nodes)
+    payload = encode_value(tree)
+    snapshot_id = hashlib.sha256(payload).hexdigest()
+    key = "permissions:benchmark"
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = SharedSnapshotCache(f"{directory}/bench", slots=64, slot_size=256 * 1024)
+        cache.set(key, snapshot_id, payload, ttl=3600)
+        results: Dict[str, Any] = {
+            "nodes": nodes,
+            "payload_bytes": len(payload),
+            "shm_known_snapshot": timeit(lambda: cache.get(key, known=lambda _: True), iterations),
+            "shm_decode": timeit(lambda: decode_value(cache.get(key)[1]), iterations),
+        }
+        cache.close()
+
+    try:
+        client = get_redis_client()
+        client.set(key, payload, ex=60)
+        results["redis_decode"] = timeit(lambda: decode_value(client.get(key)), iterations)
+        client.delete(key)
+    except redis.RedisError as e:
+        results["redis_decode"] = f"unavailable: {e}"
+    return results
+
+
+def bench_evaluators(
+    max_nodes: int = 100_000, fanouts: tuple = (2, 10, 100)
+) -> List[Dict[str, Any]]:
+    """
+    The legacy recursive evaluators (v1/v2/v3) against the same decisions from
+    a PermissionIndex, for trees of 100 to `max_nodes` nodes of varying depth
+    (`fanouts`) and codenames at different search positions.
+    """
+    from .decorators import (
+        is_permission_denied_or_needs_approval,
+        is_permission_denied_or_needs_approval_v2,
+        is_permission_denied_or_needs_approval_v3,
+    )
+    from .index import PermissionIndex
+
+    legacy = {
+        PermissionIndex.V1: swallow_denied(is_permission_denied_or_needs_approval),
+        PermissionIndex.V2: swallow_denied(is_permission_denied_or_needs_approval_v2),
+        PermissionIndex.V3: swallow_denied(is_permission_denied_or_needs_approval_v3),
+    }
+
+    results = []
+    nodes = 100
+    while nodes <= max_nodes:
+        iterations = scaled_iterations(nodes)
+        for fanout in fanouts:
+            tree = build_tree(nodes, fanout)
+            index = PermissionIndex.from_permissions(tree)
+            check = swallow_denied(index.check)
+            positions = {}
+            for position, codename in pick_codenames(tree).items():
+                positions[position] = {
+                    f"v{version}": {
+                        "legacy": timeit(lambda: evaluate(tree, codename), iterations),
+                        "index": timeit(lambda: check(codename, version), 2000),
+                    }
+                    for version, evaluate in legacy.items()
+                }
+            results.append({
+                "nodes": nodes,
+                "fanout": fanout,
+                "depth": tree_depth(tree),
+                "build_index": timeit(
+                    lambda: PermissionIndex.from_permissions(tree), max(3, iterations // 10)
+                ),
+                "positions": positions,
+            })
+        nodes *= 10
+    return results
+
+
+def bench_cache_path(nodes: int = 1000, iterations: int = 2000) -> Dict[str, Any]:
+    """
+    Snapshot writes and reads through Redis (or a fakeredis stand-in), and the
+    selector's per-process cache in front of it.
+    """
+    from django.test import RequestFactory, override_settings
+
+    from .selectors import FetchPermissionSelector
+    from .snapshot import PermissionSnapshot, encode_permissions
+    from .utils import SNAPSHOT_KEY_PREFIX, get_cached_json, set_cached_snapshot
+
+    tree = build_tree(nodes)
+    _, snapshot_id = encode_permissions(tree)
+    codename = pick_codenames(tree)["last"]
+    request = RequestFactory().get("/", HTTP_AUTHORIZATION="Bearer benchmark")
+
+    with redis_stand_in() as backend, override_settings(
+        AUTH_PERMISSION_INVALIDATION_ENABLED=False
+    ):
+        if backend is None:
+            return {"nodes": nodes, "backend": "unavailable"}
+
+        selector = FetchPermissionSelector(request)
+        cache_key = selector._get_cache_key()
+        snapshot = PermissionSnapshot(tree, snapshot_id)
+        bits = snapshot.bits.to_bytes() if snapshot.bits else None
+        snapshot_cache = FetchPermissionSelector.get_snapshot_cache()
+        local_cache = FetchPermissionSelector.get_local_cache()
+
+        def set_snapshot():
+            set_cached_snapshot(cache_key, snapshot_id, tree, ttl=60, bits=bits)
+
+        def read_bits():
+            snapshot_cache.clear()  # a cold process: pointer + bits from Redis
+            swallow_denied(selector._read_cached(cache_key)[0].check)(codename)
+
+        def read_tree():
+            get_cached_json(f"{SNAPSHOT_KEY_PREFIX}{snapshot_id}")
+
+        def local_hit():
+            swallow_denied(FetchPermissionSelector(request).fetch_snapshot().check)(codename)
+
+        results: Dict[str, Any] = {
+            "nodes": nodes,
+            "backend": backend,
+            "set_snapshot": timeit(set_snapshot, iterations),
+            "read_pointer_and_bits": timeit(read_bits, iterations),
+            "read_tree": timeit(read_tree, iterations),
+        }
+        if local_cache is not None:
+            local_cache.set(cache_key, snapshot)
+            results["local_cache_hit"] = timeit(local_hit, iterations)
+            local_cache.clear()
+        snapshot_cache.clear()
+        return results
+
+
+def bench_dispatch(nodes: int = 1000, iterations: int = 2000) -> Dict[str, Any]:
+    """
+    A full decorated-view call (request in, response out) with the snapshot in
+    the per-process cache, against an undecorated view and the legacy v3 scan.
+    """
+    from django.http import HttpResponse
+    from django.test import RequestFactory, override_settings
+
+    from .constants import PermissionOption
+    from .decorators import check_permission, is_permission_denied_or_needs_approval_v3
+    from .selectors import FetchPermissionSelector
+    from .snapshot import PermissionSnapshot, encode_permissions
+
+    tree = build_tree(nodes)
+    _, snapshot_id = encode_permissions(tree)
+    snapshot = PermissionSnapshot(tree, snapshot_id)
+    allowed = [
+        node["codename"]
+        for node in iter_nodes(tree)
+        if snapshot.index.get_type(node["codename"]) == PermissionOption.ALLOWED
+    ]
+    codename, other = allowed[-1], allowed[len(allowed) // 2]
+    factory = RequestFactory()
+
+    class View:
+        def plain(self, request):
+            return HttpResponse()
+
+        @check_permission(codename)
+        def single(self, request):
+            return HttpResponse()
+
+        @check_permission(f"{codename} & ({other} | perm.missing)")
+        def expression(self, request):
+            return HttpResponse()
+
+        def legacy_v3(self, request):
+            is_permission_denied_or_needs_approval_v3(snapshot.permissions, codename)
+            return HttpResponse()
+
+    view = View()
+
+    def dispatch(method):
+        return lambda: method(factory.get("/", HTTP_AUTHORIZATION="Bearer benchmark"))
+
+    with override_settings(AUTH_PERMISSION_INVALIDATION_ENABLED=False):
+        local_cache = FetchPermissionSelector.get_local_cache()
+        if local_cache is None:
+            return {"nodes": nodes, "local_cache": "disabled"}
+        request = factory.get("/", HTTP_AUTHORIZATION="Bearer benchmark")
+        local_cache.set(FetchPermissionSelector(request)._get_cache_key(), snapshot)
+        try:
+            return {
+                "nodes": nodes,
+                "undecorated": timeit(dispatch(view.plain), iterations),
+                "legacy_v3_scan": timeit(dispatch(view.legacy_v3), iterations),
+                "check_permission": timeit(dispatch(view.single), iterations),
+                "check_permission_expression": timeit(dispatch(view.expression), iterations),
+            }
+        finally:
+            local_cache.clear()
+
+
+def bench_metrics(iterations: int = 100_000) -> Dict[str, Any]:
+    """
+    Cost of one timer and one counter increment per exporter; the no-op
+    exporter is the default.
+    """
+    from . import metrics
+
+    def measure():
+        with metrics.timer("wdg_benchmark_seconds", source="benchmark") as timer:
+            timer.labels["outcome"] = "allowed"
+        metrics.increment("wdg_benchmark_total", source="benchmark")
+
+    results = {}
+    exporters = {
+        "noop": metrics.NoopExporter(),
+        "callback": lambda *args: None,
+        "prometheus": metrics.PrometheusExporter(),
+    }
+    try:
+        for name, exporter in exporters.items():
+            metrics.set_exporter(exporter)
+            results[name] = timeit(measure, iterations)
+    finally:
+        metrics.set_exporter(None)
+    return results
+
+
+BENCHMARKS = {
+    "http_client": bench_http_client,
+    "jwt_verify": bench_jwt_verify,
+    "codecs": bench_codecs,
+    "shared_cache": bench_shared_cache,
+    "evaluators": bench_evaluators,
+    "cache_path": bench_cache_path,
+    "dispatch": bench_dispatch,
+    "metrics": bench_metrics,
+}
+
+
+def get_version() -> Optional[str]:
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:
+        return None
+    try:
+        return version("wdg-core-auth")
+    except PackageNotFoundError:
+        return None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Permission pipeline benchmarks.")
+    parser.add_argument(
+        "names", nargs="*", help=f"Benchmarks to run (default: all): {', '.join(BENCHMARKS)}."
+    )
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    parser.add_argument(
+        "--max-nodes", type=int, default=100_000, help="Largest tree for the evaluators benchmark."
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    setup_django()
+    options = {"evaluators": {"max_nodes": args.max_nodes}}
+    names = args.names or list(BENCHMARKS)
+    results = {
+        "meta": {
+            "version": get_version(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "timestamp": int(time.time()),
+        },
+        "results": {name: BENCHMARKS[name](**options.get(name, {})) for name in names},
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
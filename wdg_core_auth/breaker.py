@@ -0,0 +1,175 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker for calls to an upstream service.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    are rejected without being attempted. Once `recovery_timeout` seconds have
+    passed, up to `half_open_max_calls` probe calls are let through: a success
+    closes the circuit, a failure opens it again. Probes that report nothing
+    within `probe_timeout` seconds (default: `recovery_timeout`) count as failed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30,
+        half_open_max_calls: int = 1,
+        probe_timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.probe_timeout = recovery_timeout if probe_timeout is None else probe_timeout
+
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._half_open_calls = 0
+        self._probe_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+        self.successes = 0
+        self.failures = 0
+        self.rejections = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._half_open_calls = 0
+        elif (
+            self._state == HALF_OPEN
+            and self._half_open_calls >= self.half_open_max_calls
+            and now - self._probe_started_at >= self.probe_timeout
+        ):
+            # The probes never reported back: give up on them.
+            self._open(now)
+            logging.warning(f"Circuit {self.name} reopened: half-open probe timed out.")
+        return self._state
+
+    def _open(self, now: float):
+        self._state = OPEN
+        self._opened_at = now
+        self.times_opened += 1
+
+    def allow_request(self) -> bool:
+        """
+        Whether a call may be attempted now. Every allowed call must be followed
+        by `record_success` or `record_failure`.
+        """
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                self._probe_started_at = time.monotonic()
+                return True
+            self.rejections += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self._consecutive_failures = 0
+            if self._state != CLOSED:
+                logging.warning(f"Circuit {self.name} closed.")
+            self._state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == HALF_OPEN or (
+                state == CLOSED and self._consecutive_failures >= self.failure_threshold
+            ):
+                self._open(now)
+                logging.warning(
+                    f"Circuit {self.name} opened after {self._consecutive_failures} "
+                    f"consecutive failures."
+                )
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._half_open_calls = 0
+            self._probe_started_at = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._current_state(time.monotonic()),
+                "consecutive_failures": self._consecutive_failures,
+                "successes": self.successes,
+                "failures": self.failures,
+                "rejections": self.rejections,
+                "times_opened": self.times_opened,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def get_circuit_breaker(base_url: str) -> CircuitBreaker:
+    """
+    Return the process-wide breaker for the host of `base_url`, configured by
+    AUTH_BREAKER_FAILURE_THRESHOLD, AUTH_BREAKER_RECOVERY_TIMEOUT,
+    AUTH_BREAKER_HALF_OPEN_CALLS and AUTH_BREAKER_PROBE_TIMEOUT.
+    """
+    global _breakers_pid
+
+    parsed = urlparse(base_url)
+    name = parsed.netloc or base_url
+    pid = os.getpid()
+    breaker = _breakers.get(name)
+    if breaker is not None and _breakers_pid == pid:
+        return breaker
+
+    with _lock:
+        if _breakers_pid != pid:
+            _breakers.clear()
+            _breakers_pid = pid
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=getattr(settings, "AUTH_BREAKER_FAILURE_THRESHOLD", 5),
+                recovery_timeout=getattr(settings, "AUTH_BREAKER_RECOVERY_TIMEOUT", 30),
+                half_open_max_calls=getattr(settings, "AUTH_BREAKER_HALF_OPEN_CALLS", 1),
+                probe_timeout=getattr(settings, "AUTH_BREAKER_PROBE_TIMEOUT", None),
+            )
+        return breaker
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    State and counters of every breaker in this process, keyed by host.
+    """
+    return {name: breaker.stats() for name, breaker in list(_breakers.items())}
@@ -0,0 +1,127 @@
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+import weakref
+from functools import partial
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+from django.conf import settings
+
+from wdg_core_auth.utils import on_loop_shutdown
+
+DEFAULT_TIMEOUT = 5
+
+_clients: Dict[str, httpx.Client] = {}
+_clients_pid: Optional[int] = None
+_lock = threading.Lock()
+
+# httpx.AsyncClient connections are bound to the event loop that opened them
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _get_host_key(base_url: str) -> str:
+    parsed = urlparse(base_url)
+    return f"{parsed.scheme}://{parsed.netloc}" if parsed.netloc else base_url
+
+
+def _http2_enabled() -> bool:
+    if not getattr(settings, "AUTH_HTTP2", False):
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logging.warning("AUTH_HTTP2 is enabled but the 'h2' package is not installed.")
+        return False
+    return True
+
+
+def get_timeout(base_url: str) -> float:
+    """
+    Timeout for `base_url`, from AUTH_HTTP_TIMEOUTS (keyed by hostname) or AUTH_HTTP_TIMEOUT.
+    """
+    timeouts = getattr(settings, "AUTH_HTTP_TIMEOUTS", {})
+    hostname = urlparse(base_url).hostname
+    if hostname in timeouts:
+        return timeouts[hostname]
+    return getattr(settings, "AUTH_HTTP_TIMEOUT", DEFAULT_TIMEOUT)
+
+
+def build_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=getattr(settings, "AUTH_HTTP_MAX_CONNECTIONS", 100),
+        max_keepalive_connections=getattr(settings, "AUTH_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20),
+        keepalive_expiry=getattr(settings, "AUTH_HTTP_KEEPALIVE_EXPIRY", 30),
+    )
+
+
+def get_http_client(base_url: str) -> httpx.Client:
+    """
+    Return the process-wide pooled client for the host of `base_url`.
+
+    Clients are shared between threads and must not be closed by callers. A
+    process created with fork() gets its own clients instead of the parent's
+    connections.
+    """
+    global _clients_pid
+
+    key = _get_host_key(base_url)
+    pid = os.getpid()
+    client = _clients.get(key)
+    if client is not None and _clients_pid == pid:
+        return client
+
+    with _lock:
+        if _clients_pid != pid:
+            # Sockets inherited from the parent must not be reused; drop them.
+            _clients.clear()
+            _clients_pid = pid
+
+        client = _clients.get(key)
+        if client is None:
+            client = httpx.Client(
+                timeout=get_timeout(base_url),
+                limits=build_limits(),
+                http2=_http2_enabled(),
+            )
+            _clients[key] = client
+        return client
+
+
+async def _aclose_async_clients(loop):
+    for client in _async_clients.pop(loop, {}).values():
+        await client.aclose()
+
+
+def get_async_http_client(base_url: str) -> httpx.AsyncClient:
+    """
+    Async counterpart of `get_http_client`, one pool per host and event loop.
+    The clients of a loop are closed when it shuts down.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = _async_clients[loop] = {}
+        on_loop_shutdown(partial(_aclose_async_clients, loop))
+    key = _get_host_key(base_url)
+    client = clients.get(key)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=get_timeout(base_url),
+            limits=build_limits(),
+            http2=_http2_enabled(),
+        )
+        clients[key] = client
+    return client
+
+
+def close_http_clients():
+    """
+    Close every client owned by this process.
+    """
+    with _lock:
+        if _clients_pid == os.getpid():
+            for client in _clients.values():
+                client.close()
+        _clients.clear()
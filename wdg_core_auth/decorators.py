@@ -1,11 +1,13 @@
-import jwt
 from functools import wraps
-from django.http import JsonResponse
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpRequest, JsonResponse
 from jwt import ExpiredSignatureError, InvalidTokenError
-from django.conf import settings
+from . import metrics
 from .constants import PermissionOption
-from .selectors import FetchPermissionSelector
-from .utils import parse_verify_key
+from .exceptions import PermissionsUnavailable
+from .expressions import compile_expression
+from .middleware import get_request_permissions
+from .approval import averify_approval_token, verify_approval_token
 
 
 def is_permission_denied_or_needs_approval(permissions, codename):
@@ -109,74 +111,157 @@ def is_permission_denied_or_needs_approval_v3(permissions, codename):
         )
 
 
+def _get_request(args):
+    """
+    The request among a view's arguments: the first HttpRequest (or DRF Request,
+    which wraps one), so both function views and methods work.
+    """
+    for arg in args:
+        if isinstance(getattr(arg, "_request", arg), HttpRequest):
+            return arg
+    # Request-like objects that are neither: the argument after `self` for a method.
+    return args[1] if len(args) > 1 else args[0]
+
+
 def check_permission(required_permissions=None, required_type=PermissionOption.ALLOWED):
     """
     Decorator to check if the user has the required permission type.
+    - required_permissions: a codename, a list of codenames (all required) or an
+      expression such as `"order.read & (order.update | order.approve)"` or
+      `all_of("order.read", any_of("order.update", "order.approve"))`.
     - required_type: Can be PermissionOption.ALLOWED, PermissionOption.APPROVAL_REQUIRED, or PermissionOption.DENIED.
     """
 
-    def decorator(view_func):
-        @wraps(view_func)
-        def wrapped_view(*args, **kwargs):
-            request = args[1] if hasattr(args[0], "__class__") else args[0]
-
-            # TODO: Redis Cache to prevent hit the same endpoint
-            permissions = FetchPermissionSelector(request).fetch_permissions()
-
-            codename_to_check = required_permissions
+    # Parsed once here, not per request.
+    expression = (
+        compile_expression(required_permissions)
+        if required_permissions is not None
+        else None
+    )
+
+    def decide(request):
+        """
+        Return (error response, approval message, codenames needing approval);
+        the response is None unless the request is refused outright.
+        """
+        permissions = get_request_permissions(request)
+        permissions.get_snapshot()  # fetched before the decision is timed
+
+        approval_required = []
+        with metrics.timer("wdg_permission_decision_seconds", source="decorator") as timer:
             try:
-                message = is_permission_denied_or_needs_approval_v3(
-                    permissions, codename_to_check
-                )
-                # TODO: will remove after testing
-                if message:
-                    print(message)  # approval_required case
+                if expression is None:
+                    message = permissions.check(required_permissions)
                 else:
-                    print("Permission is allowed.")
-
+                    result = permissions.evaluate_expression(expression)
+                    message = result.check()
+                    approval_required = result.approval
             except PermissionError as e:
-                return JsonResponse({"detail": str(e)}, status=403)
+                timer.labels["outcome"] = PermissionOption.DENIED
+                return JsonResponse({"detail": str(e)}, status=403), None, []
+            except PermissionsUnavailable as e:
+                # Auth service down and nothing to fall back to: fail fast with a 503.
+                timer.labels["outcome"] = "unavailable"
+                return JsonResponse({"detail": str(e.detail)}, status=e.status_code), None, []
+            timer.labels["outcome"] = (
+                PermissionOption.APPROVAL_REQUIRED if message else PermissionOption.ALLOWED
+            )
+        return None, message, approval_required
+
+    def get_approval_token(request):
+        return request.headers.get("X-Approval-Token") or request.META.get(
+            "HTTP_X_APPROVAL_TOKEN"
+        )
 
-            if message:
-                token = request.headers.get("X-Approval-Token") or request.META.get(
-                    "HTTP_X_APPROVAL_TOKEN"
+    def approve(request, payload, approval_required):
+        """
+        Return an error response unless the verified approval `payload` covers
+        the codenames that need approval.
+        """
+        request.user_payload = payload  # Attach to request
+
+        # Only the codenames that actually need approval
+        required = approval_required
+        if required:
+            user_permissions = payload.get("permissions", [])
+            # To check if permission not matching
+            missing_perms = [
+                perm for perm in required if perm not in user_permissions
+            ]
+
+            if missing_perms:
+                return JsonResponse(
+                    {
+                        "detail": f"Missing permissions: {', '.join(missing_perms)}"
+                    },
+                    status=403,
                 )
+        return None
+
+    def authorize(request):
+        """
+        Return an error response, or None when the request may proceed.
+        """
+        response, message, approval_required = decide(request)
+        if response is not None or not message:
+            return response
+
+        token = get_approval_token(request)
+        if not token:
+            return JsonResponse({"detail": "Approval token required."}, status=401)
+
+        try:
+            payload = verify_approval_token(token)
+        except ExpiredSignatureError:
+            return JsonResponse({"detail": "Token expired."}, status=401)
+        except InvalidTokenError:
+            return JsonResponse({"detail": "Invalid token."}, status=401)
+        return approve(request, payload, approval_required)
+
+    async def aauthorize(request):
+        """
+        Async `authorize`: the snapshot and the approval token are loaded
+        without blocking the event loop; the decision itself is memory-only.
+        """
+        await get_request_permissions(request).aget_snapshot()
+        response, message, approval_required = decide(request)
+        if response is not None or not message:
+            return response
+
+        token = get_approval_token(request)
+        if not token:
+            return JsonResponse({"detail": "Approval token required."}, status=401)
+
+        try:
+            payload = await averify_approval_token(token)
+        except ExpiredSignatureError:
+            return JsonResponse({"detail": "Token expired."}, status=401)
+        except InvalidTokenError:
+            return JsonResponse({"detail": "Invalid token."}, status=401)
+        return approve(request, payload, approval_required)
+
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+
+            @wraps(view_func)
+            async def async_wrapped_view(*args, **kwargs):
+                request = _get_request(args)
+
+                response = await aauthorize(request)
+                if response is not None:
+                    return response
+
+                return await view_func(*args, **kwargs)
+
+            return async_wrapped_view
+
+        @wraps(view_func)
+        def wrapped_view(*args, **kwargs):
+            request = _get_request(args)
 
-                if not token:
-                    return JsonResponse(
-                        {"detail": "Approval token required."}, status=401
-                    )
-
-                try:
-                    public_key = parse_verify_key(settings.JWT_VERIFYING_KEY)
-
-                    payload = jwt.decode(token, public_key, algorithms=["RS256"])
-                    request.user_payload = payload  # Attach to request
-
-                    # Normalize permissions into a list
-                    required = required_permissions
-                    if required:
-                        if isinstance(required, str):
-                            required = [required]
-
-                        user_permissions = payload.get("permissions", [])
-                        # To check if permission not matching
-                        missing_perms = [
-                            perm for perm in required if perm not in user_permissions
-                        ]
-
-                        if missing_perms:
-                            return JsonResponse(
-                                {
-                                    "detail": f"Missing permissions: {', '.join(missing_perms)}"
-                                },
-                                status=403,
-                            )
-
-                except ExpiredSignatureError:
-                    return JsonResponse({"detail": "Token expired."}, status=401)
-                except InvalidTokenError:
-                    return JsonResponse({"detail": "Invalid token."}, status=401)
+            response = authorize(request)
+            if response is not None:
+                return response
 
             # return view_func(request, *args, **kwargs)
             return view_func(*args, **kwargs)
@@ -0,0 +1,13 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PermissionsUnavailable(APIException):
+    """
+    The caller's permissions could not be loaded (auth service down or
+    refusing, nothing to fall back to).
+    """
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Permissions are unavailable. Please try again later."
+    default_code = "permissions_unavailable"
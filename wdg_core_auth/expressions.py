@@ -0,0 +1,246 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .constants import PermissionOption
+
+ALL_OF = "all_of"
+ANY_OF = "any_of"
+
+_TOKEN_RE = re.compile(r"\s*(\(|\)|&|\||[^\s()&|]+)")
+_OPERATORS = {"&": ALL_OF, "and": ALL_OF, "|": ANY_OF, "or": ANY_OF}
+
+
+def all_of(*terms) -> Dict[str, List[Any]]:
+    """
+    Every term must be granted.
+    """
+    return {ALL_OF: list(terms)}
+
+
+def any_of(*terms) -> Dict[str, List[Any]]:
+    """
+    At least one term must be granted.
+    """
+    return {ANY_OF: list(terms)}
+
+
+class ExpressionResult:
+    """
+    Outcome of a permission expression.
+
+    `approval` lists the codenames that need an approval token for the request to
+    proceed; `denied` and `missing` explain a denial.
+    """
+
+    __slots__ = ("outcome", "approval", "denied", "missing")
+
+    def __init__(self, outcome: str, approval=(), denied=(), missing=()):
+        self.outcome = outcome
+        self.approval = list(dict.fromkeys(approval))
+        self.denied = list(dict.fromkeys(denied))
+        self.missing = list(dict.fromkeys(missing))
+
+    @property
+    def allowed(self) -> bool:
+        return self.outcome == PermissionOption.ALLOWED
+
+    def check(self) -> Optional[str]:
+        """
+        Same contract as `PermissionIndex.check`: raise PermissionError when
+        denied, return a message when approval is required, None when allowed.
+        """
+        if self.outcome == PermissionOption.DENIED:
+            if self.denied:
+                raise PermissionError(
+                    f"Access denied for permission: {', '.join(self.denied)}"
+                )
+            raise PermissionError(
+                f"Permission {', '.join(self.missing)} not found. Access denied by default."
+            )
+        if self.outcome == PermissionOption.APPROVAL_REQUIRED:
+            return f"Permission {', '.join(self.approval)} approval required before proceeding."
+        return None
+
+
+class CompiledExpression:
+    """
+    A permission expression compiled once (e.g. at decoration time).
+
+    `evaluate` resolves every referenced codename in a single
+    `PermissionSnapshot.evaluate` call, then folds the tree in memory.
+    """
+
+    def __init__(self, tree: Tuple, source: Any = None):
+        self.tree = tree
+        self.source = source
+        self.codenames = tuple(dict.fromkeys(_leaves(tree)))
+
+    def __repr__(self):
+        return f"<CompiledExpression {self.source!r}>"
+
+    def evaluate(self, snapshot) -> ExpressionResult:
+        denied, approval, missing = snapshot.evaluate(self.codenames)
+        states = dict.fromkeys(self.codenames, PermissionOption.ALLOWED)
+        states.update(dict.fromkeys(approval, PermissionOption.APPROVAL_REQUIRED))
+        states.update(dict.fromkeys(missing, None))
+        states.update(dict.fromkeys(denied, PermissionOption.DENIED))
+        return ExpressionResult(*_fold(self.tree, states))
+
+    def check(self, snapshot) -> Optional[str]:
+        return self.evaluate(snapshot).check()
+
+
+def _leaves(tree: Tuple) -> Iterable[str]:
+    if tree[0] is None:
+        yield tree[1]
+        return
+    for child in tree[1]:
+        yield from _leaves(child)
+
+
+def _fold(tree: Tuple, states: Dict[str, Optional[str]]):
+    """
+    Return (outcome, approval, denied, missing) for `tree`.
+    """
+    op, value = tree
+    if op is None:
+        state = states[value]
+        if state is None:
+            return PermissionOption.DENIED, (), (), (value,)
+        if state == PermissionOption.DENIED:
+            return PermissionOption.DENIED, (), (value,), ()
+        if state == PermissionOption.APPROVAL_REQUIRED:
+            return PermissionOption.APPROVAL_REQUIRED, (value,), (), ()
+        return PermissionOption.ALLOWED, (), (), ()
+
+    results = [_fold(child, states) for child in value]
+    failed = [r for r in results if r[0] == PermissionOption.DENIED]
+    pending = [r for r in results if r[0] == PermissionOption.APPROVAL_REQUIRED]
+
+    if op == ALL_OF:
+        if failed:
+            return (
+                PermissionOption.DENIED,
+                (),
+                sum((r[2] for r in failed), ()),
+                sum((r[3] for r in failed), ()),
+            )
+        if pending:
+            return PermissionOption.APPROVAL_REQUIRED, sum((r[1] for r in pending), ()), (), ()
+        return PermissionOption.ALLOWED, (), (), ()
+
+    # ANY_OF: one granted term is enough; otherwise the first term that an
+    # approval can unlock.
+    if len(failed) + len(pending) < len(results):
+        return PermissionOption.ALLOWED, (), (), ()
+    if pending:
+        return pending[0]
+    return (
+        PermissionOption.DENIED,
+        (),
+        sum((r[2] for r in failed), ()),
+        sum((r[3] for r in failed), ()),
+    )
+
+
+def _build(spec: Any) -> Tuple:
+    if isinstance(spec, str):
+        return parse_expression(spec).tree
+    if isinstance(spec, CompiledExpression):
+        return spec.tree
+    if isinstance(spec, dict) and len(spec) == 1:
+        ((op, terms),) = spec.items()
+        if op in (ALL_OF, ANY_OF) and isinstance(terms, (list, tuple, set)):
+            return _group(op, [_build(term) for term in terms])
+    if isinstance(spec, (list, tuple, set)):
+        return _group(ALL_OF, [_build(term) for term in spec])
+    raise ValueError(f"Invalid permission expression: {spec!r}")
+
+
+def _group(op: str, children: List[Tuple]) -> Tuple:
+    if not children:
+        raise ValueError(f"Empty {op} permission expression.")
+    if len(children) == 1:
+        return children[0]
+    flattened = []
+    for child in children:
+        # all_of(a, all_of(b, c)) == all_of(a, b, c)
+        flattened.extend(child[1] if child[0] == op else [child])
+    return (op, tuple(flattened))
+
+
+def parse_expression(text: str) -> CompiledExpression:
+    """
+    Parse `"a & (b | c)"` (or `"a and (b or c)"`) into a CompiledExpression.
+
+    `&` binds tighter than `|`. A plain codename is a valid expression.
+    """
+    tokens = []
+    position = 0
+    text_length = len(text.rstrip())
+    while position < text_length:
+        match = _TOKEN_RE.match(text, position)
+        if match is None:
+            raise ValueError(f"Invalid permission expression: {text!r}")
+        token = match.group(1)
+        # Operators become 1-tuples so a codename can never be mistaken for one.
+        operator = _OPERATORS.get(token.lower())
+        tokens.append((operator,) if operator else token)
+        position = match.end()
+
+    tokens.append(None)
+    position = 0
+
+    def peek():
+        return tokens[position]
+
+    def take():
+        nonlocal position
+        token = tokens[position]
+        position += 1
+        return token
+
+    def parse_any():
+        children = [parse_all()]
+        while peek() == (ANY_OF,):
+            take()
+            children.append(parse_all())
+        return _group(ANY_OF, children)
+
+    def parse_all():
+        children = [parse_term()]
+        while peek() == (ALL_OF,):
+            take()
+            children.append(parse_term())
+        return _group(ALL_OF, children)
+
+    def parse_term():
+        token = take()
+        if token == "(":
+            tree = parse_any()
+            if take() != ")":
+                raise ValueError(f"Unbalanced parentheses in permission expression: {text!r}")
+            return tree
+        if token is None or token == ")" or isinstance(token, tuple):
+            raise ValueError(f"Invalid permission expression: {text!r}")
+        return (None, token)
+
+    tree = parse_any()
+    if peek() is not None:
+        raise ValueError(f"Invalid permission expression: {text!r}")
+    return CompiledExpression(tree, source=text)
+
+
+def compile_expression(spec: Any) -> CompiledExpression:
+    """
+    Compile a permission requirement into a CompiledExpression.
+
+    Accepted forms:
+    - `"product.read"` or `"product.read & (product.update | product.approve)"`
+    - a list/tuple/set of terms: all of them are required
+    - `all_of(...)` / `any_of(...)`, i.e. `{"all_of": [...]}` / `{"any_of": [...]}`,
+      nested freely
+    """
+    if isinstance(spec, CompiledExpression):
+        return spec
+    return CompiledExpression(_build(spec), source=spec)
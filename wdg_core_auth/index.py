@@ -0,0 +1,227 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from .constants import PermissionOption
+
+PERMISSION_TYPES = (
+    PermissionOption.ALLOWED,
+    PermissionOption.DENIED,
+    PermissionOption.APPROVAL_REQUIRED,
+)
+# Types the v1/v2 evaluators stop at; any other match lets their search go on.
+LEGACY_OUTCOMES = (PermissionOption.DENIED, PermissionOption.APPROVAL_REQUIRED)
+
+
+# Inheritance modes for PermissionIndex.from_permissions
+INHERIT_DENY = "deny"  # a denied node denies all its descendants
+INHERIT_APPROVAL = "approval"  # descendants of an approval-required node need approval too
+INHERITANCE_MODES = (INHERIT_DENY, INHERIT_APPROVAL)
+
+WILDCARD = "*"
+SEPARATOR = "."
+
+
+def is_wildcard(codename: str) -> bool:
+    return codename == WILDCARD or codename.endswith(SEPARATOR + WILDCARD)
+
+
+class CodenameTrie:
+    """
+    Wildcard grants (`product.*`, `*`) keyed by dotted codename segments.
+
+    `product.*` covers `product.read` and `product.variant.read`, not `product`.
+    A lookup visits at most one node per segment, whatever the tree size.
+    """
+
+    __slots__ = ("_root", "_size")
+
+    def __init__(self):
+        self._root: Dict[Optional[str], Any] = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, pattern: str, perm_type: str):
+        node = self._root
+        prefix = pattern[: -len(WILDCARD)].rstrip(SEPARATOR)
+        for segment in prefix.split(SEPARATOR) if prefix else ():
+            node = node.setdefault(segment, {})
+        if None not in node:  # first occurrence wins, like exact codenames
+            node[None] = perm_type
+            self._size += 1
+
+    def lookup(self, codename: str) -> Optional[str]:
+        """
+        Type of the most specific wildcard covering `codename`, if any.
+        """
+        node = self._root
+        perm_type = node.get(None)
+        for segment in codename.split(SEPARATOR)[:-1]:
+            node = node.get(segment)
+            if node is None:
+                break
+            perm_type = node.get(None, perm_type)
+        return perm_type
+
+
+class PermissionIndex:
+    """
+    Flattened, read-only view of a permission tree returned by `fetch_permissions()`.
+
+    The tree is walked once (pre-order, like the recursive evaluators) and every
+    codename is mapped to the type of its first occurrence, so lookups are O(1).
+    Wildcard grants (`product.*`) go to a CodenameTrie; an exact codename always
+    beats a wildcard, and a longer wildcard beats a shorter one.
+
+    With `inheritance`, types flow down `children` during that same walk, so the
+    resulting table already holds effective types and checks never recurse.
+    """
+
+    V1 = 1  # not found -> allowed
+    V2 = 2  # not found or allowed -> denied ("not found")
+    V3 = 3  # not found -> denied, nodes with an unknown type are skipped
+
+    def __init__(
+        self,
+        entries: Dict[str, Any],
+        typed_entries: Dict[str, str],
+        wildcards: Optional[CodenameTrie] = None,
+    ):
+        self._entries = entries
+        self._typed_entries = typed_entries
+        self._wildcards = wildcards if wildcards else None
+
+    @classmethod
+    def from_permissions(
+        cls,
+        permissions: Optional[Iterable[Dict[str, Any]]],
+        inheritance: Iterable[str] = (),
+    ):
+        if permissions is None:
+            raise ValueError("Permissions list cannot be None.")
+
+        inheritance = frozenset(inheritance)
+        unknown = inheritance.difference(INHERITANCE_MODES)
+        if unknown:
+            raise ValueError(f"Unknown permission inheritance mode(s): {', '.join(sorted(unknown))}")
+        propagated = set()
+        if INHERIT_DENY in inheritance:
+            propagated.add(PermissionOption.DENIED)
+        if INHERIT_APPROVAL in inheritance:
+            propagated.add(PermissionOption.APPROVAL_REQUIRED)
+
+        entries = {}
+        typed_entries = {}
+        wildcards = CodenameTrie()
+        # The v1/v2 searches stop scanning a sibling list at its first match and
+        # never descend into a match, so later occurrences of that codename in
+        # the list (or below the match) are unreachable: `blocked` counts the
+        # codenames matched in the sibling lists currently on the stack.
+        blocked: Dict[str, int] = {}
+        # (children iterator, type inherited from the parent, codenames matched)
+        stack: List[Any] = [(iter(permissions), None, [])]
+
+        while stack:
+            siblings, inherited, matched = stack[-1]
+            perm = next(siblings, StopIteration)
+            if perm is StopIteration:
+                stack.pop()
+                for codename in matched:
+                    blocked[codename] -= 1
+                continue
+            if perm is None:
+                continue
+
+            perm_type = perm.get("type")
+            if inherited == PermissionOption.DENIED or (
+                inherited == PermissionOption.APPROVAL_REQUIRED
+                and perm_type != PermissionOption.DENIED
+            ):
+                perm_type = inherited
+
+            codename = perm.get("codename")
+            if codename is not None:
+                if not blocked.get(codename):
+                    matched.append(codename)
+                    blocked[codename] = blocked.get(codename, 0) + 1
+                    # A denied/approval match ends the search, any other goes on.
+                    if entries.get(codename) not in LEGACY_OUTCOMES:
+                        entries[codename] = perm_type
+                if perm_type in PERMISSION_TYPES:
+                    typed_entries.setdefault(codename, perm_type)
+                    if is_wildcard(codename):
+                        wildcards.insert(codename, perm_type)
+
+            children = perm.get("children")
+            if children:
+                stack.append(
+                    (iter(children), perm_type if perm_type in propagated else None, [])
+                )
+
+        return cls(entries, typed_entries, wildcards)
+
+    @property
+    def typed_entries(self) -> Dict[str, str]:
+        """
+        Codename -> effective type for entries with a known type (the v3 view).
+        """
+        return self._typed_entries
+
+    @property
+    def has_wildcards(self) -> bool:
+        return self._wildcards is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, codename):
+        return codename in self._entries
+
+    def get_type(self, codename: str, version: int = V3) -> Optional[str]:
+        """
+        Return the permission type of `codename`, or None if it is not present.
+
+        For V1/V2 that is the type of the match their search stops at.
+        """
+        if version == self.V3:
+            perm_type = self._typed_entries.get(codename)
+            if perm_type is not None or self._wildcards is None:
+                return perm_type
+        elif codename in self._entries or self._wildcards is None:
+            return self._entries.get(codename)
+        return self._wildcards.lookup(codename)
+
+    def check(self, codename: str, version: int = V3) -> Optional[str]:
+        """
+        Same outcome as `is_permission_denied_or_needs_approval[_v2|_v3]` on the
+        indexed tree, selected by `version`.
+
+        Raises PermissionError when access is denied, returns a message when an
+        approval is required and None when the permission is allowed.
+
+        V1 and V2 keep the legacy search quirks: an allowed match does not end
+        the search (a later reachable denied or approval-required occurrence
+        wins), and V2 reports an allowed codename as "not found". Beyond the
+        legacy functions, wildcard grants apply to codenames absent from the
+        tree and AUTH_PERMISSION_INHERITANCE, when set, is applied first.
+        """
+        if codename is None:
+            raise ValueError("Permissions list and codename cannot be None.")
+        return self.decide(codename, self.get_type(codename, version), version)
+
+    @classmethod
+    def decide(cls, codename: str, perm_type: Optional[str], version: int = V3) -> Optional[str]:
+        """
+        Turn the type found for `codename` into the evaluators' outcome.
+        """
+        if perm_type == PermissionOption.DENIED:
+            raise PermissionError(f"Access denied for permission: {codename}")
+        if perm_type == PermissionOption.APPROVAL_REQUIRED:
+            if version == cls.V1:
+                return f"Permission {codename} Approval required before proceeding."
+            return f"Permission {codename} approval required before proceeding."
+        if version == cls.V2 or (perm_type is None and version == cls.V3):
+            raise PermissionError(
+                f"Permission {codename} not found. Access denied by default."
+            )
+        return None
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import redis
+from django.conf import settings
+
+from wdg_core_auth.cache import LocalCache
+from wdg_core_auth.utils import (
+    delete_keys_matching,
+    delete_tagged_keys,
+    get_redis_client,
+)
+
+DEFAULT_CHANNEL = "permissions:invalidate"
+CACHE_KEY_PATTERN = "permissions:*"
+
+_local_caches: List[LocalCache] = []
+# caches shared with the other processes on the host (see `wdg_core_auth.shm`)
+_host_wide_caches: List[Any] = []
+_listener: Optional["InvalidationListener"] = None
+_listener_lock = threading.Lock()
+
+
+def get_channel() -> str:
+    return getattr(settings, "AUTH_PERMISSION_INVALIDATION_CHANNEL", DEFAULT_CHANNEL)
+
+
+def user_tag(user_id) -> str:
+    return f"user:{user_id}"
+
+
+def role_tag(role) -> str:
+    return f"role:{role}"
+
+
+def register_local_cache(cache: LocalCache, host_wide: bool = False):
+    """
+    Register a cache to be evicted when invalidations arrive. `host_wide`
+    marks a cache shared with the other processes on the host.
+    """
+    caches = _host_wide_caches if host_wide else _local_caches
+    if cache not in caches:
+        caches.append(cache)
+
+
+def unregister_local_cache(cache: LocalCache):
+    for caches in (_local_caches, _host_wide_caches):
+        if cache in caches:
+            caches.remove(cache)
+
+
+def evict_local(message: Dict[str, Any], process_only: bool = False):
+    """
+    Apply an invalidation message to every registered cache, or only to this
+    process's own caches if `process_only` is set.
+    """
+    caches = _local_caches if process_only else _local_caches + _host_wide_caches
+    for cache in caches:
+        if message.get("all"):
+            cache.clear()
+            continue
+        if message.get("user_id") is not None:
+            cache.delete_tagged(user_tag(message["user_id"]))
+        if message.get("role") is not None:
+            cache.delete_tagged(role_tag(message["role"]))
+
+
+def invalidate_permissions(user_id=None, role=None, everything: bool = False):
+    """
+    Invalidate cached permissions by user id, by role, or all of them.
+
+    Redis entries are deleted here; every worker running an InvalidationListener
+    evicts its in-process entries when it receives the published message.
+    """
+    if user_id is None and role is None and not everything:
+        raise ValueError("Provide user_id, role or everything=True.")
+
+    message = {"user_id": user_id, "role": role, "all": everything}
+
+    if everything:
+        delete_keys_matching(CACHE_KEY_PATTERN)
+    else:
+        if user_id is not None:
+            delete_tagged_keys(user_tag(user_id))
+        if role is not None:
+            delete_tagged_keys(role_tag(role))
+
+    evict_local(message)
+
+    try:
+        get_redis_client().publish(get_channel(), json.dumps(message))
+    except redis.RedisError as e:
+        logging.error(f"Failed to publish permission invalidation: {e}")
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Daemon thread subscribed to the invalidation channel of the current process.
+    """
+
+    RETRY_DELAY = 1
+    MAX_RETRY_DELAY = 30
+
+    def __init__(self, channel: str):
+        super().__init__(name="wdg-core-auth-invalidation", daemon=True)
+        self.channel = channel
+        self.pid = os.getpid()
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def handle(self, data):
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            logging.warning(f"Ignoring malformed permission invalidation: {data!r}")
+            return
+        evict_local(message)
+
+    def run(self):
+        delay = self.RETRY_DELAY
+        while not self._stopped.is_set():
+            pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # Anything cached before (re)subscribing may have missed a message.
+                # Not the host-wide cache: every worker subscribes at start-up and
+                # its entries expire within AUTH_PERMISSION_SHARED_CACHE_TTL.
+                evict_local({"all": True}, process_only=True)
+                delay = self.RETRY_DELAY
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "message":
+                        self.handle(message["data"])
+            except redis.RedisError as e:
+                logging.error(f"Permission invalidation listener error: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, self.MAX_RETRY_DELAY)
+            finally:
+                try:
+                    pubsub.close()
+                except redis.RedisError:
+                    pass
+
+
+def start_invalidation_listener() -> Optional[InvalidationListener]:
+    """
+    Start the listener for the current process if enabled and not already running.
+
+    Safe to call on every request: a listener inherited through fork() is
+    replaced by one owned by the child process.
+    """
+    global _listener
+
+    if not getattr(settings, "AUTH_PERMISSION_INVALIDATION_ENABLED", True):
+        return None
+
+    listener = _listener
+    if listener is not None and listener.pid == os.getpid() and listener.is_alive():
+        return listener
+
+    with _listener_lock:
+        if _listener is None or _listener.pid != os.getpid() or not _listener.is_alive():
+            _listener = InvalidationListener(get_channel())
+            _listener.start()
+        return _listener
@@ -0,0 +1,172 @@
+import json
+import logging
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional, Sequence
+
+import httpx
+import jwt
+from django.conf import settings
+from django.core.signals import setting_changed
+from jwt.algorithms import RSAAlgorithm
+
+from wdg_core_auth.clients import get_http_client
+from wdg_core_auth.utils import parse_verify_key
+
+DEFAULT_ALGORITHMS = ("RS256",)
+KEY_SETTINGS = (
+    "JWT_VERIFYING_KEY",
+    "JWT_VERIFYING_KEYS",
+    "JWT_JWKS_FILE",
+    "JWT_JWKS_URL",
+    "JWT_JWKS_REFRESH_INTERVAL",
+)
+
+
+@lru_cache(maxsize=32)
+def load_pem_key(pem: str):
+    """
+    Deserialize a PEM public key (with literal `\\n` allowed) into a key object.
+    Results are cached per PEM string.
+    """
+    return RSAAlgorithm(RSAAlgorithm.SHA256).prepare_key(parse_verify_key(pem))
+
+
+class KeyProvider:
+    """
+    Loads JWT verification keys once and caches the deserialized key objects.
+
+    Keys come from, in order of precedence:
+    - JWT_JWKS_URL / JWT_JWKS_FILE: a JWKS document, keyed by `kid`, reloaded
+      every JWT_JWKS_REFRESH_INTERVAL seconds or when an unknown `kid` shows up
+    - JWT_VERIFYING_KEYS: a `{kid: pem}` mapping
+    - JWT_VERIFYING_KEY: the default key for tokens without a `kid`
+    """
+
+    MIN_REFRESH_INTERVAL = 60  # seconds between reloads triggered by unknown kids
+
+    def __init__(self):
+        self._keys: Dict[Optional[str], Any] = {}
+        self._loaded_at: Optional[float] = None
+        self._refresh_interval: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _load_jwks(self) -> Dict[Optional[str], Any]:
+        jwks_url = getattr(settings, "JWT_JWKS_URL", None)
+        jwks_file = getattr(settings, "JWT_JWKS_FILE", None)
+
+        if jwks_url:
+            response = get_http_client(jwks_url).get(jwks_url)
+            response.raise_for_status()
+            data = response.json()
+        elif jwks_file:
+            with open(jwks_file, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        else:
+            return {}
+
+        keys = {}
+        for jwk in jwt.PyJWKSet.from_dict(data).keys:
+            keys[jwk.key_id] = jwk.key
+        return keys
+
+    def _load(self) -> Dict[Optional[str], Any]:
+        keys: Dict[Optional[str], Any] = {}
+
+        default_key = getattr(settings, "JWT_VERIFYING_KEY", None)
+        if default_key:
+            keys[None] = load_pem_key(default_key)
+
+        for kid, pem in getattr(settings, "JWT_VERIFYING_KEYS", {}).items():
+            keys[kid] = load_pem_key(pem)
+
+        try:
+            keys.update(self._load_jwks())
+        except (OSError, ValueError, httpx.HTTPError, jwt.PyJWKSetError) as e:
+            logging.error(f"Failed to load JWKS: {e}")
+            # Keep serving the previously loaded JWKS keys.
+            keys = {**self._keys, **keys}
+
+        return keys
+
+    def _needs_refresh(self, now: float) -> bool:
+        if self._loaded_at is None:
+            return True
+        return self._refresh_interval is not None and now - self._loaded_at >= self._refresh_interval
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if force or self._needs_refresh(now):
+                self._keys = self._load()
+                self._loaded_at = now
+                has_jwks = getattr(settings, "JWT_JWKS_URL", None) or getattr(
+                    settings, "JWT_JWKS_FILE", None
+                )
+                self._refresh_interval = (
+                    getattr(settings, "JWT_JWKS_REFRESH_INTERVAL", 3600) if has_jwks else None
+                )
+
+    def get_key(self, kid: Optional[str] = None):
+        if self._needs_refresh(time.monotonic()):
+            self.refresh()
+
+        key = self._keys.get(kid)
+        if key is None and kid is not None:
+            # Possibly a rotated key: reload, but not more often than MIN_REFRESH_INTERVAL.
+            if time.monotonic() - (self._loaded_at or 0) >= self.MIN_REFRESH_INTERVAL:
+                self.refresh(force=True)
+                key = self._keys.get(kid)
+        if key is None and kid is not None and len(self._keys) == 1:
+            key = self._keys.get(None)  # single configured key, token names its kid
+        return key
+
+    def decode(
+        self,
+        token: str,
+        algorithms: Sequence[str] = DEFAULT_ALGORITHMS,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """
+        Verify `token` with the cached key matching its `kid` header.
+
+        Raises jwt.InvalidTokenError (or a subclass) like `jwt.decode`.
+        """
+        if self._needs_refresh(time.monotonic()):
+            self.refresh()
+
+        if len(self._keys) == 1 and None in self._keys and self._refresh_interval is None:
+            key = self._keys[None]  # only one key: no need to read the header
+        else:
+            kid = jwt.get_unverified_header(token).get("kid")
+            key = self.get_key(kid)
+            if key is None:
+                raise jwt.InvalidTokenError(f"No verification key found for kid {kid!r}.")
+        return jwt.decode(token, key, algorithms=list(algorithms), **kwargs)
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._loaded_at = None
+            self._refresh_interval = None
+
+
+_provider = KeyProvider()
+
+
+def get_key_provider() -> KeyProvider:
+    return _provider
+
+
+def decode_token(token: str, algorithms: Sequence[str] = DEFAULT_ALGORITHMS, **kwargs):
+    return _provider.decode(token, algorithms=algorithms, **kwargs)
+
+
+def _reset_keys(setting, **kwargs):
+    if setting in KEY_SETTINGS:
+        load_pem_key.cache_clear()
+        _provider.clear()
+
+
+setting_changed.connect(_reset_keys)
@@ -0,0 +1,50 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.conf import settings
+
+from .constants import PermissionOption, PermissionType
+from .index import PermissionIndex
+
+
+def get_kind_field() -> str:
+    """
+    Node attribute holding the PermissionType (`menu` / `permission`).
+    """
+    return getattr(settings, "AUTH_PERMISSION_KIND_FIELD", "permission_type")
+
+
+def build_effective_menu(
+    permissions: Optional[Iterable[Dict[str, Any]]],
+    index: PermissionIndex,
+    kind_field: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Project a permission tree onto the menus the user can see.
+
+    Only PermissionType.MENU nodes are kept, with their effective type from
+    `index`. Denied menus are dropped together with their submenus, and menus
+    nested under non-menu nodes are lifted to the nearest kept menu.
+    """
+    kind_field = kind_field or get_kind_field()
+
+    def project(nodes) -> List[Dict[str, Any]]:
+        menu = []
+        for node in nodes or ():
+            if node is None:
+                continue
+            children = node.get("children")
+            if node.get(kind_field) != PermissionType.MENU:
+                menu.extend(project(children))
+                continue
+
+            perm_type = index.get_type(node.get("codename"))
+            if perm_type is None or perm_type == PermissionOption.DENIED:
+                continue
+
+            item = {key: value for key, value in node.items() if key != "children"}
+            item["type"] = perm_type
+            item["children"] = project(children)
+            menu.append(item)
+        return menu
+
+    return project(permissions)
@@ -0,0 +1,370 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+GAUGE = "gauge"
+
+# name -> (type, help)
+METRICS = {
+    "wdg_permission_cache_total": (
+        COUNTER, "Permission snapshot lookups by cache layer and result."
+    ),
+    "wdg_permission_cache_read_seconds": (
+        HISTOGRAM, "Time to read a snapshot from a cache layer."
+    ),
+    "wdg_permission_decode_seconds": (HISTOGRAM, "Time to decode a cached entry."),
+    "wdg_permission_fetch_seconds": (
+        HISTOGRAM, "Time to fetch permissions from the auth service, by outcome."
+    ),
+    "wdg_permission_fetch_rejected_total": (
+        COUNTER, "Fetches not attempted because the circuit breaker is open."
+    ),
+    "wdg_permission_decision_seconds": (
+        HISTOGRAM, "Time to decide a guarded request, by source and outcome."
+    ),
+    "wdg_auth_token_cache_total": (COUNTER, "Verified-token cache lookups by result."),
+    "wdg_auth_approval_verify_seconds": (
+        HISTOGRAM, "Time to verify an approval token, by outcome."
+    ),
+}
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricsExporter:
+    """
+    Receives every measurement. Subclasses override `increment` and `observe`.
+    """
+
+    enabled = True
+
+    def increment(self, name: str, value: float, labels: Dict[str, Any]):
+        pass
+
+    def observe(self, name: str, value: float, labels: Dict[str, Any]):
+        pass
+
+
+class NoopExporter(MetricsExporter):
+    """
+    The default: instrumented code checks `enabled` and skips the measurement.
+    """
+
+    enabled = False
+
+
+class LoggingExporter(MetricsExporter):
+    """
+    Logs every measurement to the `wdg_core_auth.metrics` logger.
+    """
+
+    def __init__(self, level: int = logging.DEBUG):
+        self.logger = logging.getLogger("wdg_core_auth.metrics")
+        self.level = level
+
+    def increment(self, name, value, labels):
+        self.logger.log(self.level, f"{name} {labels} +{value}")
+
+    def observe(self, name, value, labels):
+        self.logger.log(self.level, f"{name} {labels} {value * 1000:.3f}ms")
+
+
+class CallbackExporter(MetricsExporter):
+    """
+    Calls `callback(kind, name, value, labels)`, kind being "counter" or "histogram".
+    """
+
+    def __init__(self, callback: Callable[[str, str, float, Dict[str, Any]], None]):
+        self.callback = callback
+
+    def increment(self, name, value, labels):
+        self.callback(COUNTER, name, value, labels)
+
+    def observe(self, name, value, labels):
+        self.callback(HISTOGRAM, name, value, labels)
+
+
+class PrometheusExporter(MetricsExporter):
+    """
+    Aggregates measurements in process and renders them, together with the
+    breaker and cache stats, in the Prometheus text format.
+
+    Every worker process keeps its own numbers: scrape each of them, or use a
+    callback exporter that feeds a multi-process client.
+    """
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        # (name, labels) -> [bucket counts..., sum, count]
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Labels]:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def increment(self, name, value, labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+
+        lines: List[str] = []
+        described = set()
+
+        def describe(name: str, kind: str, help_text: str = ""):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text or METRICS.get(name, ('', ''))[1]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, COUNTER)
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), values in sorted(histograms.items()):
+            describe(name, HISTOGRAM)
+            for bound, count in zip(self.buckets, values):
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {count}")
+            inf_labels = labels + (("le", "+Inf"),)
+            lines.append(f"{name}_bucket{_format_labels(inf_labels)} {values[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-2])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+
+        # Samples of one metric must be contiguous.
+        for name, kind, help_text, labels, value in sorted(collect_stats(), key=lambda s: s[0]):
+            describe(name, kind, help_text)
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def collect_stats() -> List[Tuple[str, str, str, Labels, float]]:
+    """
+    Current breaker and cache stats as (name, type, help, labels, value) samples.
+    """
+    from wdg_core_auth.approval import get_verified_cache
+    from wdg_core_auth.breaker import CLOSED, HALF_OPEN, OPEN, get_breaker_stats
+    from wdg_core_auth.selectors import FetchPermissionSelector
+    from wdg_core_auth.shm import get_shared_cache
+
+    samples = []
+    for host, stats in get_breaker_stats().items():
+        for state in (CLOSED, OPEN, HALF_OPEN):
+            samples.append((
+                "wdg_auth_breaker_state",
+                GAUGE,
+                "1 for the current state of the auth service circuit breaker.",
+                (("host", host), ("state", state)),
+                int(stats["state"] == state),
+            ))
+        for field in ("successes", "failures", "rejections", "times_opened"):
+            samples.append((
+                f"wdg_auth_breaker_{field}_total",
+                COUNTER,
+                f"Circuit breaker {field.replace('_', ' ')}.",
+                (("host", host),),
+                stats[field],
+            ))
+
+    caches = {
+        "local": FetchPermissionSelector._local_cache,
+        "snapshot": FetchPermissionSelector._snapshot_cache,
+        "negative": FetchPermissionSelector._negative_cache,
+        "last_good": FetchPermissionSelector._last_good_cache,
+        "approval_token": get_verified_cache(),
+    }
+    for cache_name, cache in caches.items():
+        if cache is None:
+            continue
+        for field, value in cache.stats().items():
+            kind = GAUGE if field in ("size", "maxsize") else COUNTER
+            samples.append((
+                f"wdg_local_cache_{field}" + ("_total" if kind == COUNTER else ""),
+                kind,
+                f"In-process cache {field}.",
+                (("cache", cache_name),),
+                value,
+            ))
+
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        for field, value in shared_cache.stats().items():
+            samples.append((
+                f"wdg_shared_cache_{field}_total",
+                COUNTER,
+                f"Shared-memory cache {field} in this process.",
+                (),
+                value,
+            ))
+    return samples
+
+
+class _Timer:
+    """
+    Context manager observing its duration; labels can still be set inside
+    the block (e.g. the outcome).
+    """
+
+    __slots__ = ("exporter", "name", "labels", "start")
+
+    def __init__(self, exporter: MetricsExporter, name: str, labels: Dict[str, Any]):
+        self.exporter = exporter
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.labels.setdefault("outcome", "error")
+        self.exporter.observe(self.name, time.perf_counter() - self.start, self.labels)
+
+
+class _NoopTimer:
+    __slots__ = ("labels",)
+
+    def __init__(self):
+        self.labels: Dict[str, Any] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.labels.clear()
+
+
+_exporter: Optional[MetricsExporter] = None
+_lock = threading.Lock()
+_noop_timer = _NoopTimer()
+
+
+def _build_exporter(setting: Any) -> MetricsExporter:
+    if setting in (None, "", "noop"):
+        return NoopExporter()
+    if setting == "logging":
+        return LoggingExporter()
+    if setting == "prometheus":
+        return PrometheusExporter(getattr(settings, "AUTH_METRICS_BUCKETS", DEFAULT_BUCKETS))
+    if isinstance(setting, str):
+        setting = import_string(setting)
+    if isinstance(setting, type):
+        setting = setting()
+    if isinstance(setting, MetricsExporter):
+        return setting
+    if callable(setting):
+        return CallbackExporter(setting)
+    raise ValueError(f"Invalid AUTH_METRICS_EXPORTER: {setting!r}")
+
+
+def get_exporter() -> MetricsExporter:
+    """
+    The exporter configured by AUTH_METRICS_EXPORTER: None/"noop" (default),
+    "logging", "prometheus", an exporter (class, instance or dotted path) or a
+    callback.
+    """
+    global _exporter
+
+    exporter = _exporter
+    if exporter is None:
+        with _lock:
+            if _exporter is None:
+                try:
+                    _exporter = _build_exporter(getattr(settings, "AUTH_METRICS_EXPORTER", None))
+                except (ImportError, ValueError) as e:
+                    logging.error(f"Metrics disabled: {e}")
+                    _exporter = NoopExporter()
+            exporter = _exporter
+    return exporter
+
+
+def set_exporter(exporter: Any):
+    """
+    Replace the exporter, e.g. `set_exporter(my_callback)`; None restores the setting.
+    """
+    global _exporter
+    with _lock:
+        _exporter = _build_exporter(exporter) if exporter is not None else None
+
+
+def increment(name: str, value: float = 1, **labels):
+    exporter = _exporter or get_exporter()
+    if exporter.enabled:
+        exporter.increment(name, value, labels)
+
+
+def observe(name: str, value: float, **labels):
+    exporter = _exporter or get_exporter()
+    if exporter.enabled:
+        exporter.observe(name, value, labels)
+
+
+def timer(name: str, **labels):
+    """
+    `with timer("wdg_permission_fetch_seconds") as t: ...; t.labels["outcome"] = "ok"`
+    """
+    exporter = _exporter or get_exporter()
+    if not exporter.enabled:
+        return _noop_timer
+    return _Timer(exporter, name, labels)
+
+
+def _reset_exporter(setting, **kwargs):
+    global _exporter
+    if setting in ("AUTH_METRICS_EXPORTER", "AUTH_METRICS_BUCKETS"):
+        _exporter = None
+
+
+setting_changed.connect(_reset_exporter)
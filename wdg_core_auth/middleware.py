@@ -0,0 +1,115 @@
+from typing import Iterable, List, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .exceptions import PermissionsUnavailable
+from .expressions import CompiledExpression, ExpressionResult
+from .index import PermissionIndex
+from .selectors import FetchPermissionSelector
+from .snapshot import PermissionSnapshot
+
+_UNSET = object()
+
+
+class RequestPermissions:
+    """
+    Request-scoped, lazily fetched permission snapshot.
+
+    The first access fetches (and decodes) the permissions through
+    FetchPermissionSelector; every later access in the same request is served
+    from memory. `fetch_count` and `hit_count` expose how often each happened.
+    """
+
+    selector_class = FetchPermissionSelector
+
+    def __init__(self, request):
+        self.request = request
+        self.fetch_count = 0
+        self.hit_count = 0
+        self._snapshot = _UNSET
+
+    def get_snapshot(self) -> Optional[PermissionSnapshot]:
+        if self._snapshot is _UNSET:
+            self.fetch_count += 1
+            self._snapshot = self.selector_class(self.request).fetch_snapshot()
+        else:
+            self.hit_count += 1
+        return self._snapshot
+
+    async def aget_snapshot(self) -> Optional[PermissionSnapshot]:
+        if self._snapshot is _UNSET:
+            self.fetch_count += 1
+            self._snapshot = await self.selector_class(self.request).afetch_snapshot()
+        else:
+            self.hit_count += 1
+        return self._snapshot
+
+    @property
+    def permissions(self):
+        snapshot = self.get_snapshot()
+        return snapshot.permissions if snapshot else None
+
+    def require_snapshot(self) -> PermissionSnapshot:
+        """
+        The snapshot, or PermissionsUnavailable (a 503) when it cannot be loaded.
+        """
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            raise PermissionsUnavailable()
+        return snapshot
+
+    @property
+    def index(self) -> PermissionIndex:
+        return self.require_snapshot().index
+
+    def check(self, codename: str, version: int = PermissionIndex.V3) -> Optional[str]:
+        return self.require_snapshot().check(codename, version)
+
+    def check_all(self, codenames: Iterable[str]) -> Optional[str]:
+        return self.require_snapshot().check_all(codenames)
+
+    def evaluate(self, codenames: Iterable[str]) -> Tuple[List[str], List[str], List[str]]:
+        return self.require_snapshot().evaluate(codenames)
+
+    def evaluate_expression(self, expression: CompiledExpression) -> ExpressionResult:
+        return expression.evaluate(self.require_snapshot())
+
+
+def get_request_permissions(request) -> RequestPermissions:
+    """
+    Return the RequestPermissions attached to `request`, attaching one if needed.
+
+    DRF requests are unwrapped so the decorator and the mixin share one snapshot.
+    """
+    http_request = getattr(request, "_request", request)
+    permissions = getattr(http_request, "permissions", None)
+    if not isinstance(permissions, RequestPermissions):
+        permissions = RequestPermissions(http_request)
+        http_request.permissions = permissions
+    return permissions
+
+
+class PermissionSnapshotMiddleware:
+    """
+    Attach a lazy `request.permissions` to every request.
+
+    Optional: `check_permission` and `ActionPermissionMixin` attach it on first use.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        get_request_permissions(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        get_request_permissions(request)
+        return await self.get_response(request)
@@ -1,13 +1,25 @@
-import jwt
-from django.conf import settings
 from django.http import JsonResponse
 from jwt import ExpiredSignatureError, InvalidTokenError
-from .decorators import is_permission_denied_or_needs_approval_v3
-from .utils import parse_verify_key
-from .selectors import FetchPermissionSelector
+from . import metrics
+from .middleware import get_request_permissions
+from .approval import verify_approval_token
+from .expressions import compile_expression
 
 class ActionPermissionMixin:
-    action_permissions = {}  # Define this in your view class
+    action_permissions = {}  # Define this in your view class; values may be expressions
+
+    @classmethod
+    def get_action_expression(cls, action):
+        """
+        Compiled expression for `action`, parsed once per view class.
+        """
+        compiled = cls.__dict__.get("_compiled_action_permissions")
+        if compiled is None:
+            compiled = {}
+            setattr(cls, "_compiled_action_permissions", compiled)
+        if action not in compiled:
+            compiled[action] = compile_expression(cls.action_permissions[action])
+        return compiled[action]
 
     def initial(self, request, *args, **kwargs):
         super().initial(request, *args, **kwargs)
@@ -18,10 +30,15 @@ class ActionPermissionMixin:
         if not codename:
             return  # Skip permission check if no codename specified
 
-        permissions = FetchPermissionSelector(request).fetch_permissions()
-        
+        permissions = get_request_permissions(request)
+        # Fetched before the decision is timed; PermissionsUnavailable is a 503.
+        permissions.require_snapshot()
+
         try:
-            message = is_permission_denied_or_needs_approval_v3(permissions, codename)
+            with metrics.timer("wdg_permission_decision_seconds", source="mixin") as timer:
+                result = permissions.evaluate_expression(self.get_action_expression(action))
+                timer.labels["outcome"] = result.outcome
+            message = result.check()
 
             if message:  # approval_required
                 token = request.headers.get("X-Approval-Token") or request.META.get(
@@ -33,14 +50,15 @@ class ActionPermissionMixin:
                         {"detail": "Approval token required."}, status=401
                     )
 
-                public_key = parse_verify_key(settings.JWT_VERIFYING_KEY)
-                
-                payload = jwt.decode(token, public_key, algorithms=["RS256"])
+                payload = verify_approval_token(token)
                 request.user_payload = payload
 
                 user_permissions = payload.get("permissions", [])
-                if codename not in user_permissions:
-                    return PermissionError(f"Missing permission: {codename}")
+                missing_perms = [
+                    perm for perm in result.approval if perm not in user_permissions
+                ]
+                if missing_perms:
+                    return PermissionError(f"Missing permission: {', '.join(missing_perms)}")
 
         except PermissionError as e:
             return JsonResponse({"detail": f"{str(e)}"}, status=401)
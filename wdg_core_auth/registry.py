@@ -0,0 +1,248 @@
+import logging
+import struct
+import threading
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import redis
+
+from wdg_core_auth.constants import PermissionOption
+from wdg_core_auth.index import INHERITANCE_MODES
+from wdg_core_auth.utils import get_redis_client
+
+# Kept outside the `permissions:*` namespace so `invalidate_permissions(everything=True)`
+# does not renumber codenames.
+REGISTRY_KEY = "permission-codenames"
+COUNTER_KEY = "permission-codenames:next"
+GENERATION_KEY = "permission-codenames:generation"
+
+BITS_MAGIC = b"PB"
+BITS_VERSION = 2
+# magic, version, inheritance flags, generation
+_HEADER = struct.Struct("<2sBB16s")
+_LENGTH = struct.Struct("<I")
+
+
+class CodenameRegistry:
+    """
+    Assigns every codename a stable integer id, shared between processes through
+    a Redis hash so bitsets encoded by one worker can be read by another.
+
+    The registry has a generation; if the Redis hash is lost (flush, eviction)
+    a new generation starts and bitsets from the previous one are ignored.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+        # Replaced, never cleared, on a generation change: see `lookup`.
+        self._ids: Dict[str, int] = {}
+        self._generation: Optional[bytes] = None
+        self._local = False  # generation not shared through Redis
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else get_redis_client()
+
+    @property
+    def generation(self) -> bytes:
+        if self._generation is None:
+            with self._lock:
+                if self._generation is None:
+                    self._generation = self._load_generation()
+        return self._generation
+
+    def _load_generation(self) -> bytes:
+        candidate = uuid.uuid4().bytes
+        try:
+            self.client.set(GENERATION_KEY, candidate, nx=True)
+            generation = self.client.get(GENERATION_KEY)
+            if generation and len(generation) == 16:
+                self._local = False
+                return generation
+        except redis.RedisError as e:
+            logging.warning(f"Codename registry unavailable, using local ids: {e}")
+        self._local = True
+        return candidate  # process-local: bitsets will not be shared
+
+    def _reset(self):
+        self._ids = {}
+        self._generation = None
+
+    def get_id(self, codename: str) -> Optional[int]:
+        """
+        Id of `codename` if this process already knows it. Never touches Redis.
+        """
+        return self._ids.get(codename)
+
+    def lookup(self, codenames: Iterable[str]) -> Tuple[Optional[bytes], Dict[str, Optional[int]]]:
+        """
+        Ids this process already knows for `codenames` (None for the others) and
+        the generation they belong to, without touching Redis or assigning ids.
+
+        The generation is None if it is not loaded yet or changed during the lookup.
+        """
+        generation = self._generation
+        ids = self._ids
+        found = {codename: ids.get(codename) for codename in codenames}
+        if self._ids is not ids or self._generation != generation:
+            generation = None
+        return generation, found
+
+    def allocate(self, codenames: Iterable[str]) -> Tuple[bytes, Dict[str, int]]:
+        """
+        Ids for `codenames`, assigning new ones where needed, together with the
+        generation they belong to.
+        """
+        codenames = list(dict.fromkeys(codenames))
+        with self._lock:
+            # Twice: a generation change inside _assign drops the ids known before it.
+            for _ in range(2):
+                missing = [codename for codename in codenames if codename not in self._ids]
+                if missing:
+                    self._assign(missing)
+            if self._generation is None:
+                self._generation = self._load_generation()
+            return self._generation, {codename: self._ids[codename] for codename in codenames}
+
+    def register_many(self, codenames: Iterable[str]) -> Dict[str, int]:
+        """
+        Return ids for `codenames`, assigning new ones where needed.
+        """
+        return self.allocate(codenames)[1]
+
+    def register(self, codename: str) -> int:
+        return self.register_many([codename])[codename]
+
+    def _assign(self, codenames: List[str]):
+        generation = self._generation
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.get(GENERATION_KEY)
+            pipe.hmget(REGISTRY_KEY, codenames)
+            current_generation, ids = pipe.execute()
+
+            if generation is not None and current_generation != generation:
+                # Redis lost the registry: start over with the new generation.
+                self._reset()
+                self._generation = self._load_generation()
+                return
+
+            unassigned = [codename for codename, id_ in zip(codenames, ids) if id_ is None]
+            if unassigned:
+                last = self.client.incrby(COUNTER_KEY, len(unassigned))
+                pipe = self.client.pipeline(transaction=False)
+                for offset, codename in enumerate(unassigned):
+                    pipe.hsetnx(REGISTRY_KEY, codename, last - len(unassigned) + offset)
+                pipe.hmget(REGISTRY_KEY, codenames)
+                ids = pipe.execute()[-1]
+
+            for codename, id_ in zip(codenames, ids):
+                self._ids[codename] = int(id_)
+            if self._generation is None:
+                self._generation = current_generation or self._load_generation()
+        except redis.RedisError as e:
+            logging.warning(f"Codename registry unavailable, using local ids: {e}")
+            # Ids assigned here are not in Redis: keep them under a process-local
+            # generation so bitsets using them are never read by other processes.
+            ids = dict(self._ids)
+            next_id = max(ids.values(), default=-1) + 1
+            for offset, codename in enumerate(codenames):
+                ids[codename] = next_id + offset
+            self._ids = ids
+            if self._generation is None or not self._local:
+                self._generation = uuid.uuid4().bytes
+                self._local = True
+
+
+class PermissionBits:
+    """
+    A permission set encoded as three bitsets over CodenameRegistry ids.
+    """
+
+    __slots__ = ("allowed", "approval", "denied", "generation", "inheritance")
+
+    def __init__(
+        self,
+        allowed: int,
+        approval: int,
+        denied: int,
+        generation: bytes,
+        inheritance: Iterable[str] = (),
+    ):
+        self.allowed = allowed
+        self.approval = approval
+        self.denied = denied
+        self.generation = generation
+        # Inheritance modes the types were computed with.
+        self.inheritance = frozenset(inheritance)
+
+    @classmethod
+    def from_types(
+        cls, types: Dict[str, str], registry: CodenameRegistry, inheritance: Iterable[str] = ()
+    ) -> "PermissionBits":
+        generation, ids = registry.allocate(types)
+        allowed = approval = denied = 0
+        for codename, perm_type in types.items():
+            bit = 1 << ids[codename]
+            if perm_type == PermissionOption.ALLOWED:
+                allowed |= bit
+            elif perm_type == PermissionOption.APPROVAL_REQUIRED:
+                approval |= bit
+            elif perm_type == PermissionOption.DENIED:
+                denied |= bit
+        return cls(allowed, approval, denied, generation, inheritance)
+
+    def get_type(self, bit: int) -> Optional[str]:
+        if self.denied & bit:
+            return PermissionOption.DENIED
+        if self.approval & bit:
+            return PermissionOption.APPROVAL_REQUIRED
+        if self.allowed & bit:
+            return PermissionOption.ALLOWED
+        return None
+
+    def evaluate(self, mask: int) -> Tuple[int, int, int]:
+        """
+        Split a mask of required codenames into (denied, approval, missing) masks.
+        """
+        return (
+            mask & self.denied,
+            mask & self.approval,
+            mask & ~(self.allowed | self.approval | self.denied),
+        )
+
+    def to_bytes(self) -> bytes:
+        flags = sum(1 << INHERITANCE_MODES.index(mode) for mode in self.inheritance)
+        parts = [_HEADER.pack(BITS_MAGIC, BITS_VERSION, flags, self.generation)]
+        for value in (self.allowed, self.approval, self.denied):
+            data = value.to_bytes((value.bit_length() + 7) // 8, "little")
+            parts.append(_LENGTH.pack(len(data)))
+            parts.append(data)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Optional["PermissionBits"]:
+        try:
+            magic, version, flags, generation = _HEADER.unpack_from(data, 0)
+            if magic != BITS_MAGIC or version != BITS_VERSION:
+                return None
+            offset = _HEADER.size
+            values = []
+            for _ in range(3):
+                (length,) = _LENGTH.unpack_from(data, offset)
+                offset += _LENGTH.size
+                values.append(int.from_bytes(data[offset:offset + length], "little"))
+                offset += length
+        except struct.error:
+            return None
+        inheritance = [mode for i, mode in enumerate(INHERITANCE_MODES) if flags >> i & 1]
+        return cls(*values, generation=generation, inheritance=inheritance)
+
+
+_registry = CodenameRegistry()
+
+
+def get_registry() -> CodenameRegistry:
+    return _registry
+
@@ -1,15 +1,63 @@
+import asyncio
+import hashlib
 import json
+import os
+import threading
+import time
 import httpx
 import logging
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from typing import Optional, Dict, Any
+from django.core.exceptions import SynchronousOnlyOperation
+from jwt import InvalidTokenError
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional, Dict, Any, List, Tuple
 
-from wdg_core_auth.utils import get_cached_json, set_cached_json
+from wdg_core_auth import metrics
+from wdg_core_auth.approval import averify_token, verify_token
+from wdg_core_auth.breaker import CircuitBreaker, get_circuit_breaker
+from wdg_core_auth.clients import get_async_http_client, get_http_client
+from wdg_core_auth.cache import AsyncSingleFlight, KeyedLocks, LocalCache
+from wdg_core_auth.registry import PermissionBits, get_registry
+from wdg_core_auth.shm import get_shared_cache
+from wdg_core_auth.snapshot import PermissionSnapshot, encode_permissions, get_inheritance
+from wdg_core_auth.invalidation import (
+    register_local_cache,
+    role_tag,
+    start_invalidation_listener,
+    user_tag,
+)
+from wdg_core_auth.utils import (
+    BITS_KEY_PREFIX,
+    SNAPSHOT_KEY_PREFIX,
+    VALIDATORS_KEY_SUFFIX,
+    LazySetting,
+    aacquire_lock,
+    aget_cached_json,
+    aget_cached_json_with_ttl,
+    arelease_lock,
+    aset_cached_snapshot,
+    atouch_cached_snapshot,
+    acquire_lock,
+    decode_value,
+    encode_value,
+    get_cached_bytes,
+    get_cached_json,
+    get_cached_json_with_ttl,
+    release_lock,
+    set_cached_json,
+    set_cached_snapshot,
+    touch_cached_snapshot,
+)
+
+# Returned by `FetchPermissionSelector._fetch` when the auth service answers 304.
+NOT_MODIFIED = object()
 
 
 class FetchPermissionV1Selector:
-    AUTH_URL = settings.AUTH_SERVICE_BASE_URL
+    AUTH_URL = LazySetting("AUTH_SERVICE_BASE_URL")
     DEFAULT_ENDPOINT = "api/v1/user/permissions?paging=false"
     CACHE_TTL = 60 * 30  # 30 minutes
 
@@ -35,10 +83,9 @@ class FetchPermissionV1Selector:
 
         url = f"{self.AUTH_URL.rstrip('/')}/{endpoint.lstrip('/')}"
         try:
-            with httpx.Client() as client:
-                response = client.get(url, headers=headers, timeout=5)
-                response.raise_for_status()
-                return response.json()
+            response = get_http_client(self.AUTH_URL).get(url, headers=headers)
+            response.raise_for_status()
+            return response.json()
         except httpx.HTTPStatusError as e:
             logging.error(
                 f"HTTP error from {url}: {e.response.status_code} - {e.response.text}"
@@ -69,57 +116,882 @@ class FetchPermissionV1Selector:
 
 
 class FetchPermissionSelector:
-    AUTH_URL = settings.AUTH_SERVICE_BASE_URL
+    AUTH_URL = LazySetting("AUTH_SERVICE_BASE_URL")
     DEFAULT_ENDPOINT = "api/v1/user/permissions?paging=false"
     CACHE_TTL = 60 * 30  # 30 minutes
 
+    # Claims (besides the user id and the role claim) that identify a permission
+    # set; a change in `permission_version` makes the cached snapshot unreachable.
+    CACHE_KEY_CLAIMS = ("company_id", "branch_id", "permission_version")
+
+    LOCK_TTL = 10  # seconds a cross-process refresh lock is held at most
+    LOCK_WAIT = 3  # seconds a request waits for another refresh before fetching itself
+    LOCK_POLL_INTERVAL = 0.05
+
+    _local_cache: Optional[LocalCache] = None
+    _snapshot_cache: Optional[LocalCache] = None
+    _inflight = KeyedLocks()
+    _ainflight = AsyncSingleFlight()
+    _refreshing: set = set()
+    _refreshing_lock = threading.Lock()
+    _refresh_executor: Optional[ThreadPoolExecutor] = None
+    _refresh_executor_pid: Optional[int] = None
+    _negative_cache: Optional[LocalCache] = None
+    _last_good_cache: Optional[LocalCache] = None
+
+    # AUTH_PERMISSION_FALLBACK: what to serve when the auth service cannot be reached
+    FALLBACK_FAIL = "fail"
+    FALLBACK_LAST_KNOWN_GOOD = "last_known_good"
+
     def __init__(self, request=None):
         self.request = request
         self.caching_enabled = getattr(settings, "AUTH_PERMISSION_CACHE_ENABLED", True)
+        self.revalidation_enabled = self.get_validators_ttl() is not None
+        self._identity_claims: Optional[Dict[str, Any]] = None
+        # Whether the last failed fetch was refused by the auth service (4xx).
+        self._rejected = False
+
+    def _get_identity_claims(self) -> Dict[str, Any]:
+        """
+        Verified claims of the caller's access token, or {} if it cannot be verified.
+        """
+        if self._identity_claims is None:
+            self._identity_claims = self._load_identity_claims() or {}
+        return self._identity_claims
+
+    async def _aget_identity_claims(self) -> Dict[str, Any]:
+        """
+        Async `_get_identity_claims`; a token that is not cached yet is verified
+        off the event loop.
+        """
+        if self._identity_claims is None:
+            claims = None
+            raw_token = self._get_bearer_token()
+            if raw_token:
+                try:
+                    claims = await averify_token(raw_token)
+                except InvalidTokenError:
+                    pass
+            self._identity_claims = claims or self._get_authenticated_claims() or {}
+        return self._identity_claims
+
+    def _get_bearer_token(self) -> Optional[str]:
+        auth_header = self.request.headers.get("Authorization") or ""
+        scheme, _, raw_token = auth_header.partition(" ")
+        if scheme.lower() == "bearer" and raw_token.strip():
+            return raw_token.strip()
+        return None
+
+    def _load_identity_claims(self) -> Optional[Dict[str, Any]]:
+        raw_token = self._get_bearer_token()
+        if raw_token:
+            try:
+                return verify_token(raw_token)
+            except InvalidTokenError:
+                pass
+        return self._get_authenticated_claims()
+
+    def _get_authenticated_claims(self) -> Optional[Dict[str, Any]]:
+        # Token already verified by DRF (simplejwt TokenUser)
+        try:
+            token = getattr(getattr(self.request, "user", None), "token", None)
+        except SynchronousOnlyOperation:
+            return None  # lazy session user cannot be loaded from async code
+        if token is not None:
+            return dict(getattr(token, "payload", token))
+        return None
+
+    @classmethod
+    def get_cache_key_claims(cls) -> Tuple[str, ...]:
+        """
+        AUTH_PERMISSION_CACHE_KEY_CLAIMS, by default CACHE_KEY_CLAIMS plus the
+        role claim: a user who switches role must not get the old role's tree.
+        """
+        key_claims = getattr(settings, "AUTH_PERMISSION_CACHE_KEY_CLAIMS", None)
+        if key_claims is None:
+            role_claim = getattr(settings, "AUTH_PERMISSION_ROLE_CLAIM", "role_id")
+            key_claims = (*cls.CACHE_KEY_CLAIMS, role_claim)
+        return tuple(key_claims)
 
     def _get_cache_key(self) -> Optional[str]:
+        """
+        Cache key derived from the caller's identity, so it survives token refreshes.
+
+        Built from the user id and `get_cache_key_claims()` of the verified access
+        token (or of the token DRF already authenticated); falls back to the
+        Authorization header when neither is available. Either way the key is a
+        fixed-length hash.
+        """
+        claims = self._get_identity_claims()
+        user_id_claim = getattr(settings, "AUTH_PERMISSION_USER_ID_CLAIM", "user_id")
+        if claims.get(user_id_claim) is not None:
+            key_claims = self.get_cache_key_claims()
+            identity = json.dumps(
+                [user_id_claim, claims.get(user_id_claim)]
+                + [[claim, claims.get(claim)] for claim in key_claims],
+                sort_keys=True,
+                default=str,
+            )
+            return f"permissions:id:{hashlib.sha256(identity.encode()).hexdigest()}"
+
         auth_header = self.request.headers.get("Authorization")
         if auth_header:
-            return f"permissions:{auth_header}"
+            return f"permissions:auth:{hashlib.sha256(auth_header.encode()).hexdigest()}"
         return None
 
-    def _fetch_data(self, endpoint: str) -> Optional[Dict[str, Any]]:
+    def get_breaker(self) -> Optional[CircuitBreaker]:
+        if not getattr(settings, "AUTH_BREAKER_ENABLED", True):
+            return None
+        return get_circuit_breaker(self.AUTH_URL)
+
+    def _get_headers(self, validators: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
         authorization = self.request.headers.get("Authorization") or ""
         headers = {
             "Authorization": authorization,
             "Content-Type": "application/json",
         }
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    @staticmethod
+    def _get_validators(response: httpx.Response) -> Optional[Dict[str, Any]]:
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        return validators if any(validators.values()) else None
+
+    def _fetch(
+        self, endpoint: str, validators: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        """
+        GET `endpoint`, conditionally when `validators` are given.
+
+        Returns (data, validators of the response); data is NOT_MODIFIED on a
+        304 and None when the request failed.
+        """
+        self._rejected = False
+        breaker = self.get_breaker()
+        if breaker is not None and not breaker.allow_request():
+            metrics.increment("wdg_permission_fetch_rejected_total")
+            return None, None  # circuit open: fail fast
 
         url = f"{self.AUTH_URL.rstrip('/')}/{endpoint.lstrip('/')}"
-        try:
-            with httpx.Client() as client:
-                response = client.get(url, headers=headers, timeout=5)
-                response.raise_for_status()
-                return response.json()
-        except httpx.HTTPStatusError as e:
+        with metrics.timer("wdg_permission_fetch_seconds") as timer:
+            try:
+                response = get_http_client(self.AUTH_URL).get(
+                    url, headers=self._get_headers(validators)
+                )
+                if validators and response.status_code == httpx.codes.NOT_MODIFIED:
+                    data = NOT_MODIFIED
+                else:
+                    response.raise_for_status()
+                    data = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                timer.labels["outcome"] = "error"
+                self._rejected = self._record_failure(breaker, url, e)
+                return None, None
+            except BaseException:
+                # Cancelled or crashed: a half-open probe must still report back.
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            timer.labels["outcome"] = "not_modified" if data is NOT_MODIFIED else "ok"
+
+        if breaker is not None:
+            breaker.record_success()
+        return data, self._get_validators(response)
+
+    def _fetch_data(self, endpoint: str) -> Optional[Dict[str, Any]]:
+        return self._fetch(endpoint)[0]
+
+    @staticmethod
+    def _record_failure(
+        breaker: Optional[CircuitBreaker], url: str, error: Exception
+    ) -> bool:
+        """
+        Log a failed fetch and report it to `breaker`. Returns True if the
+        service rejected the request (4xx) rather than being unavailable.
+        """
+        if isinstance(error, httpx.HTTPStatusError):
             logging.error(
-                f"HTTP error from {url}: {e.response.status_code} - {e.response.text}"
+                f"HTTP error from {url}: {error.response.status_code} - {error.response.text}"
             )
-        except httpx.RequestError as e:
-            logging.error(f"Network error while fetching data from {url}: {e}")
+            if error.response.status_code < 500:
+                # The service answered; a rejected token is not an outage.
+                if breaker is not None:
+                    breaker.record_success()
+                return True
+        elif isinstance(error, httpx.RequestError):
+            logging.error(f"Network error while fetching data from {url}: {error}")
+        else:
+            logging.error(f"Invalid response from {url}: {error}")
+
+        if breaker is not None:
+            breaker.record_failure()
+        return False
+
+    @classmethod
+    def get_negative_cache(cls) -> LocalCache:
+        """
+        Keys whose fetch just failed; they are not retried for
+        AUTH_PERMISSION_NEGATIVE_TTL seconds.
+        """
+        if cls._negative_cache is None:
+            ttl = getattr(settings, "AUTH_PERMISSION_NEGATIVE_TTL", 5)
+            cls._negative_cache = LocalCache(maxsize=4096, ttl=ttl)
+        return cls._negative_cache
+
+    @classmethod
+    def get_last_good_cache(cls) -> LocalCache:
+        """
+        Last snapshot served per key, for AUTH_PERMISSION_FALLBACK = "last_known_good".
+        """
+        if cls._last_good_cache is None:
+            cls._last_good_cache = LocalCache(
+                maxsize=getattr(settings, "AUTH_PERMISSION_LAST_GOOD_CACHE_SIZE", 1024),
+                ttl=getattr(settings, "AUTH_PERMISSION_LAST_GOOD_TTL", 60 * 60 * 24),
+            )
+            register_local_cache(cls._last_good_cache)
+        return cls._last_good_cache
+
+    @classmethod
+    def get_fallback_policy(cls) -> str:
+        return getattr(settings, "AUTH_PERMISSION_FALLBACK", cls.FALLBACK_FAIL)
+
+    def _fallback(
+        self, cache_key: str, rejected: Optional[bool] = None
+    ) -> Optional[PermissionSnapshot]:
+        """
+        What to serve when `cache_key` cannot be fetched: `rejected` is None
+        right after a failed fetch, or the reason remembered in the negative cache.
+
+        The last known good snapshot only stands in while the service is
+        unavailable (open circuit, network error, 5xx). A 4xx is an answer, e.g.
+        revoked access, so it also drops that snapshot.
+        """
+        if rejected is None:
+            rejected = self._rejected
+            self.get_negative_cache().set(cache_key, rejected)
+        if self.get_fallback_policy() != self.FALLBACK_LAST_KNOWN_GOOD:
+            return None
+        if rejected:
+            self.get_last_good_cache().delete(cache_key)
+            return None
+        return self.get_last_good_cache().get(cache_key)
+
+    def _cached_failure(self, cache_key: str) -> Optional[bool]:
+        """
+        None, or whether the fetch that just failed for `cache_key` was rejected.
+        """
+        return self.get_negative_cache().get(cache_key)
+
+    def _remember(self, cache_key: str, snapshot: PermissionSnapshot, tags: List[str]):
+        local_cache = self.get_local_cache()
+        if local_cache is not None:
+            local_cache.set(cache_key, snapshot, tags=tags)
+        if self.get_fallback_policy() == self.FALLBACK_LAST_KNOWN_GOOD:
+            self.get_last_good_cache().set(cache_key, snapshot, tags=tags)
+
+    @classmethod
+    def get_local_cache(cls) -> Optional[LocalCache]:
+        """
+        Per-process L1 cache of decoded snapshots in front of Redis.
+        """
+        if cls._local_cache is None:
+            maxsize = getattr(settings, "AUTH_PERMISSION_LOCAL_CACHE_SIZE", 1024)
+            ttl = getattr(settings, "AUTH_PERMISSION_LOCAL_CACHE_TTL", 60)
+            cls._local_cache = LocalCache(maxsize=maxsize, ttl=min(ttl, cls.CACHE_TTL))
+            register_local_cache(cls._local_cache)
+        if cls._local_cache.maxsize <= 0:
+            return None
+        start_invalidation_listener()
+        return cls._local_cache
+
+    def _get_cache_tags(self) -> List[str]:
+        """
+        Tags used to invalidate this request's cache entries by user id or role.
+        """
+        claims = self._get_identity_claims()
+        user_id_claim = getattr(settings, "AUTH_PERMISSION_USER_ID_CLAIM", "user_id")
+        role_claim = getattr(settings, "AUTH_PERMISSION_ROLE_CLAIM", "role_id")
+
+        user_id = claims.get(user_id_claim)
+        roles = claims.get(role_claim)
+        if user_id is None:
+            try:
+                user = getattr(self.request, "user", None)
+                if user is not None and getattr(user, "is_authenticated", False):
+                    user_id = getattr(user, "id", None)
+                    roles = getattr(user, role_claim, None)
+            except SynchronousOnlyOperation:
+                pass  # lazy session user cannot be loaded from async code
+
+        tags = []
+        if user_id is not None:
+            tags.append(user_tag(user_id))
+        if roles is not None:
+            if not isinstance(roles, (list, tuple, set)):
+                roles = [roles]
+            tags.extend(role_tag(role) for role in roles)
+
+        return tags
+
+    def _get_endpoint(self) -> str:
+        return getattr(settings, "AUTH_SERVICE_PERMISSION_ENDPOINT", self.DEFAULT_ENDPOINT)
+
+    @classmethod
+    def get_snapshot_cache(cls) -> LocalCache:
+        """
+        Per-process store of snapshots by content hash: users with identical
+        permission trees share one decoded tree and one index.
+        """
+        if cls._snapshot_cache is None:
+            maxsize = getattr(settings, "AUTH_PERMISSION_LOCAL_SNAPSHOT_CACHE_SIZE", 256)
+            cls._snapshot_cache = LocalCache(maxsize=maxsize, ttl=cls.CACHE_TTL)
+        return cls._snapshot_cache
+
+    @classmethod
+    def _intern_snapshot(
+        cls, permissions: List[Dict[str, Any]], snapshot_id: Optional[str] = None
+    ) -> PermissionSnapshot:
+        if snapshot_id is None:
+            _, snapshot_id = encode_permissions(permissions)
+
+        snapshot_cache = cls.get_snapshot_cache()
+        snapshot = snapshot_cache.get(snapshot_id)
+        if snapshot is None:
+            snapshot = PermissionSnapshot(permissions, snapshot_id)
+            snapshot_cache.set(snapshot_id, snapshot)
+        return snapshot
+
+    def _snapshot_from_bits(self, snapshot_id: str, data: Optional[bytes]) -> Optional[PermissionSnapshot]:
+        """
+        Snapshot backed by cached bits only; the tree is loaded if something needs it.
+        """
+        bits = PermissionBits.from_bytes(data) if data else None
+        if (
+            bits is None
+            or bits.generation != get_registry().generation
+            or bits.inheritance != frozenset(get_inheritance())
+        ):
+            return None
+
+        snapshot = PermissionSnapshot(
+            snapshot_id=snapshot_id,
+            bits=bits,
+            loader=partial(get_cached_json, f"{SNAPSHOT_KEY_PREFIX}{snapshot_id}"),
+        )
+        self.get_snapshot_cache().set(snapshot_id, snapshot)
+        return snapshot
 
+    def _resolve_cached(self, value: Any) -> Optional[PermissionSnapshot]:
+        """
+        Turn a cached user entry (a snapshot pointer) into a snapshot.
+        """
+        if isinstance(value, dict) and "snapshot_id" in value:
+            snapshot_id = value["snapshot_id"]
+            snapshot = self.get_snapshot_cache().get(snapshot_id)
+            if snapshot is not None:
+                return snapshot
+            snapshot = self._snapshot_from_bits(
+                snapshot_id, get_cached_bytes(f"{BITS_KEY_PREFIX}{snapshot_id}")
+            )
+            if snapshot is not None:
+                return snapshot
+            permissions = get_cached_json(f"{SNAPSHOT_KEY_PREFIX}{snapshot_id}")
+            if permissions is None:
+                return None
+            return self._intern_snapshot(permissions, snapshot_id)
+        # Entry written before snapshots were content-addressed
+        return self._intern_snapshot(value)
+
+    def _read_cached(
+        self, cache_key: str
+    ) -> Tuple[Optional[PermissionSnapshot], Optional[float]]:
+        with metrics.timer("wdg_permission_cache_read_seconds", layer="redis"):
+            value, ttl_remaining = get_cached_json_with_ttl(cache_key)
+            snapshot = self._resolve_cached(value) if value else None
+        self._count_lookup("redis", snapshot)
+        return snapshot, ttl_remaining if snapshot is not None else None
+
+    @staticmethod
+    def _count_lookup(layer: str, snapshot: Optional[PermissionSnapshot]):
+        metrics.increment(
+            "wdg_permission_cache_total",
+            layer=layer,
+            result="miss" if snapshot is None else "hit",
+        )
+
+    def _store_fetched(
+        self,
+        cache_key: str,
+        permissions: List[Dict[str, Any]],
+        tags: List[str],
+        validators: Optional[Dict[str, Any]] = None,
+    ) -> PermissionSnapshot:
+        _, snapshot_id = encode_permissions(permissions)
+        snapshot = self._intern_snapshot(permissions, snapshot_id)
+        set_cached_snapshot(
+            cache_key,
+            snapshot_id,
+            permissions,
+            ttl=self.CACHE_TTL,
+            tags=tags,
+            bits=snapshot.bits.to_bytes() if snapshot.bits else None,
+            validators=validators if self.revalidation_enabled else None,
+            snapshot_ttl=self.get_validators_ttl(),
+        )
+        self._write_shared(cache_key, snapshot)
+        return snapshot
+
+    @classmethod
+    def get_validators_ttl(cls) -> Optional[int]:
+        """
+        How long the upstream ETag/Last-Modified of an entry (and the snapshot
+        it points to) are kept for revalidation after the entry expires.
+        """
+        if not getattr(settings, "AUTH_PERMISSION_REVALIDATE", True):
+            return None
+        return getattr(settings, "AUTH_PERMISSION_VALIDATORS_TTL", 60 * 60 * 24)
+
+    def _read_validators(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        if not self.revalidation_enabled:
+            return None
+        validators = get_cached_json(f"{cache_key}{VALIDATORS_KEY_SUFFIX}")
+        if isinstance(validators, dict) and validators.get("snapshot_id"):
+            return validators
         return None
 
+    def _fetch_and_store(
+        self, cache_key: str, tags: List[str]
+    ) -> Optional[PermissionSnapshot]:
+        """
+        Fetch the permissions for `cache_key` and cache them.
+
+        When the previous response's validators are known the request is
+        conditional: on a 304 the cached snapshot is reused and its TTL extended,
+        without transferring or parsing the tree again.
+        """
+        validators = self._read_validators(cache_key)
+        permissions, new_validators = self._fetch(self._get_endpoint(), validators)
+        if permissions is NOT_MODIFIED:
+            validators = {**validators, **(new_validators or {})}
+            snapshot = self._resolve_cached(validators)
+            if snapshot is not None:
+                touch_cached_snapshot(
+                    cache_key,
+                    validators["snapshot_id"],
+                    ttl=self.CACHE_TTL,
+                    tags=tags,
+                    validators=validators,
+                    snapshot_ttl=self.get_validators_ttl(),
+                )
+                self._write_shared(cache_key, snapshot)
+                return snapshot
+            # The cached tree is gone: download it again.
+            permissions, new_validators = self._fetch(self._get_endpoint())
+
+        if permissions:
+            return self._store_fetched(cache_key, permissions, tags, new_validators)
+        if permissions is not None:
+            return PermissionSnapshot(permissions)
+        return None
+
+    def _wait_for_cache(self, cache_key: str) -> Optional[PermissionSnapshot]:
+        """
+        Poll Redis while another process repopulates `cache_key`.
+        """
+        deadline = time.monotonic() + self.LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(self.LOCK_POLL_INTERVAL)
+            snapshot, _ = self._read_cached(cache_key)
+            if snapshot is not None:
+                return snapshot
+        return None
+
+    @classmethod
+    def get_soft_ttl(cls) -> Optional[int]:
+        """
+        Age (in seconds) after which a cached entry is served stale and refreshed
+        in the background. None disables stale-while-revalidate.
+        """
+        soft_ttl = getattr(settings, "AUTH_PERMISSION_CACHE_SOFT_TTL", None)
+        if soft_ttl is None or soft_ttl >= cls.CACHE_TTL:
+            return None
+        return soft_ttl
+
+    @classmethod
+    def get_refresh_executor(cls) -> ThreadPoolExecutor:
+        # A pool inherited through fork() has no live threads; start a new one.
+        if cls._refresh_executor is None or cls._refresh_executor_pid != os.getpid():
+            workers = getattr(settings, "AUTH_PERMISSION_REFRESH_WORKERS", 4)
+            cls._refresh_executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="wdg-core-auth-refresh"
+            )
+            cls._refresh_executor_pid = os.getpid()
+            cls._refreshing = set()
+        return cls._refresh_executor
+
+    def _is_stale(self, ttl_remaining: Optional[float]) -> bool:
+        soft_ttl = self.get_soft_ttl()
+        if soft_ttl is None or ttl_remaining is None:
+            return False
+        return self.CACHE_TTL - ttl_remaining >= soft_ttl
+
+    def _schedule_refresh(self, cache_key: str, tags: List[str]):
+        executor = self.get_refresh_executor()
+        with self._refreshing_lock:
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+        try:
+            executor.submit(self._refresh, cache_key, tags)
+        except RuntimeError:  # interpreter shutting down
+            with self._refreshing_lock:
+                self._refreshing.discard(cache_key)
+
+    def _refresh(self, cache_key: str, tags: List[str]):
+        """
+        Background refresh of a stale entry in Redis and the local cache.
+        """
+        lock_key = f"{cache_key}:lock"
+        try:
+            lock_token = acquire_lock(lock_key, ttl_ms=int(self.LOCK_TTL * 1000))
+            if lock_token is None:
+                return  # another process is already refreshing it
+
+            try:
+                snapshot = self._fetch_and_store(cache_key, tags)
+                if snapshot is not None and snapshot.snapshot_id is not None:
+                    self._remember(cache_key, snapshot, tags)
+            finally:
+                release_lock(lock_key, lock_token)
+        except Exception:
+            logging.exception(f"Background permission refresh failed for {cache_key}")
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.discard(cache_key)
+
+    def _read_shared(self, cache_key: str) -> Optional[PermissionSnapshot]:
+        """
+        Look `cache_key` up in the host-wide shared-memory cache, if enabled.
+        """
+        shared_cache = get_shared_cache()
+        if shared_cache is None:
+            return None
+
+        with metrics.timer("wdg_permission_cache_read_seconds", layer="shared"):
+            snapshot = self._get_shared(shared_cache, cache_key)
+        self._count_lookup("shared", snapshot)
+        return snapshot
+
+    def _get_shared(self, shared_cache, cache_key: str) -> Optional[PermissionSnapshot]:
+        snapshot_cache = self.get_snapshot_cache()
+        found = shared_cache.get(cache_key, known=snapshot_cache.__contains__)
+        if found is None:
+            return None
+        snapshot_id, payload = found
+        if payload is None:
+            return snapshot_cache.get(snapshot_id)
+        try:
+            permissions = decode_value(payload)
+        except ValueError:
+            return None
+        return self._intern_snapshot(permissions, snapshot_id)
+
+    def _write_shared(
+        self, cache_key: str, snapshot: PermissionSnapshot, ttl: Optional[float] = None
+    ):
+        shared_cache = get_shared_cache()
+        if shared_cache is None or snapshot.snapshot_id is None or not snapshot.loaded:
+            return
+        max_ttl = getattr(settings, "AUTH_PERMISSION_SHARED_CACHE_TTL", 60)
+        shared_cache.set(
+            cache_key,
+            snapshot.snapshot_id,
+            encode_value(snapshot.permissions),
+            ttl=min(max_ttl, ttl or self.CACHE_TTL),
+        )
+
+    async def _aread_shared(self, cache_key: str) -> Optional[PermissionSnapshot]:
+        # File locks and the first open of the file block: use a worker thread.
+        if not getattr(settings, "AUTH_PERMISSION_SHARED_CACHE_ENABLED", False):
+            return None
+        return await sync_to_async(self._read_shared, thread_sensitive=False)(cache_key)
+
+    async def _awrite_shared(
+        self, cache_key: str, snapshot: PermissionSnapshot, ttl: Optional[float] = None
+    ):
+        if not getattr(settings, "AUTH_PERMISSION_SHARED_CACHE_ENABLED", False):
+            return
+        await sync_to_async(self._write_shared, thread_sensitive=False)(cache_key, snapshot, ttl)
+
+    def _load_snapshot(
+        self, cache_key: str, tags: List[str]
+    ) -> Optional[PermissionSnapshot]:
+        snapshot = self._read_shared(cache_key)
+        if snapshot is not None:
+            return snapshot
+
+        snapshot, ttl_remaining = self._read_cached(cache_key)
+        if snapshot is not None:
+            self._write_shared(cache_key, snapshot, ttl_remaining)
+            if self._is_stale(ttl_remaining):
+                self._schedule_refresh(cache_key, tags)
+            return snapshot
+
+        # Only one process refreshes an expired key; the others wait for it.
+        lock_key = f"{cache_key}:lock"
+        lock_token = acquire_lock(lock_key, ttl_ms=int(self.LOCK_TTL * 1000))
+        if lock_token is None:
+            snapshot = self._wait_for_cache(cache_key)
+            if snapshot is not None:
+                return snapshot
+
+        try:
+            return self._fetch_and_store(cache_key, tags)
+        finally:
+            release_lock(lock_key, lock_token)
+
+    def fetch_snapshot(self) -> Optional[PermissionSnapshot]:
+        cache_key = self._get_cache_key() if self.caching_enabled else None
+        if not cache_key:
+            permissions = self._fetch_data(self._get_endpoint())
+            return PermissionSnapshot(permissions) if permissions is not None else None
+
+        local_cache = self.get_local_cache()
+        if local_cache is not None:
+            snapshot = local_cache.get(cache_key)
+            self._count_lookup("local", snapshot)
+            if snapshot is not None:
+                return snapshot
+        rejected = self._cached_failure(cache_key)
+        if rejected is not None:
+            return self._fallback(cache_key, rejected)
+
+        # Coalesce concurrent misses for the same key within this process.
+        with self._inflight.hold(cache_key, timeout=self.LOCK_WAIT):
+            if local_cache is not None:
+                snapshot = local_cache.get(cache_key)
+                if snapshot is not None:
+                    return snapshot
+            rejected = self._cached_failure(cache_key)
+            if rejected is not None:
+                return self._fallback(cache_key, rejected)
+
+            tags = self._get_cache_tags()
+            snapshot = self._load_snapshot(cache_key, tags)
+            if snapshot is None:
+                return self._fallback(cache_key)
+            self._remember(cache_key, snapshot, tags)
+            return snapshot
+
     def fetch_permissions(self) -> Optional[Dict[str, Any]]:
-        endpoint = getattr(settings, "AUTH_SERVICE_PERMISSION_ENDPOINT", self.DEFAULT_ENDPOINT)
+        snapshot = self.fetch_snapshot()
+        return snapshot.permissions if snapshot else None
+
+    async def _afetch(
+        self, endpoint: str, validators: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        self._rejected = False
+        breaker = self.get_breaker()
+        if breaker is not None and not breaker.allow_request():
+            metrics.increment("wdg_permission_fetch_rejected_total")
+            return None, None
+
+        url = f"{self.AUTH_URL.rstrip('/')}/{endpoint.lstrip('/')}"
+        with metrics.timer("wdg_permission_fetch_seconds") as timer:
+            try:
+                response = await get_async_http_client(self.AUTH_URL).get(
+                    url, headers=self._get_headers(validators)
+                )
+                if validators and response.status_code == httpx.codes.NOT_MODIFIED:
+                    data = NOT_MODIFIED
+                else:
+                    response.raise_for_status()
+                    data = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                timer.labels["outcome"] = "error"
+                self._rejected = self._record_failure(breaker, url, e)
+                return None, None
+            except BaseException:
+                # Cancelled or crashed: a half-open probe must still report back.
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            timer.labels["outcome"] = "not_modified" if data is NOT_MODIFIED else "ok"
+
+        if breaker is not None:
+            breaker.record_success()
+        return data, self._get_validators(response)
+
+    async def _afetch_data(self, endpoint: str) -> Optional[Dict[str, Any]]:
+        return (await self._afetch(endpoint))[0]
+
+    async def _aresolve_cached(self, value: Any) -> Optional[PermissionSnapshot]:
+        if isinstance(value, dict) and "snapshot_id" in value:
+            snapshot_id = value["snapshot_id"]
+            snapshot = self.get_snapshot_cache().get(snapshot_id)
+            if snapshot is not None:
+                return snapshot
+            # Always load the tree: a snapshot backed by bits only could need the
+            # sync Redis client later, on the event loop.
+            permissions = await aget_cached_json(f"{SNAPSHOT_KEY_PREFIX}{snapshot_id}")
+            if permissions is None:
+                return None
+            return self._intern_snapshot(permissions, snapshot_id)
+        return self._intern_snapshot(value)
+
+    async def _aread_cached(
+        self, cache_key: str
+    ) -> Tuple[Optional[PermissionSnapshot], Optional[float]]:
+        with metrics.timer("wdg_permission_cache_read_seconds", layer="redis"):
+            value, ttl_remaining = await aget_cached_json_with_ttl(cache_key)
+            snapshot = await self._aresolve_cached(value) if value else None
+        self._count_lookup("redis", snapshot)
+        return snapshot, ttl_remaining if snapshot is not None else None
+
+    async def _astore_fetched(
+        self,
+        cache_key: str,
+        permissions: List[Dict[str, Any]],
+        tags: List[str],
+        validators: Optional[Dict[str, Any]] = None,
+    ) -> PermissionSnapshot:
+        _, snapshot_id = encode_permissions(permissions)
+        snapshot = self._intern_snapshot(permissions, snapshot_id)
+        # Bits are left to sync callers: encoding them assigns codename ids
+        # through the sync Redis client.
+        await aset_cached_snapshot(
+            cache_key,
+            snapshot_id,
+            permissions,
+            ttl=self.CACHE_TTL,
+            tags=tags,
+            validators=validators if self.revalidation_enabled else None,
+            snapshot_ttl=self.get_validators_ttl(),
+        )
+        await self._awrite_shared(cache_key, snapshot)
+        return snapshot
+
+    async def _aread_validators(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        if not self.revalidation_enabled:
+            return None
+        validators = await aget_cached_json(f"{cache_key}{VALIDATORS_KEY_SUFFIX}")
+        if isinstance(validators, dict) and validators.get("snapshot_id"):
+            return validators
+        return None
+
+    async def _afetch_and_store(
+        self, cache_key: str, tags: List[str]
+    ) -> Optional[PermissionSnapshot]:
+        validators = await self._aread_validators(cache_key)
+        permissions, new_validators = await self._afetch(self._get_endpoint(), validators)
+        if permissions is NOT_MODIFIED:
+            validators = {**validators, **(new_validators or {})}
+            snapshot = await self._aresolve_cached(validators)
+            if snapshot is not None:
+                await atouch_cached_snapshot(
+                    cache_key,
+                    validators["snapshot_id"],
+                    ttl=self.CACHE_TTL,
+                    tags=tags,
+                    validators=validators,
+                    snapshot_ttl=self.get_validators_ttl(),
+                )
+                await self._awrite_shared(cache_key, snapshot)
+                return snapshot
+            permissions, new_validators = await self._afetch(self._get_endpoint())
+
+        if permissions:
+            return await self._astore_fetched(cache_key, permissions, tags, new_validators)
+        if permissions is not None:
+            return PermissionSnapshot(permissions)
+        return None
+
+    async def _await_for_cache(self, cache_key: str) -> Optional[PermissionSnapshot]:
+        deadline = time.monotonic() + self.LOCK_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.LOCK_POLL_INTERVAL)
+            snapshot, _ = await self._aread_cached(cache_key)
+            if snapshot is not None:
+                return snapshot
+        return None
+
+    async def _aload_snapshot(
+        self, cache_key: str, tags: List[str]
+    ) -> Optional[PermissionSnapshot]:
+        snapshot = await self._aread_shared(cache_key)
+        if snapshot is not None:
+            return snapshot
+
+        snapshot, ttl_remaining = await self._aread_cached(cache_key)
+        if snapshot is not None:
+            await self._awrite_shared(cache_key, snapshot, ttl_remaining)
+            if self._is_stale(ttl_remaining):
+                self._schedule_refresh(cache_key, tags)
+            return snapshot
+
+        lock_key = f"{cache_key}:lock"
+        lock_token = await aacquire_lock(lock_key, ttl_ms=int(self.LOCK_TTL * 1000))
+        if lock_token is None:
+            snapshot = await self._await_for_cache(cache_key)
+            if snapshot is not None:
+                return snapshot
+
+        try:
+            return await self._afetch_and_store(cache_key, tags)
+        finally:
+            await arelease_lock(lock_key, lock_token)
+
+    async def afetch_snapshot(self) -> Optional[PermissionSnapshot]:
+        """
+        Async version of `fetch_snapshot` using redis.asyncio and httpx.AsyncClient.
+
+        The snapshot returned has its tree loaded, so checks on it stay in memory.
+        """
+        snapshot = await self._afetch_snapshot()
+        if snapshot is not None and not snapshot.loaded and snapshot.snapshot_id is not None:
+            # Backed by bits only (cached by a sync request of this process).
+            snapshot.set_permissions(
+                await aget_cached_json(f"{SNAPSHOT_KEY_PREFIX}{snapshot.snapshot_id}")
+            )
+        return snapshot
 
+    async def _afetch_snapshot(self) -> Optional[PermissionSnapshot]:
+        cache_key = None
         if self.caching_enabled:
+            await self._aget_identity_claims()  # `_get_cache_key` then stays in memory
             cache_key = self._get_cache_key()
-            if cache_key:
-                permissions = get_cached_json(cache_key)
-                if permissions:
-                    return permissions
+        if not cache_key:
+            permissions = await self._afetch_data(self._get_endpoint())
+            return PermissionSnapshot(permissions) if permissions is not None else None
 
-        permissions = self._fetch_data(endpoint)
+        local_cache = self.get_local_cache()
+        if local_cache is not None:
+            snapshot = local_cache.get(cache_key)
+            self._count_lookup("local", snapshot)
+            if snapshot is not None:
+                return snapshot
+        rejected = self._cached_failure(cache_key)
+        if rejected is not None:
+            return self._fallback(cache_key, rejected)
 
-        if self.caching_enabled and permissions:
-            cache_key = self._get_cache_key()
-            if cache_key:
-                set_cached_json(cache_key, permissions, ttl=self.CACHE_TTL)
+        async def load():
+            tags = self._get_cache_tags()
+            snapshot = await self._aload_snapshot(cache_key, tags)
+            if snapshot is None:
+                return self._fallback(cache_key)
+            self._remember(cache_key, snapshot, tags)
+            return snapshot
 
-        return permissions
+        return await self._ainflight.do(cache_key, load)
+
+    async def afetch_permissions(self) -> Optional[Dict[str, Any]]:
+        snapshot = await self.afetch_snapshot()
+        return snapshot.permissions if snapshot else None
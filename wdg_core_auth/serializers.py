@@ -0,0 +1,20 @@
+from django.conf import settings
+from rest_framework import serializers
+
+
+def get_max_codenames() -> int:
+    return getattr(settings, "AUTH_PERMISSION_CHECK_MAX_CODENAMES", 500)
+
+
+class PermissionCheckSerializer(serializers.Serializer):
+    codenames = serializers.ListField(
+        child=serializers.CharField(max_length=255), allow_empty=False
+    )
+
+    def validate_codenames(self, value):
+        max_codenames = get_max_codenames()
+        if len(value) > max_codenames:
+            raise serializers.ValidationError(
+                f"At most {max_codenames} codenames can be checked at once."
+            )
+        return list(dict.fromkeys(value))
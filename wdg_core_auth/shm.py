@@ -0,0 +1,297 @@
+import fcntl
+import hashlib
+import mmap
+import logging
+import os
+import stat
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from wdg_core_auth.invalidation import register_local_cache, unregister_local_cache
+
+MAGIC = b"WDGS"
+VERSION = 1
+
+# magic, version, slots, slot size, generation
+_FILE_HEADER = struct.Struct("<4sIIIQ")
+_GENERATION_OFFSET = 16
+_GENERATION = struct.Struct("<Q")
+# seq (odd while written), generation, key digest, snapshot id, expires at (epoch), payload length
+_SLOT_HEADER = struct.Struct("<QQ16s32sdI")
+_SEQ = struct.Struct("<Q")
+_SLOT_FIELDS = struct.Struct("<Q16s32sdI")  # the slot header after `seq`
+
+PROBES = 4  # slots checked per key (open addressing)
+READ_RETRIES = 4
+
+
+def _key_digest(key: str) -> bytes:
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+
+def _check_private(fd: int, path: str):
+    """
+    Refuse a file another user could have planted or can read or write: the
+    path is predictable and the cache decides authorization.
+    """
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode) or st.st_uid != os.geteuid() or st.st_mode & 0o077:
+        raise PermissionError(
+            f"Shared cache file {path} must be a regular file owned by this user "
+            f"with mode 0600."
+        )
+
+
+class SharedSnapshotCache:
+    """
+    Fixed-slot hash table in a memory-mapped file, shared by every worker
+    process on the host.
+
+    Each slot holds one cache key, its snapshot id and the encoded permission
+    tree. Readers are lock-free and use a per-slot sequence number (seqlock):
+    a read that overlaps a write is retried. Writers serialize on an flock of
+    the file. Entries are invalidated wholesale by bumping the file generation.
+
+    The file name includes the layout, so changing the slot settings never
+    remaps a file another worker is using. Symlinks are not followed, and a
+    file that is not private to the current user is rejected.
+    """
+
+    def __init__(self, path: str, slots: int = 1024, slot_size: int = 32 * 1024):
+        if slot_size <= _SLOT_HEADER.size:
+            raise ValueError(f"slot_size must be larger than {_SLOT_HEADER.size} bytes.")
+        self.slots = slots
+        self.slot_size = slot_size
+        self.path = f"{path}-{slots}x{slot_size}.v{VERSION}"
+        self.size = _FILE_HEADER.size + slots * slot_size
+        self._thread_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.oversize = 0
+        self.retries = 0
+
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            _check_private(self._fd, self.path)
+            with self._locked():
+                if os.fstat(self._fd).st_size < self.size:
+                    os.ftruncate(self._fd, self.size)
+                self._mm = mmap.mmap(self._fd, self.size)
+                magic, version, slots_, slot_size_, _ = _FILE_HEADER.unpack_from(self._mm, 0)
+                if magic != MAGIC:
+                    _FILE_HEADER.pack_into(self._mm, 0, MAGIC, VERSION, slots, slot_size, 1)
+                elif (version, slots_, slot_size_) != (VERSION, slots, slot_size):
+                    self._mm.close()
+                    raise ValueError(f"Unexpected shared cache layout in {self.path}.")
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    @contextmanager
+    def _locked(self):
+        # flock excludes other processes; the thread lock, other threads of this one.
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def generation(self) -> int:
+        return _GENERATION.unpack_from(self._mm, _GENERATION_OFFSET)[0]
+
+    def _offsets(self, digest: bytes) -> Iterable[int]:
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        for probe in range(min(PROBES, self.slots)):
+            yield _FILE_HEADER.size + ((start + probe) % self.slots) * self.slot_size
+
+    def get(
+        self, key: str, known: Callable[[str], bool] = lambda snapshot_id: False
+    ) -> Optional[Tuple[str, Optional[bytes]]]:
+        """
+        Return (snapshot_id, payload) for `key`, or None on a miss.
+
+        The payload is not copied (None is returned instead) when
+        `known(snapshot_id)` says the caller already has that snapshot.
+        """
+        digest = _key_digest(key)
+        generation = self.generation
+        mm = self._mm
+        for offset in self._offsets(digest):
+            for _ in range(READ_RETRIES):
+                seq, slot_generation, slot_digest, snapshot_id, expires_at, length = (
+                    _SLOT_HEADER.unpack_from(mm, offset)
+                )
+                if seq & 1:
+                    self.retries += 1
+                    continue  # being written
+                if (
+                    slot_digest != digest
+                    or slot_generation != generation
+                    or expires_at <= time.time()
+                ):
+                    break
+                snapshot_id = snapshot_id.hex()
+                payload = None
+                if not known(snapshot_id):
+                    start = offset + _SLOT_HEADER.size
+                    payload = mm[start:start + length]
+                if _SEQ.unpack_from(mm, offset)[0] != seq:
+                    self.retries += 1
+                    continue  # overwritten while reading
+                self.hits += 1
+                return snapshot_id, payload
+        self.misses += 1
+        return None
+
+    def set(self, key: str, snapshot_id: str, payload: bytes, ttl: float):
+        """
+        Store `payload` (an encoded permission tree) for `key` for `ttl` seconds.
+        Payloads larger than a slot are not stored.
+        """
+        if len(payload) > self.slot_size - _SLOT_HEADER.size:
+            self.oversize += 1
+            return
+
+        digest = _key_digest(key)
+        now = time.time()
+        with self._locked():
+            generation = self.generation
+            mm = self._mm
+            target = None
+            free = None
+            oldest = None
+            for offset in self._offsets(digest):
+                _, slot_generation, slot_digest, _, expires_at, _ = _SLOT_HEADER.unpack_from(
+                    mm, offset
+                )
+                if slot_digest == digest and slot_generation == generation:
+                    target = offset  # the key's own slot, wherever it is probed
+                    break
+                if slot_generation != generation or expires_at <= now:
+                    if free is None:
+                        free = offset
+                elif oldest is None or expires_at < oldest[0]:
+                    oldest = (expires_at, offset)
+            if target is None:
+                # A free slot, else evict the entry closest to expiry.
+                target = free if free is not None else oldest[1]
+
+            # seq goes odd, the slot is rewritten, then seq goes even again.
+            seq = _SEQ.unpack_from(mm, target)[0] | 1
+            _SEQ.pack_into(mm, target, seq)
+            _SLOT_FIELDS.pack_into(
+                mm,
+                target + _SEQ.size,
+                generation,
+                digest,
+                bytes.fromhex(snapshot_id),
+                now + ttl,
+                len(payload),
+            )
+            start = target + _SLOT_HEADER.size
+            mm[start:start + len(payload)] = payload
+            _SEQ.pack_into(mm, target, seq + 1)
+            self.writes += 1
+
+    def clear(self):
+        """
+        Invalidate every entry, in every process.
+        """
+        with self._locked():
+            _GENERATION.pack_into(self._mm, _GENERATION_OFFSET, self.generation + 1)
+
+    def delete_tagged(self, tag: str):
+        # Slots do not record tags: invalidate everything (invalidations are rare).
+        self.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "oversize": self.oversize,
+            "retries": self.retries,
+        }
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+
+_shared_cache: Optional[SharedSnapshotCache] = None
+_shared_cache_pid: Optional[int] = None
+_shared_cache_failed_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def get_default_path() -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "wdg-core-auth-permissions")
+
+
+def get_shared_cache() -> Optional[SharedSnapshotCache]:
+    """
+    Return this process's handle on the host-wide cache, or None unless
+    AUTH_PERMISSION_SHARED_CACHE_ENABLED is set.
+
+    A forked process opens its own handle: flock locks belong to the open file,
+    so a handle inherited from the parent would not exclude it. If the file
+    cannot be used (e.g. it is not private to this user), the cache stays
+    disabled in this process.
+    """
+    global _shared_cache, _shared_cache_pid, _shared_cache_failed_pid
+
+    if not getattr(settings, "AUTH_PERMISSION_SHARED_CACHE_ENABLED", False):
+        return None
+
+    pid = os.getpid()
+    if _shared_cache is not None and _shared_cache_pid == pid:
+        return _shared_cache
+    if _shared_cache_failed_pid == pid:
+        return None
+
+    with _lock:
+        if _shared_cache_failed_pid == pid:
+            return None
+        if _shared_cache is None or _shared_cache_pid != pid:
+            if _shared_cache is not None:
+                unregister_local_cache(_shared_cache)  # the parent's handle
+                _shared_cache = None
+            try:
+                shared_cache = SharedSnapshotCache(
+                    getattr(settings, "AUTH_PERMISSION_SHARED_CACHE_PATH", None)
+                    or get_default_path(),
+                    slots=getattr(settings, "AUTH_PERMISSION_SHARED_CACHE_SLOTS", 1024),
+                    slot_size=getattr(
+                        settings, "AUTH_PERMISSION_SHARED_CACHE_SLOT_SIZE", 32 * 1024
+                    ),
+                )
+            except (OSError, ValueError) as e:
+                logging.error(f"Shared permission cache disabled: {e}")
+                _shared_cache_failed_pid = pid
+                return None
+            _shared_cache = shared_cache
+            _shared_cache_pid = pid
+            # Any invalidation message clears the shared table.
+            register_local_cache(_shared_cache, host_wide=True)
+        return _shared_cache
+
+
+def _reset_failure(setting, **kwargs):
+    global _shared_cache_failed_pid
+    if setting.startswith("AUTH_PERMISSION_SHARED_CACHE_"):
+        _shared_cache_failed_pid = None  # retry with the new settings
+
+
+setting_changed.connect(_reset_failure)
@@ -0,0 +1,181 @@
+import hashlib
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from .constants import PermissionOption
+from .index import PermissionIndex
+from .menus import build_effective_menu
+from .registry import PermissionBits, get_registry
+
+
+def get_inheritance() -> Tuple[str, ...]:
+    """
+    Inheritance modes applied when building indexes, e.g. `("deny", "approval")`.
+    """
+    return tuple(getattr(settings, "AUTH_PERMISSION_INHERITANCE", ()))
+
+
+def encode_permissions(permissions: List[Dict[str, Any]]) -> Tuple[str, str]:
+    """
+    Return the canonical JSON encoding of a permission tree and its snapshot id
+    (a hash of that encoding), so identical trees share one id.
+    """
+    encoded = json.dumps(permissions, sort_keys=True, separators=(",", ":"))
+    return encoded, hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class PermissionSnapshot:
+    """
+    Decoded permission payload together with its (lazily built) PermissionIndex
+    and PermissionBits.
+
+    A snapshot can also be created from cached bits alone; the payload is then
+    only loaded (through `loader`) when `permissions` or `index` is used.
+    """
+
+    def __init__(
+        self,
+        permissions: Optional[List[Dict[str, Any]]] = None,
+        snapshot_id: Optional[str] = None,
+        bits: Optional[PermissionBits] = None,
+        loader: Optional[Callable[[], Optional[List[Dict[str, Any]]]]] = None,
+    ):
+        self._permissions = permissions
+        self.snapshot_id = snapshot_id
+        self._bits = bits
+        self._loader = loader
+        self._index: Optional[PermissionIndex] = None
+        self._menu: Optional[List[Dict[str, Any]]] = None
+
+    @property
+    def permissions(self) -> Optional[List[Dict[str, Any]]]:
+        if self._permissions is None and self._loader is not None:
+            self._permissions = self._loader()
+            self._loader = None
+        return self._permissions
+
+    def set_permissions(self, permissions: Optional[List[Dict[str, Any]]]):
+        """
+        Supply the payload of a snapshot backed by bits only (e.g. loaded asynchronously).
+        """
+        if permissions is not None and self._permissions is None:
+            self._permissions = permissions
+            self._loader = None
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Whether the payload is in memory (False for a snapshot still backed by bits only).
+        """
+        return self._permissions is not None
+
+    @property
+    def index(self) -> PermissionIndex:
+        if self._index is None:
+            self._index = PermissionIndex.from_permissions(
+                self.permissions, inheritance=get_inheritance()
+            )
+        return self._index
+
+    @property
+    def bits(self) -> Optional[PermissionBits]:
+        """
+        Bits to cache with the snapshot, encoded (assigning codename ids through
+        the registry) if needed. None when the tree has wildcard grants: those
+        need the index's trie.
+        """
+        if self._bits is None and self.index.has_wildcards:
+            return None
+        registry = get_registry()
+        inheritance = frozenset(get_inheritance())
+        bits = self._bits
+        if (
+            bits is None
+            or bits.generation != registry.generation
+            or bits.inheritance != inheritance
+        ):
+            bits = self._bits = PermissionBits.from_types(
+                self.index.typed_entries, registry, inheritance
+            )
+        return bits
+
+    @property
+    def effective_menu(self) -> List[Dict[str, Any]]:
+        """
+        Menus visible to this snapshot, computed once per snapshot (snapshots are
+        shared per snapshot id, so once per distinct tree and process).
+        """
+        if self._menu is None:
+            self._menu = build_effective_menu(self.permissions, self.index)
+        return self._menu
+
+    def _known_bits(
+        self, codenames: Iterable[str]
+    ) -> Optional[Tuple[PermissionBits, Dict[str, int]]]:
+        """
+        The bits and the ids of `codenames`, if this process knows every id in
+        the generation the bits were encoded with and they were computed with
+        the current AUTH_PERMISSION_INHERITANCE. Never touches Redis.
+        """
+        bits = self._bits
+        if bits is None or bits.inheritance != frozenset(get_inheritance()):
+            return None
+        generation, ids = get_registry().lookup(codenames)
+        if generation != bits.generation or None in ids.values():
+            return None
+        return bits, ids
+
+    def check(self, codename: str, version: int = PermissionIndex.V3) -> Optional[str]:
+        if self._index is None and version == PermissionIndex.V3:
+            # Built from cached bits: answer without loading the payload if we can.
+            found = self._known_bits((codename,))
+            if found is not None:
+                bits, ids = found
+                return PermissionIndex.decide(codename, bits.get_type(1 << ids[codename]), version)
+        return self.index.check(codename, version)
+
+    def evaluate(self, codenames: Iterable[str]) -> Tuple[List[str], List[str], List[str]]:
+        """
+        Evaluate many codenames at once, with bitwise operations when the bits
+        and every codename id are known.
+
+        Returns (denied, approval_required, missing) codenames, in input order.
+        """
+        codenames = list(codenames)
+        found = self._known_bits(codenames)
+        if found is None:
+            types = [(codename, self.index.get_type(codename)) for codename in codenames]
+            return (
+                [codename for codename, t in types if t == PermissionOption.DENIED],
+                [codename for codename, t in types if t == PermissionOption.APPROVAL_REQUIRED],
+                [codename for codename, t in types if t is None],
+            )
+
+        bits, ids = found
+        mask = 0
+        for id_ in ids.values():
+            mask |= 1 << id_
+
+        denied, approval, missing = bits.evaluate(mask)
+        return (
+            [codename for codename in codenames if denied >> ids[codename] & 1],
+            [codename for codename in codenames if approval >> ids[codename] & 1],
+            [codename for codename in codenames if missing >> ids[codename] & 1],
+        )
+
+    def check_all(self, codenames: Iterable[str]) -> Optional[str]:
+        """
+        Like `check`, for a list of codenames that must all be granted.
+        """
+        denied, approval, missing = self.evaluate(codenames)
+        if denied:
+            raise PermissionError(f"Access denied for permission: {', '.join(denied)}")
+        if missing:
+            raise PermissionError(
+                f"Permission {', '.join(missing)} not found. Access denied by default."
+            )
+        if approval:
+            return f"Permission {', '.join(approval)} approval required before proceeding."
+        return None
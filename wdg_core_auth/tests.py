@@ -1,3 +1,2176 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+import jwt
+import redis
+import redis.asyncio as aioredis
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from asgiref.sync import async_to_sync
+from jwt import ExpiredSignatureError, InvalidTokenError
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.viewsets import ViewSet
+
+from wdg_core_auth import approval, clients, invalidation, metrics, registry, shm, utils
+from wdg_core_auth.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from wdg_core_auth.cache import LocalCache
+from wdg_core_auth.constants import PermissionOption
+from wdg_core_auth.decorators import (
+    check_permission,
+    is_permission_denied_or_needs_approval,
+    is_permission_denied_or_needs_approval_v2,
+    is_permission_denied_or_needs_approval_v3,
+)
+from wdg_core_auth.expressions import (
+    ALL_OF,
+    ANY_OF,
+    all_of,
+    any_of,
+    compile_expression,
+    parse_expression,
+)
+from wdg_core_auth.index import CodenameTrie, PermissionIndex
+from wdg_core_auth.keys import KeyProvider
+from wdg_core_auth.middleware import get_request_permissions
+from wdg_core_auth.mixins import ActionPermissionMixin
+from wdg_core_auth.registry import PermissionBits
+from wdg_core_auth.selectors import FetchPermissionSelector
+from wdg_core_auth.snapshot import PermissionSnapshot
+from wdg_core_auth.views import PermissionCheckView, metrics_view
+from wdg_core_auth.warmup import warm_permissions
+
+try:
+    import fakeredis
+except ImportError:  # optional test dependency
+    fakeredis = None
+
+ALLOWED = PermissionOption.ALLOWED
+DENIED = PermissionOption.DENIED
+APPROVAL = PermissionOption.APPROVAL_REQUIRED
+
+
+def node(codename, perm_type=ALLOWED, children=None):
+    return {"codename": codename, "type": perm_type, "children": children or []}
+
+
+def outcome(func, *args):
+    """
+    (returned value, PermissionError message) of `func(*args)`.
+    """
+    try:
+        return func(*args), None
+    except PermissionError as e:
+        return None, str(e)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for condition.")
+        time.sleep(0.01)
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class FakeRedisTestCase(SimpleTestCase):
+    """
+    Points `get_redis_client()` (and the async client) at a fresh fakeredis server.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server)
+
+        def build_redis_client(asyncio_client=False):
+            if asyncio_client:
+                return fakeredis.FakeAsyncRedis(server=self.server)
+            return self.redis
+
+        patcher = mock.patch.object(utils, "build_redis_client", build_redis_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        utils.reset_redis_clients()
+        self.addCleanup(utils.reset_redis_clients)
+
+
+class StubAuthService(ThreadingHTTPServer):
+    """
+    Auth service answering every GET with `permissions` after `delay` seconds.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, permissions=None, delay=0.0):
+        self.permissions = permissions if permissions is not None else [node("a")]
+        self.delay = delay
+        self.status = 200
+        self.calls = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), StubAuthHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubAuthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.calls += 1
+        time.sleep(self.server.delay)
+        body = json.dumps(self.server.permissions).encode()
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_request(user_id=1, **claims):
+    """
+    Request whose user carries an already verified token, as DRF leaves it.
+    """
+    token = {"user_id": user_id, **claims}
+    user = SimpleNamespace(is_authenticated=True, id=user_id, token=token)
+    return SimpleNamespace(headers={"Authorization": f"Bearer {user_id}"}, META={}, user=user)
+
+
+def generate_key():
+    """
+    A new RSA private key and its public key in PEM.
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.public_key().public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+    return private_key, pem.decode()
+
+
+def sign(private_key, kid=None, **claims):
+    return jwt.encode(
+        claims, private_key, algorithm="RS256", headers={"kid": kid} if kid else None
+    )
+
+
+class SelectorTestCase(FakeRedisTestCase):
+    """
+    FakeRedisTestCase with empty in-process caches and a fresh codename registry.
+    """
+
+    def setUp(self):
+        super().setUp()
+        for name in ("_local_cache", "_snapshot_cache", "_negative_cache", "_last_good_cache"):
+            patcher = mock.patch.object(FetchPermissionSelector, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(registry, "_registry", registry.CodenameRegistry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = override_settings(AUTH_PERMISSION_INVALIDATION_ENABLED=False)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def start_auth_service(self, permissions=None, delay=0.0):
+        service = StubAuthService(permissions, delay)
+        self.addCleanup(service.stop)
+        patcher = override_settings(AUTH_SERVICE_BASE_URL=service.url)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        return service
+
+
+def random_tree(rng, codenames, depth=3, width=4):
+    types = (ALLOWED, DENIED, APPROVAL, "unknown", None)
+    return [
+        node(
+            rng.choice(codenames),
+            rng.choice(types),
+            random_tree(rng, codenames, depth - 1, width) if depth > 1 else None,
+        )
+        for _ in range(rng.randint(0, width))
+    ]
+
+
+class PermissionIndexLegacyTests(SimpleTestCase):
+    LEGACY = {
+        PermissionIndex.V1: is_permission_denied_or_needs_approval,
+        PermissionIndex.V2: is_permission_denied_or_needs_approval_v2,
+        PermissionIndex.V3: is_permission_denied_or_needs_approval_v3,
+    }
+
+    def assertSameOutcome(self, permissions, codename):
+        index = PermissionIndex.from_permissions(permissions)
+        for version, legacy in self.LEGACY.items():
+            self.assertEqual(
+                outcome(index.check, codename, version),
+                outcome(legacy, permissions, codename),
+                f"v{version} {codename} {permissions}",
+            )
+
+    def test_matches_legacy_evaluators_on_random_trees(self):
+        rng = random.Random(13)
+        codenames = ["a", "b", "c", "d"]
+        for _ in range(2000):
+            permissions = random_tree(rng, codenames)
+            for codename in codenames + ["missing"]:
+                self.assertSameOutcome(permissions, codename)
+
+    def test_v1_allowed_match_does_not_end_search(self):
+        permissions = [node("x", children=[node("a")]), node("a", DENIED)]
+        self.assertSameOutcome(permissions, "a")
+        with self.assertRaises(PermissionError):
+            PermissionIndex.from_permissions(permissions).check("a", PermissionIndex.V1)
+
+    def test_v1_skips_siblings_after_allowed_match(self):
+        permissions = [node("x", children=[node("a"), node("a", DENIED)])]
+        self.assertSameOutcome(permissions, "a")
+        self.assertIsNone(
+            PermissionIndex.from_permissions(permissions).check("a", PermissionIndex.V1)
+        )
+
+    def test_v1_does_not_descend_into_match(self):
+        permissions = [node("a", children=[node("a", APPROVAL)])]
+        self.assertSameOutcome(permissions, "a")
+
+    def test_v2_reports_allowed_as_not_found(self):
+        index = PermissionIndex.from_permissions([node("a")])
+        with self.assertRaisesMessage(PermissionError, "not found"):
+            index.check("a", PermissionIndex.V2)
+        self.assertIsNone(index.check("a", PermissionIndex.V3))
+
+
+class InvalidationTests(FakeRedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.local = LocalCache(maxsize=16, ttl=60)
+        invalidation.register_local_cache(self.local)
+        self.addCleanup(invalidation.unregister_local_cache, self.local)
+
+    def cache(self, key, user_id, role):
+        tags = [invalidation.user_tag(user_id), invalidation.role_tag(role)]
+        utils.set_cached_snapshot(key, f"snap-{key}", [node("a")], ttl=60, tags=tags)
+        self.local.set(key, "snapshot", tags=tags)
+
+    def test_invalidate_by_user_deletes_tagged_keys(self):
+        self.cache("permissions:1", user_id=1, role="admin")
+        self.cache("permissions:2", user_id=2, role="admin")
+
+        invalidation.invalidate_permissions(user_id=1)
+
+        self.assertFalse(self.redis.exists("permissions:1"))
+        self.assertTrue(self.redis.exists("permissions:2"))
+        self.assertFalse(self.redis.exists(f"{utils.TAG_KEY_PREFIX}user:1"))
+        self.assertNotIn("permissions:1", self.local)
+        self.assertIn("permissions:2", self.local)
+
+    def test_invalidate_by_role_deletes_every_member(self):
+        self.cache("permissions:1", user_id=1, role="admin")
+        self.cache("permissions:2", user_id=2, role="admin")
+        self.cache("permissions:3", user_id=3, role="staff")
+
+        invalidation.invalidate_permissions(role="admin")
+
+        self.assertEqual(self.redis.exists("permissions:1", "permissions:2"), 0)
+        self.assertTrue(self.redis.exists("permissions:3"))
+        self.assertEqual(len(self.local), 1)
+
+    def test_invalidate_everything(self):
+        self.cache("permissions:1", user_id=1, role="admin")
+        self.redis.set("unrelated", 1)
+
+        invalidation.invalidate_permissions(everything=True)
+
+        self.assertEqual(self.redis.keys("permissions:*"), [])
+        self.assertTrue(self.redis.exists("unrelated"))
+        self.assertEqual(len(self.local), 0)
+
+    def test_invalidate_requires_a_target(self):
+        with self.assertRaises(ValueError):
+            invalidation.invalidate_permissions()
+
+    def test_listener_evicts_on_published_message(self):
+        channel = invalidation.get_channel()
+        listener = invalidation.InvalidationListener(channel)
+        listener.start()
+        self.addCleanup(listener.join, 5)
+        self.addCleanup(listener.stop)
+        wait_for(lambda: self.redis.pubsub_numsub(channel)[0][1] == 1)
+
+        self.local.set("permissions:1", "snapshot", tags=[invalidation.user_tag(1)])
+        self.local.set("permissions:2", "snapshot", tags=[invalidation.user_tag(2)])
+        # As published by another worker.
+        self.redis.publish(channel, json.dumps({"user_id": 1, "role": None, "all": False}))
+
+        wait_for(lambda: "permissions:1" not in self.local)
+        self.assertIn("permissions:2", self.local)
+
+    def test_subscribe_clears_only_process_caches(self):
+        shared = mock.Mock()
+        invalidation.register_local_cache(shared, host_wide=True)
+        self.addCleanup(invalidation.unregister_local_cache, shared)
+        self.local.set("permissions:1", "snapshot")
+
+        channel = invalidation.get_channel()
+        listener = invalidation.InvalidationListener(channel)
+        listener.start()
+        self.addCleanup(listener.join, 5)
+        self.addCleanup(listener.stop)
+        wait_for(lambda: "permissions:1" not in self.local)
+        shared.clear.assert_not_called()
+
+        # A published message still reaches the host-wide cache.
+        self.redis.publish(channel, json.dumps({"user_id": None, "role": None, "all": True}))
+        wait_for(lambda: shared.clear.called)
+
+    def test_listener_ignores_malformed_messages(self):
+        self.local.set("permissions:1", "snapshot", tags=[invalidation.user_tag(1)])
+        with self.assertLogs(level="WARNING"):
+            invalidation.InvalidationListener("channel").handle(b"not json")
+        self.assertIn("permissions:1", self.local)
+
+
+class LocalCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("wdg_core_auth.cache.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = LocalCache(maxsize=2, ttl=10)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.assertEqual(self.cache.get("a"), 1)  # "b" is now the oldest
+        self.cache.set("c", 3)
+
+        self.assertNotIn("b", self.cache)
+        self.assertEqual((self.cache.get("a"), self.cache.get("c")), (1, 3))
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_overwrite_does_not_evict(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.set("a", 3)
+        self.assertEqual((self.cache.get("a"), self.cache.get("b")), (3, 2))
+        self.assertEqual(self.cache.evictions, 0)
+
+    def test_entries_expire(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2, ttl=30)
+        self.now += 9.9
+        self.assertEqual(self.cache.get("a"), 1)
+        self.now += 0.1
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("a", "default"), "default")
+        self.assertEqual(self.cache.get("b"), 2)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.expirations, 1)
+
+    def test_stats(self):
+        self.cache.set("a", 1)
+        self.cache.get("a")
+        self.cache.get("missing")
+        self.now += 10
+        self.cache.get("a")
+        self.cache.set("b", 2)
+        self.cache.set("c", 3)
+        self.cache.set("d", 4)
+        self.assertEqual(
+            self.cache.stats(),
+            {"size": 2, "maxsize": 2, "hits": 1, "misses": 2, "evictions": 1, "expirations": 1},
+        )
+
+    def test_zero_size_stores_nothing(self):
+        cache = LocalCache(maxsize=0)
+        cache.set("a", 1)
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get("a"))
+
+    def test_delete_tagged(self):
+        self.cache.set("a", 1, tags=["user:1"])
+        self.cache.set("b", 2, tags=["user:2"])
+        self.assertEqual(self.cache.delete_tagged("user:1"), 1)
+        self.assertNotIn("a", self.cache)
+        self.assertIn("b", self.cache)
+
+
+class CoalescingTests(SelectorTestCase):
+    def fetch_concurrently(self, count=20):
+        start = threading.Barrier(count)
+        results = []
+
+        def fetch():
+            start.wait()
+            results.append(FetchPermissionSelector(make_request()).fetch_snapshot())
+
+        threads = [threading.Thread(target=fetch) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(len(results), count)
+        return results
+
+    def test_concurrent_misses_make_one_upstream_call(self):
+        service = self.start_auth_service([node("a", children=[node("b", DENIED)])], delay=0.2)
+
+        results = self.fetch_concurrently()
+
+        self.assertEqual(service.calls, 1)
+        self.assertEqual(len({id(snapshot) for snapshot in results}), 1)
+        self.assertIsNone(results[0].check("a"))
+
+    @override_settings(AUTH_PERMISSION_LOCAL_CACHE_SIZE=0)
+    def test_waiters_read_redis_without_local_cache(self):
+        service = self.start_auth_service(delay=0.2)
+
+        results = self.fetch_concurrently()
+
+        self.assertEqual(service.calls, 1)
+        self.assertTrue(all(snapshot is not None for snapshot in results))
+
+
+class CachedJsonTests(FakeRedisTestCase):
+    def test_redis_down_is_a_miss(self):
+        self.server.connected = False
+        self.assertIsNone(utils.get_cached_json("permissions:1"))
+        self.assertEqual(utils.get_cached_json_with_ttl("permissions:1"), (None, None))
+
+    def test_undecodable_entry_is_deleted(self):
+        self.redis.set("permissions:1", b"\x00Wgarbage")
+        self.assertEqual(utils.get_cached_json_with_ttl("permissions:1"), (None, None))
+        self.assertFalse(self.redis.exists("permissions:1"))
+
+        self.redis.set("permissions:1", b"{not json")
+        self.assertIsNone(utils.get_cached_json("permissions:1"))
+        self.assertFalse(self.redis.exists("permissions:1"))
+
+    def test_async_redis_down_is_a_miss(self):
+        self.server.connected = False
+        self.assertEqual(
+            asyncio.run(utils.aget_cached_json_with_ttl("permissions:1")), (None, None)
+        )
+
+    def test_async_undecodable_entry_is_deleted(self):
+        self.redis.set("permissions:1", b"{not json")
+        self.assertIsNone(asyncio.run(utils.aget_cached_json("permissions:1")))
+        self.assertFalse(self.redis.exists("permissions:1"))
+
+    def test_round_trip_with_ttl(self):
+        utils.set_cached_json("permissions:1", {"a": 1}, ttl=60)
+        value, ttl = utils.get_cached_json_with_ttl("permissions:1")
+        self.assertEqual(value, {"a": 1})
+        self.assertTrue(0 < ttl <= 60)
+
+
+class CodecTests(SimpleTestCase):
+    value = {"user_id": 1, "permissions": [{"codename": "orders.view", "type": 1}]}
+
+    def header(self, data):
+        return utils._CODEC_HEADER.unpack_from(data, 0)
+
+    def test_round_trip(self):
+        for name in ("json", "msgpack"):
+            with self.subTest(codec=name), override_settings(AUTH_CACHE_CODEC=name):
+                data = utils.encode_value(self.value)
+                _, version, codec_id, flags = self.header(data)
+                self.assertEqual(
+                    (version, codec_id, flags),
+                    (utils.CODEC_FORMAT_VERSION, utils.CACHE_CODECS[name].codec_id, 0),
+                )
+                self.assertEqual(utils.decode_value(data), self.value)
+
+    def test_msgpack_entry_decodes_under_json_setting(self):
+        data = utils.encode_value(self.value, utils.CACHE_CODECS["msgpack"])
+        with override_settings(AUTH_CACHE_CODEC="json"):
+            self.assertEqual(utils.decode_value(data), self.value)
+
+    def test_unavailable_codec_falls_back_to_json(self):
+        with override_settings(AUTH_CACHE_CODEC="missing"), self.assertLogs(level="WARNING"):
+            data = utils.encode_value(self.value)
+        self.assertEqual(self.header(data)[2], utils.CACHE_CODECS["json"].codec_id)
+
+    def test_legacy_json_entry(self):
+        self.assertEqual(utils.decode_value(json.dumps(self.value)), self.value)
+        self.assertEqual(utils.decode_value(json.dumps(self.value).encode()), self.value)
+
+    def test_compression_threshold(self):
+        value = {"codenames": ["orders.view"] * 100}
+        size = len(utils.CACHE_CODECS["json"].dumps(value))
+
+        with override_settings(AUTH_CACHE_COMPRESS_THRESHOLD=size):
+            self.assertEqual(self.header(utils.encode_value(value))[3], 0)
+        for threshold in (size - 1, 0):
+            with override_settings(AUTH_CACHE_COMPRESS_THRESHOLD=threshold):
+                data = utils.encode_value(value)
+                self.assertEqual(self.header(data)[3], utils.FLAG_ZLIB)
+                self.assertLess(len(data), size)
+                self.assertEqual(utils.decode_value(data), value)
+        with override_settings(AUTH_CACHE_COMPRESS_THRESHOLD=None):
+            self.assertEqual(self.header(utils.encode_value(value))[3], 0)
+
+    def test_incompressible_payload_is_stored_raw(self):
+        value = {"a": 1}  # zlib output would be larger than the payload
+        with override_settings(AUTH_CACHE_COMPRESS_THRESHOLD=0):
+            data = utils.encode_value(value)
+        self.assertEqual(self.header(data)[3], 0)
+        self.assertEqual(utils.decode_value(data), value)
+
+    def test_unknown_header_is_rejected(self):
+        payload = utils.encode_value(self.value)[utils._CODEC_HEADER.size:]
+        headers = ((utils.CODEC_FORMAT_VERSION + 1, 1), (utils.CODEC_FORMAT_VERSION, 99))
+        for version, codec_id in headers:
+            data = utils._CODEC_HEADER.pack(utils.CODEC_MAGIC, version, codec_id, 0) + payload
+            with self.subTest(version=version, codec_id=codec_id):
+                with self.assertRaisesRegex(ValueError, "Unsupported cache entry"):
+                    utils.decode_value(data)
+
+    def test_corrupt_entry_is_rejected(self):
+        header = utils._CODEC_HEADER.pack(
+            utils.CODEC_MAGIC, utils.CODEC_FORMAT_VERSION, 1, utils.FLAG_ZLIB
+        )
+        for data in (utils.CODEC_MAGIC + b"\x01", header + b"not zlib"):
+            with self.subTest(data=data):
+                with self.assertRaisesRegex(ValueError, "Corrupt cache entry"):
+                    utils.decode_value(data)
+
+
+class RedisClientTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        utils.reset_redis_clients()
+        self.addCleanup(utils.reset_redis_clients)
+
+    def test_parse_sentinel_url(self):
+        self.assertEqual(
+            utils.parse_sentinel_url("redis+sentinel://:s%40cret@s1:26380,s2/mymaster/2"),
+            ([("s1", 26380), ("s2", 26379)], "mymaster", {"db": 2, "password": "s@cret"}),
+        )
+        self.assertEqual(
+            utils.parse_sentinel_url("redis+sentinel://app:pw@s1/mymaster"),
+            ([("s1", 26379)], "mymaster", {"db": 0, "username": "app", "password": "pw"}),
+        )
+        with self.assertRaisesRegex(ValueError, "master service"):
+            utils.parse_sentinel_url("redis+sentinel://s1:26379")
+
+    @override_settings(AUTH_REDIS_URL="redis://cache:6380/1", AUTH_REDIS_MAX_CONNECTIONS=7)
+    def test_plain_url(self):
+        client = utils.build_redis_client()
+        self.assertIsInstance(client, redis.Redis)
+        kwargs = client.connection_pool.connection_kwargs
+        self.assertEqual((kwargs["host"], kwargs["port"], kwargs["db"]), ("cache", 6380, 1))
+        self.assertEqual(client.connection_pool.max_connections, 7)
+        self.assertIsInstance(utils.build_redis_client(asyncio_client=True), aioredis.Redis)
+
+    @override_settings(AUTH_REDIS_URL="rediss://cache:6380/0", AUTH_REDIS_SSL_CA_CERTS="/ca.pem")
+    def test_tls_options(self):
+        options = utils.get_redis_options(utils.get_redis_url())
+        self.assertEqual(
+            (options["ssl"], options["ssl_cert_reqs"], options["ssl_ca_certs"]),
+            (True, "required", "/ca.pem"),
+        )
+
+    @override_settings(
+        AUTH_REDIS_URL="redis+sentinel://s1:26380,s2/mymaster/2",
+        AUTH_REDIS_SENTINEL_PASSWORD="sentinel-pw",
+    )
+    def test_sentinel_url(self):
+        for module, asyncio_client in (("redis.sentinel", False), ("redis.asyncio.sentinel", True)):
+            with self.subTest(module=module), mock.patch(f"{module}.Sentinel") as sentinel:
+                client = utils.build_redis_client(asyncio_client=asyncio_client)
+                self.assertIs(client, sentinel.return_value.master_for.return_value)
+                sentinel.return_value.master_for.assert_called_once_with("mymaster")
+                args, kwargs = sentinel.call_args
+                self.assertEqual(args, ([("s1", 26380), ("s2", 26379)],))
+                self.assertEqual(kwargs["db"], 2)
+                self.assertEqual(kwargs["sentinel_kwargs"]["password"], "sentinel-pw")
+
+    def test_cluster_url(self):
+        urls = {
+            "redis+cluster://node1:7000": ("redis://node1:7000", False),
+            "rediss+cluster://node1:7000": ("redis://node1:7000", True),
+        }
+        for url, (expected_url, ssl) in urls.items():
+            with self.subTest(url=url), override_settings(AUTH_REDIS_URL=url):
+                with mock.patch("redis.cluster.RedisCluster.from_url") as from_url:
+                    self.assertIs(utils.build_redis_client(), from_url.return_value)
+                args, kwargs = from_url.call_args
+                self.assertEqual(args, (expected_url,))
+                self.assertNotIn("health_check_interval", kwargs)
+                self.assertEqual(kwargs.get("ssl", False), ssl)
+
+    def test_client_is_created_lazily_once_per_process(self):
+        with mock.patch.object(utils, "build_redis_client", side_effect=object) as build:
+            build.assert_not_called()
+            client = utils.redis_client
+            self.assertIs(utils.get_redis_client(), client)
+            self.assertEqual(build.call_count, 1)
+
+            with mock.patch.object(utils.os, "getpid", return_value=os.getpid() + 1):
+                forked = utils.get_redis_client()
+                self.assertIs(utils.get_redis_client(), forked)
+            self.assertIsNot(forked, client)
+            self.assertEqual(build.call_count, 2)
+
+
+class RedisOutageTests(SelectorTestCase):
+    def test_fetches_upstream_when_redis_is_down(self):
+        service = self.start_auth_service()
+        self.server.connected = False
+
+        snapshot = FetchPermissionSelector(make_request()).fetch_snapshot()
+
+        self.assertEqual(service.calls, 1)
+        self.assertIsNone(snapshot.check("a"))
+
+
+ORDERS = [
+    node(
+        "order",
+        children=[
+            node("order.read"),
+            node("order.delete", DENIED),
+            node("order.approve", APPROVAL),
+        ],
+    )
+]
+
+
+class SnapshotBitsTests(SelectorTestCase):
+    def reset_registry(self):
+        """
+        Flush Redis and let another process start the next registry generation,
+        with ids that differ from the ones the cached bits were encoded with.
+        """
+        self.redis.flushall()
+        registry.CodenameRegistry().register_many(["x", "y", "order.delete", "other"])
+
+    def bits_only(self, snapshot):
+        return PermissionSnapshot(
+            snapshot_id=snapshot.snapshot_id,
+            bits=PermissionBits.from_bytes(snapshot.bits.to_bytes()),
+            loader=lambda: ORDERS,
+        )
+
+    def test_evaluate_uses_bits(self):
+        snapshot = PermissionSnapshot(ORDERS, "orders")
+        self.assertIsNotNone(snapshot.bits)
+        with mock.patch.object(PermissionSnapshot, "index", new_callable=mock.PropertyMock) as index:
+            result = snapshot.evaluate(["order.delete", "order.read", "order.approve"])
+        index.assert_not_called()
+        self.assertEqual(result, (["order.delete"], ["order.approve"], []))
+
+    def test_bits_only_snapshot_checks_without_loading(self):
+        snapshot = self.bits_only(PermissionSnapshot(ORDERS, "orders"))
+        self.assertIsNone(snapshot.check("order.read"))
+        with self.assertRaises(PermissionError):
+            snapshot.check("order.delete")
+        self.assertFalse(snapshot.loaded)
+
+    def test_evaluate_after_registry_reset(self):
+        snapshot = PermissionSnapshot(ORDERS, "orders")
+        snapshot.bits
+        self.reset_registry()
+
+        self.assertEqual(
+            snapshot.evaluate(["order.delete", "order.read", "other"]),
+            (["order.delete"], [], ["other"]),
+        )
+
+    def test_bits_only_snapshot_after_registry_reset(self):
+        snapshot = self.bits_only(PermissionSnapshot(ORDERS, "orders"))
+        self.reset_registry()
+
+        self.assertIsNone(snapshot.check("order.read"))
+        with self.assertRaises(PermissionError):
+            snapshot.check("order.delete")
+        self.assertEqual(
+            snapshot.evaluate(["order.delete", "order.approve", "other"]),
+            (["order.delete"], ["order.approve"], ["other"]),
+        )
+
+    def test_evaluate_after_registry_reset_noticed(self):
+        snapshot = PermissionSnapshot(ORDERS, "orders")
+        snapshot.bits
+        self.reset_registry()
+        PermissionSnapshot([node("other")]).bits  # this process moves to the new generation
+
+        self.assertEqual(
+            snapshot.evaluate(["order.delete", "order.read", "other"]),
+            (["order.delete"], [], ["other"]),
+        )
+
+    def test_bits_are_reencoded_in_the_new_generation(self):
+        snapshot = PermissionSnapshot(ORDERS, "orders")
+        old_bits = snapshot.bits
+        self.reset_registry()
+        PermissionSnapshot([node("other")]).bits
+
+        bits = snapshot.bits
+        codename_registry = registry.get_registry()
+        self.assertNotEqual(bits.generation, old_bits.generation)
+        self.assertEqual(bits.generation, codename_registry.generation)
+        for codename, perm_type in snapshot.index.typed_entries.items():
+            bit = 1 << codename_registry.get_id(codename)
+            self.assertEqual(bits.get_type(bit), perm_type)
+
+    def test_checks_do_not_register_codenames(self):
+        snapshot = PermissionSnapshot(ORDERS, "orders")
+        snapshot.bits
+
+        self.assertEqual(snapshot.evaluate(["nope.1", "nope.2"]), ([], [], ["nope.1", "nope.2"]))
+        with self.assertRaises(PermissionError):
+            self.bits_only(snapshot).check("nope.3")
+
+        for codename in ("nope.1", "nope.2", "nope.3"):
+            self.assertIsNone(self.redis.hget(registry.REGISTRY_KEY, codename))
+            self.assertIsNone(registry.get_registry().get_id(codename))
+
+    def test_async_check_does_not_use_sync_redis(self):
+        self.start_auth_service(ORDERS)
+        # A sync request caches the snapshot (and its bits) first.
+        FetchPermissionSelector(make_request()).fetch_snapshot()
+        FetchPermissionSelector._local_cache.clear()
+        FetchPermissionSelector._snapshot_cache.clear()
+
+        class View:
+            @check_permission(["order.read", "order.unknown"])
+            async def get(self, request):
+                return "ok"
+
+            @check_permission("order.approve")
+            async def post(self, request):
+                return "ok"
+
+        request = make_request()
+        request.headers = {**request.headers, "X-Approval-Token": "invalid"}
+        no_sync_redis = mock.Mock(side_effect=AssertionError("sync Redis on the event loop"))
+        with mock.patch.object(utils, "get_redis_client", no_sync_redis), mock.patch.object(
+            registry, "get_redis_client", no_sync_redis
+        ):
+            denied = asyncio.run(View().get(request))
+            needs_approval = asyncio.run(View().post(request))
+
+        self.assertEqual(denied.status_code, 403)
+        self.assertIn("order.unknown not found", json.loads(denied.content)["detail"])
+        self.assertEqual(needs_approval.status_code, 401)
+        self.assertEqual(json.loads(needs_approval.content), {"detail": "Invalid token."})
+
+
+@override_settings(AUTH_PERMISSION_LOCAL_CACHE_SIZE=0, AUTH_PERMISSION_CACHE_ENABLED=True)
+class SnapshotSharingTests(SelectorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self.start_auth_service(ORDERS)
+
+    def fetch(self, user_id):
+        selector = FetchPermissionSelector(make_request(user_id))
+        return selector._get_cache_key(), selector.fetch_snapshot()
+
+    def snapshot_keys(self):
+        return sorted(key.decode() for key in self.redis.keys(f"{utils.SNAPSHOT_KEY_PREFIX}*"))
+
+    def test_identical_trees_share_one_snapshot(self):
+        first_key, first = self.fetch(1)
+        second_key, second = self.fetch(2)
+
+        self.assertNotEqual(first_key, second_key)
+        self.assertIs(second, first)  # interned in this process too
+        self.assertEqual(self.snapshot_keys(), [f"{utils.SNAPSHOT_KEY_PREFIX}{first.snapshot_id}"])
+        self.assertEqual(len(self.redis.keys(f"{utils.BITS_KEY_PREFIX}*")), 1)
+        for key in (first_key, second_key):
+            self.assertEqual(utils.get_cached_json(key), {"snapshot_id": first.snapshot_id})
+
+    def test_different_trees_get_their_own_snapshot(self):
+        _, first = self.fetch(1)
+        self.service.permissions = ORDERS + [node("invoice")]
+        _, second = self.fetch(2)
+
+        self.assertNotEqual(second.snapshot_id, first.snapshot_id)
+        self.assertEqual(len(self.snapshot_keys()), 2)
+
+    def test_shared_snapshot_resolves_from_redis(self):
+        _, first = self.fetch(1)
+        self.fetch(2)
+        FetchPermissionSelector.get_snapshot_cache().clear()
+
+        _, snapshot = self.fetch(2)
+        self.assertEqual(snapshot.snapshot_id, first.snapshot_id)
+        self.assertEqual(snapshot.permissions, ORDERS)
+        self.assertEqual(self.service.calls, 2)
+
+
+class ExpressionTests(SimpleTestCase):
+    snapshot = PermissionSnapshot(
+        [
+            node("order.read"),
+            node("order.update", DENIED),
+            node("order.approve", APPROVAL),
+            node("order.export", APPROVAL),
+        ]
+    )
+
+    def evaluate(self, spec):
+        return compile_expression(spec).evaluate(self.snapshot)
+
+    def test_parse_precedence(self):
+        self.assertEqual(
+            parse_expression("a | b & c").tree,
+            (ANY_OF, ((None, "a"), (ALL_OF, ((None, "b"), (None, "c"))))),
+        )
+        self.assertEqual(
+            parse_expression("(a or b) and c").tree,
+            (ALL_OF, ((ANY_OF, ((None, "a"), (None, "b"))), (None, "c"))),
+        )
+        self.assertEqual(parse_expression(" a ").tree, (None, "a"))
+
+    def test_nested_groups_are_flattened(self):
+        self.assertEqual(
+            compile_expression(all_of("a", all_of("b", "c"), any_of("d"))).tree,
+            (ALL_OF, ((None, "a"), (None, "b"), (None, "c"), (None, "d"))),
+        )
+        self.assertEqual(compile_expression(["a", "b | c"]).codenames, ("a", "b", "c"))
+
+    def test_invalid_expressions(self):
+        for spec in ("", "a &", "& a", "(a | b", "a | b)", "a b", [], {"none_of": ["a"]}, 1):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                compile_expression(spec)
+
+    def test_all_of(self):
+        self.assertTrue(self.evaluate(["order.read"]).allowed)
+
+        result = self.evaluate("order.read & order.approve & order.export")
+        self.assertEqual(result.outcome, APPROVAL)
+        self.assertEqual(result.approval, ["order.approve", "order.export"])
+
+        result = self.evaluate("order.approve & order.update & order.missing")
+        self.assertEqual(result.outcome, DENIED)
+        self.assertEqual((result.denied, result.missing), (["order.update"], ["order.missing"]))
+        with self.assertRaisesMessage(PermissionError, "Access denied for permission: order.update"):
+            result.check()
+
+    def test_any_of(self):
+        self.assertTrue(self.evaluate("order.update | order.read").allowed)
+
+        result = self.evaluate(any_of("order.update", "order.export", "order.approve"))
+        self.assertEqual(result.outcome, APPROVAL)
+        self.assertEqual(result.approval, ["order.export"])
+        self.assertEqual(
+            result.check(), "Permission order.export approval required before proceeding."
+        )
+
+        result = self.evaluate("order.missing | order.gone")
+        with self.assertRaisesMessage(PermissionError, "order.missing, order.gone not found"):
+            result.check()
+
+    def test_mixed(self):
+        self.assertTrue(self.evaluate("order.read & (order.update | order.read)").allowed)
+        self.assertEqual(
+            self.evaluate("order.read & (order.update | order.approve)").approval,
+            ["order.approve"],
+        )
+
+
+class WildcardTests(SimpleTestCase):
+    def test_trie_lookup(self):
+        trie = CodenameTrie()
+        self.assertEqual(len(trie), 0)
+        trie.insert("product.*", ALLOWED)
+        trie.insert("product.variant.*", DENIED)
+        trie.insert("product.*", DENIED)  # first occurrence wins
+        self.assertEqual(len(trie), 2)
+
+        self.assertEqual(trie.lookup("product.read"), ALLOWED)
+        self.assertEqual(trie.lookup("product.variant.read"), DENIED)
+        self.assertEqual(trie.lookup("product.variant.price.read"), DENIED)
+        self.assertIsNone(trie.lookup("product"))
+        self.assertIsNone(trie.lookup("order.read"))
+
+        trie.insert("*", APPROVAL)
+        self.assertEqual(trie.lookup("order.read"), APPROVAL)
+        self.assertEqual(trie.lookup("product.read"), ALLOWED)
+
+    def test_index_prefers_exact_then_longest_wildcard(self):
+        index = PermissionIndex.from_permissions(
+            [
+                node("product.*"),
+                node("product.delete", DENIED),
+                node("product.variant.*", APPROVAL),
+                node("*", DENIED),
+            ]
+        )
+        self.assertTrue(index.has_wildcards)
+        self.assertIsNone(index.check("product.read"))
+        self.assertEqual(index.get_type("product.variant.read"), APPROVAL)
+        with self.assertRaises(PermissionError):
+            index.check("product.delete")
+        with self.assertRaisesMessage(PermissionError, "Access denied for permission: order.read"):
+            index.check("order.read")
+
+    def test_untyped_wildcards_are_ignored(self):
+        index = PermissionIndex.from_permissions([node("product.*", "unknown")])
+        self.assertFalse(index.has_wildcards)
+        with self.assertRaisesMessage(PermissionError, "not found"):
+            index.check("product.read")
+
+    def test_snapshot_with_wildcards_uses_the_index(self):
+        snapshot = PermissionSnapshot([node("product.*"), node("product.delete", DENIED)])
+        self.assertIsNone(snapshot.bits)
+        self.assertEqual(
+            snapshot.evaluate(["product.read", "product.delete", "order.read"]),
+            (["product.delete"], [], ["order.read"]),
+        )
+
+
+class InheritanceTests(SelectorTestCase):
+    TREE = [
+        node("order", DENIED, [node("order.read"), node("order.note", children=[node("x")])]),
+        node("invoice", APPROVAL, [node("invoice.read"), node("invoice.void", DENIED)]),
+    ]
+
+    def test_without_inheritance_children_keep_their_type(self):
+        index = PermissionIndex.from_permissions(self.TREE)
+        self.assertEqual(index.get_type("order.read"), ALLOWED)
+        self.assertEqual(index.get_type("invoice.read"), ALLOWED)
+
+    def test_deny_inheritance(self):
+        index = PermissionIndex.from_permissions(self.TREE, inheritance=["deny"])
+        self.assertEqual(index.get_type("order.read"), DENIED)
+        self.assertEqual(index.get_type("x"), DENIED)
+        self.assertEqual(index.get_type("invoice.read"), ALLOWED)
+
+    def test_approval_inheritance_keeps_denials(self):
+        index = PermissionIndex.from_permissions(self.TREE, inheritance=["approval"])
+        self.assertEqual(index.get_type("invoice.read"), APPROVAL)
+        self.assertEqual(index.get_type("invoice.void"), DENIED)
+        self.assertEqual(index.get_type("order.read"), ALLOWED)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            PermissionIndex.from_permissions(self.TREE, inheritance=["everything"])
+
+    def test_bits_record_inheritance(self):
+        with override_settings(AUTH_PERMISSION_INHERITANCE=("deny", "approval")):
+            bits = PermissionSnapshot(self.TREE).bits
+        decoded = PermissionBits.from_bytes(bits.to_bytes())
+        self.assertEqual(decoded.inheritance, {"deny", "approval"})
+        self.assertEqual(decoded.generation, bits.generation)
+
+    def test_bits_from_other_modes_are_ignored(self):
+        bits = PermissionBits.from_bytes(PermissionSnapshot(self.TREE, "tree").bits.to_bytes())
+
+        with override_settings(AUTH_PERMISSION_INHERITANCE=("deny",)):
+            snapshot = PermissionSnapshot(snapshot_id="tree", bits=bits, loader=lambda: self.TREE)
+            with self.assertRaises(PermissionError):
+                snapshot.check("order.read")
+            self.assertEqual(snapshot.evaluate(["order.read", "x"]), (["order.read", "x"], [], []))
+            self.assertEqual(snapshot.bits.inheritance, {"deny"})
+
+            selector = FetchPermissionSelector(make_request())
+            self.assertIsNone(selector._snapshot_from_bits("tree", bits.to_bytes()))
+
+
+class RequestPermissionsTests(SelectorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self.start_auth_service(ORDERS)
+
+    def test_fetches_once_per_request(self):
+        request = make_request()
+        permissions = get_request_permissions(request)
+        self.assertIs(get_request_permissions(request), permissions)
+        self.assertEqual((permissions.fetch_count, permissions.hit_count), (0, 0))
+
+        self.assertEqual(outcome(permissions.check, "order.read"), (None, None))
+        self.assertIsNotNone(outcome(permissions.check, "order.delete")[1])
+        self.assertIn("approval required", permissions.check_all(["order.read", "order.approve"]))
+        self.assertIs(permissions.index, permissions.get_snapshot().index)
+
+        self.assertEqual((permissions.fetch_count, permissions.hit_count), (1, 4))
+        self.assertEqual(self.service.calls, 1)
+
+    def test_each_request_fetches_its_own(self):
+        first = get_request_permissions(make_request())
+        second = get_request_permissions(make_request())
+        first.check("order.read")
+        second.check("order.read")
+        self.assertEqual((first.fetch_count, second.fetch_count), (1, 1))
+
+    def test_drf_request_shares_the_django_request(self):
+        http_request = RequestFactory().get("/")
+        permissions = get_request_permissions(Request(http_request))
+        self.assertIs(get_request_permissions(http_request), permissions)
+        self.assertIs(http_request.permissions, permissions)
+
+    def test_async_access_is_memoized(self):
+        permissions = get_request_permissions(make_request())
+
+        async def check():
+            first = await permissions.aget_snapshot()
+            self.assertIs(await permissions.aget_snapshot(), first)
+            self.assertIs(permissions.get_snapshot(), first)
+
+        asyncio.run(check())
+        self.assertEqual((permissions.fetch_count, permissions.hit_count), (1, 2))
+        self.assertEqual(self.service.calls, 1)
+
+    def test_failed_fetch_is_not_retried(self):
+        self.service.status = 503
+        permissions = get_request_permissions(make_request())
+        with self.assertLogs(level="ERROR"):
+            self.assertIsNone(permissions.get_snapshot())
+        self.assertIsNone(permissions.permissions)
+        self.assertEqual((permissions.fetch_count, permissions.hit_count), (1, 1))
+
+
+class PermissionCheckViewTests(SelectorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start_auth_service(ORDERS)
+        self.factory = APIRequestFactory()
+
+    def check(self, codenames):
+        request = self.factory.post(
+            "/permissions/check",
+            {"codenames": codenames},
+            format="json",
+            HTTP_AUTHORIZATION="Bearer token",
+        )
+        return PermissionCheckView.as_view()(request)
+
+    def test_decisions(self):
+        response = self.check(["order.read", "order.delete", "order.approve", "order.nope"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["permissions"],
+            {
+                "order.read": ALLOWED,
+                "order.delete": DENIED,
+                "order.approve": APPROVAL,
+                "order.nope": "not_found",
+            },
+        )
+
+    def test_unknown_codenames_are_not_registered(self):
+        codenames = [f"random.{i}" for i in range(50)]
+        response = self.check(codenames)
+
+        self.assertEqual(set(response.data["permissions"].values()), {"not_found"})
+        registered = {key.decode() for key in self.redis.hkeys(registry.REGISTRY_KEY)}
+        self.assertFalse(registered.intersection(codenames))
+        self.assertIsNone(registry.get_registry().get_id("random.0"))
+
+    @override_settings(AUTH_PERMISSION_CHECK_MAX_CODENAMES=2)
+    def test_too_many_codenames(self):
+        self.assertEqual(self.check(["a", "b", "c"]).status_code, 400)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("wdg_core_auth.breaker.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("auth", failure_threshold=2, recovery_timeout=10)
+
+    def open_breaker(self):
+        with self.assertLogs(level="WARNING"):
+            for _ in range(2):
+                self.assertTrue(self.breaker.allow_request())
+                self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_opens_and_recovers(self):
+        self.open_breaker()
+        self.assertFalse(self.breaker.allow_request())
+
+        self.now += 10
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())  # one probe at a time
+        with self.assertLogs(level="WARNING"):
+            self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        self.now += 10
+        self.assertTrue(self.breaker.allow_request())
+        with self.assertLogs(level="WARNING"):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_probe_without_result_times_out(self):
+        self.open_breaker()
+        self.now += 10
+        self.assertTrue(self.breaker.allow_request())  # never reports back
+
+        self.now += 9
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.now += 1
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.times_opened, 2)
+
+        self.now += 10
+        self.assertTrue(self.breaker.allow_request())
+
+
+class FallbackTests(SelectorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self.start_auth_service(ORDERS)
+        patcher = override_settings(
+            AUTH_PERMISSION_FALLBACK=FetchPermissionSelector.FALLBACK_LAST_KNOWN_GOOD,
+            AUTH_PERMISSION_LOCAL_CACHE_SIZE=0,
+            AUTH_PERMISSION_CACHE_ENABLED=True,
+        )
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.last_good = FetchPermissionSelector(make_request()).fetch_snapshot()
+        self.assertIsNotNone(self.last_good)
+        self.redis.flushall()  # the next request has to fetch again
+
+    def fetch(self):
+        with self.assertLogs(level="ERROR"):
+            return FetchPermissionSelector(make_request()).fetch_snapshot()
+
+    def test_server_error_serves_last_known_good(self):
+        self.service.status = 503
+        self.assertIs(self.fetch(), self.last_good)
+        # And while the failure is remembered.
+        self.assertIs(FetchPermissionSelector(make_request()).fetch_snapshot(), self.last_good)
+
+    def test_client_error_fails_closed(self):
+        self.service.status = 403
+        self.assertIsNone(self.fetch())
+        self.assertIsNone(FetchPermissionSelector(make_request()).fetch_snapshot())
+
+        # The remembered snapshot is gone, even for a later outage.
+        FetchPermissionSelector.get_negative_cache().clear()
+        self.service.status = 503
+        self.assertIsNone(self.fetch())
+
+    def test_open_circuit_serves_last_known_good(self):
+        FetchPermissionSelector(make_request()).get_breaker()._open(time.monotonic())
+        self.addCleanup(FetchPermissionSelector(make_request()).get_breaker().reset)
+        self.assertIs(FetchPermissionSelector(make_request()).fetch_snapshot(), self.last_good)
+        self.assertEqual(self.service.calls, 1)
+
+    def test_cancelled_fetch_is_recorded(self):
+        breaker = FetchPermissionSelector(make_request()).get_breaker()
+        failures = breaker.failures
+        client = mock.Mock()
+        client.get = mock.AsyncMock(side_effect=asyncio.CancelledError)
+
+        with mock.patch("wdg_core_auth.selectors.get_async_http_client", return_value=client):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(FetchPermissionSelector(make_request())._afetch("permissions"))
+
+        self.assertEqual(breaker.failures, failures + 1)
+
+
+class RevalidationTests(SelectorTestCase):
+    """
+    Conditional requests for an expired entry, against a mocked auth service.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.requests = []
+        self.responses = []
+        transport = httpx.MockTransport(self.handle)
+        client = httpx.Client(transport=transport)
+        self.addCleanup(client.close)
+        async_client = httpx.AsyncClient(transport=transport)
+        self.addCleanup(lambda: asyncio.run(async_client.aclose()))
+        for name, value in (("get_http_client", client), ("get_async_http_client", async_client)):
+            patcher = mock.patch(f"wdg_core_auth.selectors.{name}", return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = override_settings(
+            AUTH_SERVICE_BASE_URL="http://auth.test",
+            AUTH_PERMISSION_LOCAL_CACHE_SIZE=0,
+            AUTH_PERMISSION_CACHE_ENABLED=True,
+        )
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.cache_key = FetchPermissionSelector(make_request())._get_cache_key()
+
+    def handle(self, request):
+        self.requests.append(request)
+        return self.responses.pop(0)
+
+    def fetch(self, *responses):
+        self.responses.extend(responses)
+        return FetchPermissionSelector(make_request()).fetch_snapshot()
+
+    def expire(self):
+        # The entry expires; its validators and snapshot outlive it. The lock
+        # goes too (fakeredis without lupa cannot run the release script).
+        self.redis.delete(self.cache_key, f"{self.cache_key}:lock")
+
+    def validators(self):
+        return utils.get_cached_json(f"{self.cache_key}{utils.VALIDATORS_KEY_SUFFIX}")
+
+    def test_not_modified_reuses_snapshot(self):
+        first = self.fetch(httpx.Response(200, json=ORDERS, headers={"ETag": '"v1"'}))
+        self.expire()
+
+        second = self.fetch(httpx.Response(304, headers={"ETag": '"v1"'}))
+
+        self.assertEqual(self.requests[1].headers["If-None-Match"], '"v1"')
+        self.assertEqual(second.snapshot_id, first.snapshot_id)
+        self.assertEqual(second.permissions, ORDERS)
+        self.assertGreater(self.redis.ttl(self.cache_key), 0)  # the entry is back
+        self.assertEqual(self.validators()["snapshot_id"], first.snapshot_id)
+
+    def test_not_modified_without_cached_tree_downloads_again(self):
+        first = self.fetch(httpx.Response(200, json=ORDERS, headers={"ETag": '"v1"'}))
+        self.expire()
+        for prefix in (utils.SNAPSHOT_KEY_PREFIX, utils.BITS_KEY_PREFIX):
+            self.redis.delete(f"{prefix}{first.snapshot_id}")
+        FetchPermissionSelector.get_snapshot_cache().clear()
+
+        second = self.fetch(
+            httpx.Response(304, headers={"ETag": '"v1"'}),
+            httpx.Response(200, json=ORDERS, headers={"ETag": '"v1"'}),
+        )
+
+        self.assertNotIn("If-None-Match", self.requests[2].headers)
+        self.assertEqual(second.permissions, ORDERS)
+        self.assertEqual(second.snapshot_id, first.snapshot_id)
+
+    def test_changed_etag_stores_new_snapshot(self):
+        first = self.fetch(httpx.Response(200, json=ORDERS, headers={"ETag": '"v1"'}))
+        self.expire()
+        changed = ORDERS + [node("invoice")]
+
+        second = self.fetch(httpx.Response(200, json=changed, headers={"ETag": '"v2"'}))
+
+        self.assertEqual(self.requests[1].headers["If-None-Match"], '"v1"')
+        self.assertNotEqual(second.snapshot_id, first.snapshot_id)
+        self.assertEqual(second.permissions, changed)
+        self.assertEqual(self.validators()["etag"], '"v2"')
+        self.assertEqual(self.validators()["snapshot_id"], second.snapshot_id)
+
+        self.expire()
+        self.fetch(httpx.Response(304))
+        self.assertEqual(self.requests[2].headers["If-None-Match"], '"v2"')
+
+    def test_missing_validators_fetch_unconditionally(self):
+        self.fetch(httpx.Response(200, json=ORDERS))
+        self.assertIsNone(self.validators())
+        self.expire()
+
+        snapshot = self.fetch(httpx.Response(200, json=ORDERS))
+
+        self.assertNotIn("If-None-Match", self.requests[1].headers)
+        self.assertNotIn("If-Modified-Since", self.requests[1].headers)
+        self.assertEqual(snapshot.permissions, ORDERS)
+
+    def test_last_modified_only(self):
+        modified = "Wed, 14 Oct 2026 10:00:00 GMT"
+        first = self.fetch(httpx.Response(200, json=ORDERS, headers={"Last-Modified": modified}))
+        self.expire()
+
+        second = self.fetch(httpx.Response(304))
+
+        self.assertEqual(self.requests[1].headers["If-Modified-Since"], modified)
+        self.assertNotIn("If-None-Match", self.requests[1].headers)
+        self.assertEqual(second.snapshot_id, first.snapshot_id)
+
+    def test_async_not_modified_reuses_snapshot(self):
+        self.responses.append(httpx.Response(200, json=ORDERS, headers={"ETag": '"v1"'}))
+        first = asyncio.run(FetchPermissionSelector(make_request()).afetch_snapshot())
+        self.expire()
+
+        self.responses.append(httpx.Response(304, headers={"ETag": '"v1"'}))
+        second = asyncio.run(FetchPermissionSelector(make_request()).afetch_snapshot())
+
+        self.assertEqual(self.requests[1].headers["If-None-Match"], '"v1"')
+        self.assertEqual(second.snapshot_id, first.snapshot_id)
+        self.assertEqual(second.permissions, ORDERS)
+
+
+@override_settings(
+    AUTH_PERMISSION_CACHE_SOFT_TTL=60,
+    AUTH_PERMISSION_LOCAL_CACHE_SIZE=0,
+    AUTH_PERMISSION_CACHE_ENABLED=True,
+)
+class StaleWhileRevalidateTests(SelectorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self.start_auth_service(ORDERS)
+        self.executor = mock.Mock()
+        executor = mock.Mock(return_value=self.executor)
+        for name, value in (("get_refresh_executor", executor), ("_refreshing", set())):
+            patcher = mock.patch.object(FetchPermissionSelector, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.first = self.fetch()
+        self.cache_key = FetchPermissionSelector(make_request())._get_cache_key()
+        self.release_lock()
+
+    def release_lock(self):
+        # fakeredis without lupa cannot run the release script
+        self.redis.delete(f"{self.cache_key}:lock")
+
+    def fetch(self):
+        return FetchPermissionSelector(make_request()).fetch_snapshot()
+
+    def age(self, seconds):
+        self.redis.expire(self.cache_key, FetchPermissionSelector.CACHE_TTL - seconds)
+
+    def test_fresh_read_schedules_nothing(self):
+        self.age(59)
+        self.assertEqual(self.fetch().snapshot_id, self.first.snapshot_id)
+        self.executor.submit.assert_not_called()
+
+    def test_stale_read_schedules_one_refresh(self):
+        self.age(60)
+        snapshots = []
+        threads = [
+            threading.Thread(target=lambda: snapshots.append(self.fetch())) for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every reader got the stale entry without waiting for the auth service.
+        self.assertEqual({snapshot.snapshot_id for snapshot in snapshots}, {self.first.snapshot_id})
+        self.assertEqual(self.service.calls, 1)
+        self.executor.submit.assert_called_once()
+
+        refresh, *args = self.executor.submit.call_args.args
+        self.service.permissions = ORDERS + [node("invoice")]
+        refresh(*args)
+
+        self.assertEqual(self.service.calls, 2)
+        self.assertGreater(self.redis.ttl(self.cache_key), FetchPermissionSelector.CACHE_TTL - 60)
+        self.assertNotEqual(self.fetch().snapshot_id, self.first.snapshot_id)
+        self.assertEqual(FetchPermissionSelector._refreshing, set())
+
+    def test_next_stale_read_after_refresh_schedules_again(self):
+        self.age(60)
+        self.fetch()
+        refresh, *args = self.executor.submit.call_args.args
+        refresh(*args)
+        self.release_lock()
+
+        self.age(60)
+        self.fetch()
+        self.assertEqual(self.executor.submit.call_count, 2)
+
+
+class WarmupTests(SelectorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.paths = []
+        client = httpx.Client(transport=httpx.MockTransport(self.handle))
+        self.addCleanup(client.close)
+        patcher = mock.patch("wdg_core_auth.selectors.get_http_client", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = override_settings(AUTH_SERVICE_BASE_URL="http://auth.test")
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def handle(self, request):
+        self.paths.append(request.url.path)
+        return httpx.Response(200, json=ORDERS)
+
+    @staticmethod
+    def identity(user_id=1, **claims):
+        # Key claims that real tokens do not carry are given as None.
+        key_claims = FetchPermissionSelector.get_cache_key_claims()
+        return {"user_id": user_id, **dict.fromkeys(key_claims), **claims}
+
+    def test_endpoint_with_key_claims(self):
+        report = warm_permissions(
+            [self.identity(company_id=2), self.identity(company_id=3)],
+            "service",
+            endpoint="api/v1/companies/{company_id}/users/{user_id}/permissions",
+        )
+
+        self.assertEqual((report.written, report.failed), (2, 0))
+        self.assertEqual(
+            sorted(self.paths),
+            ["/api/v1/companies/2/users/1/permissions", "/api/v1/companies/3/users/1/permissions"],
+        )
+        cache_key = FetchPermissionSelector(make_request(1, company_id=2))._get_cache_key()
+        self.assertTrue(self.redis.exists(cache_key))
+
+    def test_endpoint_ignoring_key_claim_fails(self):
+        report = warm_permissions([self.identity(company_id=2)], "service")
+
+        self.assertEqual((report.written, report.failed), (0, 1))
+        self.assertIn("company_id", report.failures[0]["error"])
+        self.assertEqual(self.paths, [])
+
+    def test_missing_placeholder_claim_fails(self):
+        report = warm_permissions(
+            [self.identity()],
+            "service",
+            endpoint="api/v1/companies/{company_id}/users/{user_id}/permissions",
+        )
+
+        self.assertEqual(report.failed, 1)
+        self.assertIn("company_id", report.failures[0]["error"])
+        self.assertEqual(self.paths, [])
+
+    def test_default_endpoint_with_user_id_only(self):
+        report = warm_permissions([self.identity()], "service")
+
+        self.assertEqual(report.written, 1)
+        self.assertEqual(self.paths, ["/api/v1/users/1/permissions"])
+        self.assertTrue(self.redis.exists(FetchPermissionSelector(make_request())._get_cache_key()))
+
+    def test_missing_key_claims_fail(self):
+        # e.g. `warm_permissions --user 1` without --claims
+        report = warm_permissions([{"user_id": 1}, {"user_id": 2, "company_id": 2}], "service")
+
+        self.assertEqual((report.written, report.failed), (0, 2))
+        self.assertIn("branch_id", report.failures[0]["error"])
+        self.assertIn("role_id", report.failures[1]["error"])
+        self.assertNotIn("company_id", report.failures[1]["error"])
+        self.assertEqual(self.paths, [])
+
+
+class SharedCacheFileTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.base = os.path.join(directory.name, "permissions")
+        self.path = f"{self.base}-4x1024.v{shm.VERSION}"
+
+    def open(self):
+        cache = shm.SharedSnapshotCache(self.base, slots=4, slot_size=1024)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_creates_private_file(self):
+        cache = self.open()
+        cache.set("user:1", "ab" * 32, b"[]", ttl=60)
+
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(cache.get("user:1"), ("ab" * 32, b"[]"))
+
+    def slot_digests(self, cache, key):
+        digest = shm._key_digest(key)
+        return [
+            shm._SLOT_HEADER.unpack_from(cache._mm, offset)[2] == digest
+            for offset in cache._offsets(digest)
+        ]
+
+    def test_set_replaces_the_key_in_a_later_slot(self):
+        cache = self.open()
+
+        def start(key):
+            return next(iter(cache._offsets(shm._key_digest(key))))
+
+        first, second = "user:0", next(
+            key for key in (f"user:{i}" for i in range(1, 100)) if start(key) == start("user:0")
+        )
+        now = 1000.0
+        with mock.patch("wdg_core_auth.shm.time.time", lambda: now):
+            cache.set(first, "ab" * 32, b"first", ttl=10)
+            cache.set(second, "ab" * 32, b"old", ttl=60)  # probed past `first`
+            now += 10  # `first` expires, ahead of `second` in the probe order
+
+            cache.set(second, "cd" * 32, b"new", ttl=60)
+
+            self.assertEqual(self.slot_digests(cache, second).count(True), 1)
+            self.assertEqual(cache.get(second), ("cd" * 32, b"new"))
+
+    def test_rejects_symlink(self):
+        target = os.path.join(os.path.dirname(self.base), "target")
+        open(target, "wb").close()
+        os.chmod(target, 0o600)
+        os.symlink(target, self.path)
+
+        with self.assertRaises(OSError):
+            self.open()
+        self.assertEqual(os.path.getsize(target), 0)
+
+    def test_rejects_shared_file(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        os.close(fd)
+        os.chmod(self.path, 0o644)
+
+        with self.assertRaises(PermissionError):
+            self.open()
+
+    def test_rejects_file_of_another_user(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        os.close(fd)
+
+        with mock.patch("wdg_core_auth.shm.os.geteuid", return_value=os.geteuid() + 1):
+            with self.assertRaises(PermissionError):
+                self.open()
+
+    def test_unusable_file_disables_cache(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        os.close(fd)
+        os.chmod(self.path, 0o666)
+
+        with mock.patch.multiple(shm, _shared_cache=None, _shared_cache_pid=None), \
+                override_settings(
+                    AUTH_PERMISSION_SHARED_CACHE_ENABLED=True,
+                    AUTH_PERMISSION_SHARED_CACHE_PATH=self.base,
+                    AUTH_PERMISSION_SHARED_CACHE_SLOTS=4,
+                    AUTH_PERMISSION_SHARED_CACHE_SLOT_SIZE=1024,
+                ), self.assertLogs(level="ERROR"):
+            self.assertIsNone(shm.get_shared_cache())
+            self.assertIsNone(shm.get_shared_cache())
+
+
+def forward_metric(kind, name, value, labels):
+    pass
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(metrics.set_exporter, None)
+
+    def test_exporter_setting(self):
+        self.assertIsInstance(metrics.get_exporter(), metrics.NoopExporter)
+        for setting, exporter_class in (
+            ("logging", metrics.LoggingExporter),
+            ("prometheus", metrics.PrometheusExporter),
+            ("wdg_core_auth.metrics.PrometheusExporter", metrics.PrometheusExporter),
+            ("wdg_core_auth.tests.forward_metric", metrics.CallbackExporter),
+            (forward_metric, metrics.CallbackExporter),
+        ):
+            with self.subTest(setting), override_settings(AUTH_METRICS_EXPORTER=setting):
+                self.assertIsInstance(metrics.get_exporter(), exporter_class)
+
+    def test_invalid_exporter_disables_metrics(self):
+        with override_settings(AUTH_METRICS_EXPORTER="wdg_core_auth.nope.Exporter"):
+            with self.assertLogs(level="ERROR"):
+                self.assertIsInstance(metrics.get_exporter(), metrics.NoopExporter)
+            metrics.increment("wdg_permission_cache_total", layer="local")  # no-op
+
+    def test_noop_exporter_skips_measurements(self):
+        with metrics.timer("wdg_permission_fetch_seconds") as timer:
+            timer.labels["outcome"] = "ok"
+        self.assertEqual(metrics.timer("wdg_permission_fetch_seconds").labels, {})
+
+    def test_prometheus_render(self):
+        exporter = metrics.PrometheusExporter(buckets=(1, 0.1))
+        metrics.set_exporter(exporter)
+        metrics.increment("wdg_permission_cache_total", layer="redis", result="hit")
+        metrics.increment("wdg_permission_cache_total", layer="redis", result="hit")
+        metrics.increment("wdg_auth_token_cache_total", result='a"b\n')
+        for value in (0.25, 1, 2):  # bounds are inclusive
+            metrics.observe("wdg_permission_fetch_seconds", value, outcome="ok")
+
+        lines = exporter.render().splitlines()
+
+        self.assertIn("# TYPE wdg_permission_cache_total counter", lines)
+        self.assertIn('wdg_permission_cache_total{layer="redis",result="hit"} 2', lines)
+        self.assertIn('wdg_auth_token_cache_total{result="a\\"b\\n"} 1', lines)
+        self.assertIn("# TYPE wdg_permission_fetch_seconds histogram", lines)
+        self.assertEqual(
+            [line for line in lines if line.startswith("wdg_permission_fetch_seconds")],
+            [
+                'wdg_permission_fetch_seconds_bucket{outcome="ok",le="0.1"} 0',
+                'wdg_permission_fetch_seconds_bucket{outcome="ok",le="1"} 2',
+                'wdg_permission_fetch_seconds_bucket{outcome="ok",le="+Inf"} 3',
+                'wdg_permission_fetch_seconds_sum{outcome="ok"} 3.25',
+                'wdg_permission_fetch_seconds_count{outcome="ok"} 3',
+            ],
+        )
+        # Each metric is described once, before its samples.
+        names = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_timer_outcome(self):
+        records = []
+        metrics.set_exporter(lambda kind, name, value, labels: records.append((name, labels)))
+
+        with metrics.timer("wdg_permission_fetch_seconds") as timer:
+            timer.labels["outcome"] = "not_modified"
+        with self.assertRaises(KeyError):
+            with metrics.timer("wdg_permission_fetch_seconds"):
+                raise KeyError()
+
+        self.assertEqual(
+            records,
+            [
+                ("wdg_permission_fetch_seconds", {"outcome": "not_modified"}),
+                ("wdg_permission_fetch_seconds", {"outcome": "error"}),
+            ],
+        )
+
+    def test_metrics_view(self):
+        request = RequestFactory().get("/permissions/metrics")
+        with self.assertRaises(Http404):
+            metrics_view(request)
+
+        with override_settings(AUTH_METRICS_EXPORTER="prometheus"):
+            metrics.increment("wdg_permission_cache_total", layer="local", result="miss")
+            response = metrics_view(request)
+
+        self.assertEqual(response["Content-Type"], metrics.PROMETHEUS_CONTENT_TYPE)
+        self.assertIn(
+            'wdg_permission_cache_total{layer="local",result="miss"} 1',
+            response.content.decode().splitlines(),
+        )
+
+    @override_settings(AUTH_METRICS_EXPORTER="prometheus")
+    def test_metrics_view_allowed_ips(self):
+        factory = RequestFactory()
+        for remote_addr in ("10.0.0.5", "::1", "not an address"):
+            request = factory.get("/permissions/metrics", REMOTE_ADDR=remote_addr)
+            with self.subTest(remote_addr=remote_addr):
+                if remote_addr == "::1":
+                    self.assertEqual(metrics_view(request).status_code, 200)
+                else:
+                    with self.assertRaises(PermissionDenied):
+                        metrics_view(request)
+
+        with override_settings(AUTH_METRICS_ALLOWED_IPS=["10.0.0.0/24"]):
+            request = factory.get("/permissions/metrics", REMOTE_ADDR="10.0.0.5")
+            self.assertEqual(metrics_view(request).status_code, 200)
+            with self.assertRaises(PermissionDenied):
+                metrics_view(factory.get("/permissions/metrics"))  # 127.0.0.1
+
+
+class SelectorMetricsTests(SelectorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self.start_auth_service(ORDERS)
+        self.records = []
+        metrics.set_exporter(
+            lambda kind, name, value, labels: self.records.append((kind, name, dict(labels)))
+        )
+        self.addCleanup(metrics.set_exporter, None)
+
+    def test_cache_and_fetch_metrics(self):
+        FetchPermissionSelector(make_request()).fetch_snapshot()
+        self.assertIn(
+            (metrics.COUNTER, "wdg_permission_cache_total", {"layer": "redis", "result": "miss"}),
+            self.records,
+        )
+        self.assertIn(
+            (metrics.HISTOGRAM, "wdg_permission_fetch_seconds", {"outcome": "ok"}), self.records
+        )
+
+        self.records.clear()
+        FetchPermissionSelector(make_request()).fetch_snapshot()
+        self.assertIn(
+            (metrics.COUNTER, "wdg_permission_cache_total", {"layer": "local", "result": "hit"}),
+            self.records,
+        )
+        self.assertNotIn("wdg_permission_fetch_seconds", [name for _, name, _ in self.records])
+
+    def test_failed_and_rejected_fetches(self):
+        self.service.status = 503
+        with self.assertLogs(level="ERROR"):
+            FetchPermissionSelector(make_request()).fetch_snapshot()
+        self.assertIn(
+            (metrics.HISTOGRAM, "wdg_permission_fetch_seconds", {"outcome": "error"}),
+            self.records,
+        )
+
+        breaker = FetchPermissionSelector(make_request()).get_breaker()
+        breaker._open(time.monotonic())
+        self.addCleanup(breaker.reset)
+        FetchPermissionSelector(make_request(2)).fetch_snapshot()
+        self.assertIn((metrics.COUNTER, "wdg_permission_fetch_rejected_total", {}), self.records)
+
+    def test_decision_metrics(self):
+        class View:
+            @check_permission("order.read")
+            def get(self, request):
+                return "ok"
+
+            @check_permission("order.delete")
+            def delete(self, request):
+                return "ok"
+
+        self.assertEqual(View().get(make_request()), "ok")
+        self.assertEqual(View().delete(make_request()).status_code, 403)
+
+        decisions = [
+            labels for _, name, labels in self.records if name == "wdg_permission_decision_seconds"
+        ]
+        self.assertEqual(
+            decisions,
+            [
+                {"source": "decorator", "outcome": ALLOWED},
+                {"source": "decorator", "outcome": DENIED},
+            ],
+        )
+
+
+class DecoratorTests(SelectorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start_auth_service(ORDERS)
+
+    def request(self):
+        return RequestFactory().get("/orders", HTTP_AUTHORIZATION="Bearer 1")
+
+    def test_async_function_view(self):
+        @check_permission("order.read")
+        async def view(request):
+            return "ok"
+
+        @check_permission("order.delete")
+        async def denied(request):
+            return "ok"
+
+        self.assertEqual(asyncio.run(view(self.request())), "ok")
+        self.assertEqual(asyncio.run(denied(self.request())).status_code, 403)
+
+    def test_function_view(self):
+        @check_permission("order.read")
+        def view(request, pk):
+            return pk
+
+        self.assertEqual(view(self.request(), 5), 5)
+
+    def test_method_view(self):
+        class View:
+            @check_permission("order.delete")
+            async def get(self, request):
+                return "ok"
+
+        self.assertEqual(asyncio.run(View().get(self.request())).status_code, 403)
+
+    def test_async_view_does_not_block_the_event_loop(self):
+        threads = []
+
+        def blocking(*args, **kwargs):
+            threads.append(threading.get_ident())
+
+        def decode_token(token):
+            blocking()
+            raise InvalidTokenError("invalid")
+
+        @check_permission("order.approve")
+        async def view(request):
+            return "ok"
+
+        request = RequestFactory().get(
+            "/orders", HTTP_AUTHORIZATION="Bearer 1", HTTP_X_APPROVAL_TOKEN="approval"
+        )
+        with mock.patch.object(approval, "_verified_cache", None), mock.patch.object(
+            approval, "decode_token", decode_token
+        ), mock.patch.object(
+            FetchPermissionSelector, "_read_shared", side_effect=blocking, autospec=True
+        ), mock.patch.object(
+            FetchPermissionSelector, "_write_shared", side_effect=blocking, autospec=True
+        ), override_settings(AUTH_PERMISSION_SHARED_CACHE_ENABLED=True):
+            response = asyncio.run(view(request))
+
+        self.assertEqual(json.loads(response.content), {"detail": "Invalid token."})
+        # Access token, shared read and write, approval token.
+        self.assertEqual(len(threads), 4)
+        self.assertNotIn(threading.get_ident(), threads)
+
+
+class HttpClientTests(SimpleTestCase):
+    def setUp(self):
+        clients.close_http_clients()
+        self.addCleanup(clients.close_http_clients)
+
+    @override_settings(AUTH_HTTP_TIMEOUT=5, AUTH_HTTP_TIMEOUTS={"slow.test": 30})
+    def test_per_host_timeouts(self):
+        self.assertEqual(clients.get_timeout("https://slow.test:8443/api/v1"), 30)
+        self.assertEqual(clients.get_timeout("https://auth.test/api/v1"), 5)
+
+        slow = clients.get_http_client("https://slow.test/a")
+        self.assertIs(clients.get_http_client("https://slow.test/b"), slow)
+        self.assertEqual(slow.timeout, httpx.Timeout(30))
+        self.assertEqual(clients.get_http_client("https://auth.test").timeout, httpx.Timeout(5))
+
+        async def get_timeout():
+            client = clients.get_async_http_client("https://slow.test")
+            return client.timeout
+
+        self.assertEqual(asyncio.run(get_timeout()), httpx.Timeout(30))
+
+    def test_new_pool_after_fork(self):
+        parent = clients.get_http_client("http://auth.test")
+        with mock.patch.object(clients.os, "getpid", return_value=os.getpid() + 1):
+            child = clients.get_http_client("http://auth.test")
+            self.assertIs(clients.get_http_client("http://auth.test"), child)
+            clients.close_http_clients()
+        self.assertIsNot(child, parent)
+        self.assertTrue(child.is_closed)
+        self.assertFalse(parent.is_closed)  # the parent's sockets are left alone
+        parent.close()
+
+    @override_settings(AUTH_HTTP2=True)
+    def test_http2_requires_h2(self):
+        with mock.patch("importlib.util.find_spec", return_value=None):
+            with self.assertLogs(level="WARNING"):
+                self.assertFalse(clients._http2_enabled())
+        with mock.patch("importlib.util.find_spec", return_value=object()):
+            self.assertTrue(clients._http2_enabled())
+        with override_settings(AUTH_HTTP2=False):
+            self.assertFalse(clients._http2_enabled())
+
+
+class AsyncClientTests(SimpleTestCase):
+    def test_clients_closed_with_their_loop(self):
+        async def get_clients():
+            return clients.get_async_http_client("http://auth.test"), utils.get_async_redis_client()
+
+        redis_client = mock.Mock(aclose=mock.AsyncMock())
+        with mock.patch.object(utils, "build_redis_client", return_value=redis_client):
+            # async_to_sync runs every call on a new loop, like async views under WSGI.
+            first, _ = async_to_sync(get_clients)()
+            second, _ = asyncio.run(get_clients())
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed)
+        self.assertTrue(second.is_closed)
+        self.assertEqual(redis_client.aclose.await_count, 2)
+
+    def test_clients_reused_within_a_loop(self):
+        async def get_clients():
+            http_client = clients.get_async_http_client("http://auth.test/a")
+            redis_client = utils.get_async_redis_client()
+            return (
+                http_client is clients.get_async_http_client("http://auth.test/b"),
+                redis_client is utils.get_async_redis_client(),
+            )
+
+        def build_redis_client(asyncio_client=False):
+            return mock.Mock(aclose=mock.AsyncMock())
+
+        with mock.patch.object(utils, "build_redis_client", build_redis_client):
+            self.assertEqual(asyncio.run(get_clients()), (True, True))
+
+
+class CacheKeyTests(SimpleTestCase):
+    claims = {"user_id": 1, "company_id": 2, "branch_id": 3, "role_id": 4}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_key, cls.pem = generate_key()
+        cls.other_key, _ = generate_key()
+
+    def setUp(self):
+        patcher = override_settings(JWT_VERIFYING_KEY=self.pem)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def cache_key(self, token, user_token=None):
+        user = SimpleNamespace(token=user_token) if user_token is not None else None
+        request = SimpleNamespace(headers={"Authorization": f"Bearer {token}"}, META={}, user=user)
+        return FetchPermissionSelector(request)._get_cache_key()
+
+    def test_rotated_token_keeps_key(self):
+        first = sign(self.private_key, **self.claims, jti="a", exp=int(time.time()) + 60)
+        second = sign(self.private_key, **self.claims, jti="b", exp=int(time.time()) + 600)
+
+        self.assertTrue(self.cache_key(first).startswith("permissions:id:"))
+        self.assertEqual(self.cache_key(first), self.cache_key(second))
+
+    def test_identities_never_share_a_key(self):
+        keys = {self.cache_key(sign(self.private_key, **self.claims))}
+        for claim in ("user_id", "company_id", "branch_id", "role_id", "permission_version"):
+            claims = {**self.claims, claim: 99}
+            keys.add(self.cache_key(sign(self.private_key, **claims)))
+        self.assertEqual(len(keys), 6)
+
+    def test_configured_key_claims(self):
+        same_role = {**self.claims, "role_id": 99}
+        with override_settings(AUTH_PERMISSION_CACHE_KEY_CLAIMS=("company_id",)):
+            self.assertEqual(
+                self.cache_key(sign(self.private_key, **self.claims)),
+                self.cache_key(sign(self.private_key, **same_role)),
+            )
+
+    def test_unverifiable_token_uses_authenticated_claims(self):
+        forged = sign(self.other_key, **{**self.claims, "user_id": 2})
+        verified = sign(self.private_key, **self.claims)
+
+        self.assertEqual(self.cache_key(forged, user_token=self.claims), self.cache_key(verified))
+
+    def test_unverifiable_token_never_uses_its_claims(self):
+        forged = sign(self.other_key, **self.claims)
+
+        key = self.cache_key(forged)
+
+        self.assertTrue(key.startswith("permissions:auth:"))
+        self.assertNotEqual(key, self.cache_key(sign(self.private_key, **self.claims)))
+        self.assertNotEqual(key, self.cache_key(sign(self.other_key, **self.claims, jti="b")))
+
+
+class KeyProviderTests(SimpleTestCase):
+    jwks_url = "http://keys.test/jwks.json"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        pairs = {kid: generate_key() for kid in ("a", "b", "c")}
+        cls.keys = {kid: private_key for kid, (private_key, _) in pairs.items()}
+        cls.pems = {kid: pem for kid, (_, pem) in pairs.items()}
+
+    def setUp(self):
+        self.now = 1000.0
+        self.published = ["a", "b"]
+        self.status = 200
+        self.requests = 0
+        client = httpx.Client(transport=httpx.MockTransport(self.handle))
+        self.addCleanup(client.close)
+        for patcher in (
+            mock.patch("wdg_core_auth.keys.get_http_client", return_value=client),
+            mock.patch("wdg_core_auth.keys.time.monotonic", side_effect=lambda: self.now),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = override_settings(
+            JWT_VERIFYING_KEY="", JWT_JWKS_URL=self.jwks_url, JWT_JWKS_REFRESH_INTERVAL=3600
+        )
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.provider = KeyProvider()
+
+    def handle(self, request):
+        self.requests += 1
+        keys = []
+        for kid in self.published:
+            jwk = jwt.algorithms.RSAAlgorithm.to_jwk(self.keys[kid].public_key(), as_dict=True)
+            keys.append({**jwk, "kid": kid, "use": "sig", "alg": "RS256"})
+        return httpx.Response(self.status, json={"keys": keys})
+
+    def token(self, kid, signed_by=None):
+        return sign(self.keys[signed_by or kid], kid=kid, user_id=1)
+
+    def test_kid_selects_key(self):
+        self.assertEqual(self.provider.decode(self.token("a"))["user_id"], 1)
+        self.assertEqual(self.provider.decode(self.token("b"))["user_id"], 1)
+        with self.assertRaises(jwt.InvalidSignatureError):
+            self.provider.decode(self.token("a", signed_by="b"))
+        self.assertEqual(self.requests, 1)  # keys are loaded once
+
+    def test_configured_keys_by_kid(self):
+        with override_settings(JWT_JWKS_URL=None, JWT_VERIFYING_KEYS=self.pems):
+            provider = KeyProvider()
+            self.assertEqual(provider.decode(self.token("c"))["user_id"], 1)
+            with self.assertRaises(jwt.InvalidSignatureError):
+                provider.decode(self.token("c", signed_by="a"))
+        self.assertEqual(self.requests, 0)
+
+    def test_rotated_key_refreshes_at_most_once_a_minute(self):
+        self.provider.decode(self.token("a"))
+        self.published = ["b", "c"]  # rotated
+
+        # Unknown kid right after a load: no reload yet.
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.provider.decode(self.token("c"))
+        self.assertEqual(self.requests, 1)
+
+        self.now += KeyProvider.MIN_REFRESH_INTERVAL
+        self.assertEqual(self.provider.decode(self.token("c"))["user_id"], 1)
+        self.assertEqual(self.requests, 2)
+
+        # Retired kid: rejected, and it cannot trigger another reload.
+        self.now += 1
+        for _ in range(5):
+            with self.assertRaises(jwt.InvalidTokenError):
+                self.provider.decode(self.token("a"))
+        self.assertEqual(self.requests, 2)
+
+    def test_periodic_refresh(self):
+        self.provider.decode(self.token("a"))
+        self.now += 3600
+        self.provider.decode(self.token("a"))
+        self.assertEqual(self.requests, 2)
+
+    def test_failed_refresh_keeps_keys(self):
+        self.provider.decode(self.token("a"))
+        self.status = 503
+        self.now += 3600
+
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(self.provider.decode(self.token("a"))["user_id"], 1)
+        self.assertEqual(self.provider.decode(self.token("b"))["user_id"], 1)
+        self.assertEqual(self.requests, 2)  # not retried on every token
+
+
+class ApprovalTokenTests(FakeRedisTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_key, cls.pem = generate_key()
+        cls.other_key, _ = generate_key()
+
+    def setUp(self):
+        super().setUp()
+        self.now = time.monotonic()
+        for patcher in (
+            mock.patch.object(approval, "_verified_cache", None),
+            mock.patch.object(approval, "decode_token", side_effect=approval.decode_token),
+            mock.patch("wdg_core_auth.cache.time.monotonic", side_effect=lambda: self.now),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.decode_token = approval.decode_token  # the mock counting verifications
+        patcher = override_settings(JWT_VERIFYING_KEY=self.pem)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def test_valid_token_cached_until_exp(self):
+        token = sign(self.private_key, user_id=1, exp=int(time.time()) + 30)
+
+        self.assertEqual(approval.verify_token(token)["user_id"], 1)
+        self.now += 25
+        self.assertEqual(approval.verify_token(token)["user_id"], 1)
+        self.assertEqual(self.decode_token.call_count, 1)
+
+        self.now += 10  # past `exp`
+        approval.verify_token(token)  # the real clock has not moved: still valid
+        self.assertEqual(self.decode_token.call_count, 2)
+
+    def test_token_without_exp(self):
+        token = sign(self.private_key, user_id=1)
+
+        approval.verify_token(token)
+        self.now += approval.DEFAULT_TTL - 1
+        approval.verify_token(token)
+        self.assertEqual(self.decode_token.call_count, 1)
+
+        self.now += 2
+        approval.verify_token(token)
+        self.assertEqual(self.decode_token.call_count, 2)
+
+    def test_invalid_and_expired_tokens_are_negative_cached(self):
+        for token, error in (
+            (sign(self.other_key, user_id=1), InvalidTokenError),
+            (sign(self.private_key, user_id=1, exp=int(time.time()) - 10), ExpiredSignatureError),
+        ):
+            with self.subTest(error=error.__name__):
+                self.decode_token.reset_mock()
+                for _ in range(3):
+                    with self.assertRaises(error):
+                        approval.verify_token(token)
+                self.assertEqual(self.decode_token.call_count, 1)
+
+                self.now += 5  # AUTH_APPROVAL_TOKEN_NEGATIVE_TTL
+                with self.assertRaises(error):
+                    approval.verify_token(token)
+                self.assertEqual(self.decode_token.call_count, 2)
+
+    def test_payload_is_a_copy(self):
+        token = sign(self.private_key, user_id=1)
+        approval.verify_token(token)["user_id"] = 2
+        self.assertEqual(approval.verify_token(token)["user_id"], 1)
+
+    @override_settings(AUTH_APPROVAL_TOKEN_CACHE_REDIS=True)
+    def test_shared_between_workers(self):
+        token = sign(self.private_key, user_id=1, exp=int(time.time()) + 30)
+        invalid = sign(self.other_key, user_id=1)
+
+        approval.verify_token(token)
+        with self.assertRaises(InvalidTokenError):
+            approval.verify_token(invalid)
+        key = f"{approval.CACHE_KEY_PREFIX}{approval._hash_token(token)}"
+        self.assertTrue(0 < self.redis.pttl(key) <= 30_000)
+
+        approval.get_verified_cache().clear()  # another worker
+        self.assertEqual(approval.verify_token(token)["user_id"], 1)
+        with self.assertRaises(InvalidTokenError):
+            approval.verify_token(invalid)
+        self.assertEqual(self.decode_token.call_count, 2)
+
+    def test_not_shared_by_default(self):
+        approval.verify_token(sign(self.private_key, user_id=1))
+        self.assertEqual(self.redis.keys(f"{approval.CACHE_KEY_PREFIX}*"), [])
+
+    def test_async_verification_shares_the_cache(self):
+        token = sign(self.private_key, user_id=1)
+
+        self.assertEqual(asyncio.run(approval.averify_token(token))["user_id"], 1)
+        self.assertEqual(approval.verify_token(token)["user_id"], 1)
+        self.assertEqual(self.decode_token.call_count, 1)
+
+
+class UnavailableTests(SelectorTestCase):
+    """
+    The auth service fails and there is no snapshot to fall back to.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.service = self.start_auth_service(ORDERS)
+        self.service.status = 503
+        self.factory = APIRequestFactory()
+
+    def request(self):
+        return self.factory.get("/orders", HTTP_AUTHORIZATION="Bearer 1")
+
+    def test_decorator(self):
+        @check_permission("order.read")
+        def view(request):
+            return "ok"
+
+        @check_permission("order.read")
+        async def async_view(request):
+            return "ok"
+
+        with self.assertLogs(level="ERROR"):
+            response = view(self.request())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(
+            json.loads(response.content),
+            {"detail": "Permissions are unavailable. Please try again later."},
+        )
+        self.assertEqual(asyncio.run(async_view(self.request())).status_code, 503)
+
+    def test_mixin(self):
+        class OrderViewSet(ActionPermissionMixin, ViewSet):
+            action_permissions = {"list": "order.read"}
+
+            def list(self, request):
+                return Response([])
+
+        with self.assertLogs(level="ERROR"):
+            response = OrderViewSet.as_view({"get": "list"})(self.request())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data["detail"].code, "permissions_unavailable")
+
+    def test_open_circuit(self):
+        breaker = FetchPermissionSelector(make_request()).get_breaker()
+        breaker._open(time.monotonic())
+        self.addCleanup(breaker.reset)
+
+        request = self.factory.get(
+            "/permissions/check", {"codenames": "order.read"}, HTTP_AUTHORIZATION="Bearer 1"
+        )
+        response = PermissionCheckView.as_view()(request)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.service.calls, 0)
 
-# Create your tests here.
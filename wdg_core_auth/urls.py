@@ -0,0 +1,9 @@
+from django.urls import path
+
+from wdg_core_auth.views import EffectiveMenuView, PermissionCheckView, metrics_view
+
+urlpatterns = [
+    path("permissions/check", PermissionCheckView.as_view(), name="permission-check"),
+    path("permissions/menu", EffectiveMenuView.as_view(), name="permission-menu"),
+    path("permissions/metrics", metrics_view, name="permission-metrics"),
+]
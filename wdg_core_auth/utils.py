@@ -1,28 +1,320 @@
+import asyncio
 import json
-from typing import Any, Dict, Optional
-from urllib.parse import urlparse
+import logging
+import os
+import struct
+import threading
+import uuid
+import weakref
+import zlib
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
 
 import redis
+import redis.asyncio as aioredis
 from django.conf import settings
 
-# Parse host/port/db from CACHE_REDIS_LOCATION
-parsed_url = urlparse(settings.CACHE_REDIS_LOCATION)
+from wdg_core_auth import metrics
 
+try:
+    import orjson
+except ImportError:  # optional: faster JSON
+    orjson = None
 
-# Extract credentials and connection info
-host = parsed_url.hostname
-port = parsed_url.port or 6379
-db = int(parsed_url.path.lstrip("/")) if parsed_url.path else 0
-password = parsed_url.password
+try:
+    import msgpack
+except ImportError:  # optional: binary codec
+    msgpack = None
 
-# Connect to Redis
-redis_client = redis.Redis(
-    host=host,
-    port=port,
-    db=db,
-    password=password,
-    ssl=False,  # Redis Cloud often requires SSL
-)
+SENTINEL_SCHEME = "redis+sentinel"
+CLUSTER_SCHEMES = ("redis+cluster", "rediss+cluster")
+
+_redis_client: Optional[redis.Redis] = None
+_redis_client_pid: Optional[int] = None
+_redis_lock = threading.Lock()
+
+# redis.asyncio clients are bound to the event loop they were created on
+_async_redis_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+# loop -> finalizers registered with `on_loop_shutdown` (the loop only keeps weak references)
+_loop_finalizers: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+class LazySetting:
+    """
+    Class attribute that reads a Django setting on access instead of at import.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        return getattr(settings, self.name)
+
+
+def get_redis_url() -> str:
+    return getattr(settings, "AUTH_REDIS_URL", None) or settings.CACHE_REDIS_LOCATION
+
+
+def get_redis_options(url: str) -> Dict[str, Any]:
+    """
+    Connection options shared by the sync and async clients.
+    """
+    options = {
+        "max_connections": getattr(settings, "AUTH_REDIS_MAX_CONNECTIONS", 50),
+        "socket_timeout": getattr(settings, "AUTH_REDIS_SOCKET_TIMEOUT", 5),
+        "socket_connect_timeout": getattr(settings, "AUTH_REDIS_SOCKET_CONNECT_TIMEOUT", 5),
+        "health_check_interval": getattr(settings, "AUTH_REDIS_HEALTH_CHECK_INTERVAL", 30),
+    }
+    if getattr(settings, "AUTH_REDIS_SSL", False) or url.startswith("rediss"):
+        options["ssl"] = True
+        options["ssl_cert_reqs"] = getattr(settings, "AUTH_REDIS_SSL_CERT_REQS", "required")
+        ca_certs = getattr(settings, "AUTH_REDIS_SSL_CA_CERTS", None)
+        if ca_certs:
+            options["ssl_ca_certs"] = ca_certs
+    options.update(getattr(settings, "AUTH_REDIS_OPTIONS", {}))
+    return options
+
+
+def parse_sentinel_url(url: str) -> Tuple[List[Tuple[str, int]], str, Dict[str, Any]]:
+    """
+    Parse `redis+sentinel://[[user]:password@]host:port[,host:port]/service[/db]`
+    into (sentinels, service name, master connection kwargs).
+    """
+    parsed = urlparse(url)
+    credentials, _, hosts = parsed.netloc.rpartition("@")
+    sentinels = []
+    for address in hosts.split(","):
+        hostname, _, sentinel_port = address.partition(":")
+        sentinels.append((hostname, int(sentinel_port or 26379)))
+
+    parts = [part for part in parsed.path.split("/") if part]
+    if not parts:
+        raise ValueError(f"Sentinel URL must name the master service: {url!r}")
+
+    kwargs: Dict[str, Any] = {"db": int(parts[1]) if len(parts) > 1 else 0}
+    if credentials:
+        username, _, password = credentials.partition(":")
+        if username:
+            kwargs["username"] = unquote(username)
+        if password:
+            kwargs["password"] = unquote(password)
+    return sentinels, parts[0], kwargs
+
+
+def build_redis_client(asyncio_client: bool = False):
+    """
+    Create a client for AUTH_REDIS_URL (or CACHE_REDIS_LOCATION).
+
+    Supports redis://, rediss:// (TLS), unix://, redis+sentinel:// and
+    redis+cluster:// / rediss+cluster:// URLs.
+    """
+    url = get_redis_url()
+    options = get_redis_options(url)
+    scheme = urlparse(url).scheme
+
+    if scheme == SENTINEL_SCHEME:
+        if asyncio_client:
+            from redis.asyncio.sentinel import Sentinel
+        else:
+            from redis.sentinel import Sentinel
+
+        sentinels, service_name, kwargs = parse_sentinel_url(url)
+        sentinel = Sentinel(
+            sentinels,
+            sentinel_kwargs={
+                "socket_timeout": options["socket_timeout"],
+                "password": getattr(settings, "AUTH_REDIS_SENTINEL_PASSWORD", None),
+            },
+            **kwargs,
+            **options,
+        )
+        return sentinel.master_for(service_name)
+
+    if scheme in CLUSTER_SCHEMES:
+        if asyncio_client:
+            from redis.asyncio.cluster import RedisCluster
+        else:
+            from redis.cluster import RedisCluster
+
+        options.pop("health_check_interval", None)
+        if scheme.startswith("rediss"):
+            options["ssl"] = True
+        return RedisCluster.from_url(url.replace(f"{scheme}://", "redis://", 1), **options)
+
+    client_class = aioredis.Redis if asyncio_client else redis.Redis
+    return client_class.from_url(url, **options)
+
+
+def get_redis_client() -> redis.Redis:
+    """
+    Return the process-wide Redis client, creating it on first use.
+
+    Nothing connects at import time, and a process created with fork() (e.g. a
+    gunicorn worker) builds its own pool instead of sharing the parent's sockets.
+    """
+    global _redis_client, _redis_client_pid
+
+    pid = os.getpid()
+    client = _redis_client
+    if client is not None and _redis_client_pid == pid:
+        return client
+
+    with _redis_lock:
+        if _redis_client is None or _redis_client_pid != pid:
+            _redis_client = build_redis_client()
+            _redis_client_pid = pid
+        return _redis_client
+
+
+def reset_redis_clients():
+    """
+    Drop the cached clients; the next call builds new ones from the settings.
+    """
+    global _redis_client, _redis_client_pid
+
+    with _redis_lock:
+        _redis_client = None
+        _redis_client_pid = None
+        _async_redis_clients.clear()
+
+
+def __getattr__(name):
+    # `from wdg_core_auth.utils import redis_client` keeps working, lazily.
+    if name == "redis_client":
+        return get_redis_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+TAG_KEY_PREFIX = "permissions:tag:"
+SNAPSHOT_KEY_PREFIX = "permissions:snapshot:"
+BITS_KEY_PREFIX = "permissions:bits:"
+VALIDATORS_KEY_SUFFIX = ":validators"
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class JSONCodec:
+    """
+    JSON, through orjson when it is installed.
+    """
+
+    name = "json"
+    codec_id = 1
+
+    def dumps(self, value: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes) -> Any:
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    """
+    MessagePack (requires the `msgpack` package).
+    """
+
+    name = "msgpack"
+    codec_id = 2
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+CACHE_CODECS: Dict[str, Any] = {}
+_CODECS_BY_ID: Dict[int, Any] = {}
+_unavailable_codecs = set()
+
+
+def register_codec(codec):
+    """
+    Make `codec` (an object with `name`, a unique 1-byte `codec_id`, `dumps` and
+    `loads`) available for AUTH_CACHE_CODEC and for decoding cached entries.
+    """
+    CACHE_CODECS[codec.name] = codec
+    _CODECS_BY_ID[codec.codec_id] = codec
+
+
+register_codec(JSONCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
+
+# Encoded entries: magic, format version, codec id, flags, then the payload.
+# Legacy entries are plain JSON text, which can never start with the magic.
+CODEC_MAGIC = b"\x00W"
+CODEC_FORMAT_VERSION = 1
+FLAG_ZLIB = 0x01
+_CODEC_HEADER = struct.Struct("<2sBBB")
+
+
+def get_codec():
+    name = getattr(settings, "AUTH_CACHE_CODEC", "json")
+    codec = CACHE_CODECS.get(name)
+    if codec is None:
+        if name not in _unavailable_codecs:
+            _unavailable_codecs.add(name)
+            logging.warning(f"Cache codec {name!r} is unavailable, using json.")
+        codec = CACHE_CODECS["json"]
+    return codec
+
+
+def encode_value(value: Any, codec=None) -> bytes:
+    """
+    Encode `value` for Redis with the configured codec, compressing payloads
+    larger than AUTH_CACHE_COMPRESS_THRESHOLD bytes (None disables it).
+    """
+    codec = codec or get_codec()
+    payload = codec.dumps(value)
+    flags = 0
+    threshold = getattr(settings, "AUTH_CACHE_COMPRESS_THRESHOLD", 4096)
+    if threshold is not None and len(payload) > threshold:
+        compressed = zlib.compress(payload, getattr(settings, "AUTH_CACHE_COMPRESS_LEVEL", 1))
+        if len(compressed) < len(payload):
+            payload, flags = compressed, FLAG_ZLIB
+    return _CODEC_HEADER.pack(CODEC_MAGIC, CODEC_FORMAT_VERSION, codec.codec_id, flags) + payload
+
+
+def decode_value(data: Any) -> Any:
+    """
+    Decode an entry written by `encode_value`, or a legacy plain JSON entry.
+
+    Raises ValueError for anything that cannot be decoded.
+    """
+    with metrics.timer("wdg_permission_decode_seconds"):
+        return _decode_value(data)
+
+
+def _decode_value(data: Any) -> Any:
+    if isinstance(data, str):
+        data = data.encode()
+    if not data.startswith(CODEC_MAGIC):
+        return CACHE_CODECS["json"].loads(data)
+
+    try:
+        _, version, codec_id, flags = _CODEC_HEADER.unpack_from(data, 0)
+        codec = _CODECS_BY_ID.get(codec_id)
+        if version != CODEC_FORMAT_VERSION or codec is None:
+            raise ValueError(f"Unsupported cache entry (format {version}, codec {codec_id}).")
+        payload = data[_CODEC_HEADER.size:]
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return codec.loads(payload)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Corrupt cache entry: {e}") from e
 
 
 # Parse to verify key
@@ -37,20 +329,210 @@ def get_cached_json(key: str) -> Optional[Dict[str, Any]]:
     Retrieve a JSON object from Redis.
     """
     try:
-        value = redis_client.get(key)
-        if value:
-            return json.loads(value)
-    except (json.JSONDecodeError, redis.RedisError):
-        redis_client.delete(key)
+        value = get_redis_client().get(key)
+    except redis.RedisError:
+        return None
+    if value:
+        try:
+            return decode_value(value)
+        except ValueError:
+            delete_cached_key(key)  # undecodable: drop it
     return None
 
 
+def get_cached_json_with_ttl(key: str) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+    """
+    Retrieve a JSON object from Redis together with its remaining TTL (in seconds).
+    """
+    try:
+        pipe = get_redis_client().pipeline()
+        pipe.get(key)
+        pipe.pttl(key)
+        value, pttl = pipe.execute()
+    except redis.RedisError:
+        return None, None
+    if value:
+        try:
+            return decode_value(value), (pttl / 1000 if pttl and pttl > 0 else None)
+        except ValueError:
+            delete_cached_key(key)  # undecodable: drop it
+    return None, None
+
+
+def get_cached_bytes(key: str) -> Optional[bytes]:
+    """
+    Retrieve a raw bytes value from Redis.
+    """
+    try:
+        return get_redis_client().get(key)
+    except redis.RedisError:
+        return None
+
+
 def set_cached_json(key: str, value: Dict[str, Any], ttl: int = 300):
     """
     Set a JSON-serializable object into Redis with an optional TTL (in seconds).
     """
     try:
-        redis_client.setex(key, ttl, json.dumps(value))
+        get_redis_client().setex(key, ttl, encode_value(value))
+    except redis.RedisError:
+        pass
+
+
+def set_cached_snapshot(
+    key: str,
+    snapshot_id: str,
+    value: Any,
+    ttl: int = 300,
+    tags: Iterable[str] = (),
+    bits: Optional[bytes] = None,
+    validators: Optional[Dict[str, Any]] = None,
+    snapshot_ttl: Optional[int] = None,
+):
+    """
+    Store a content-addressed snapshot (and its encoded bits) once and point
+    `key` at it, in one round trip.
+
+    `validators` (the upstream ETag/Last-Modified) are kept for `snapshot_ttl`
+    seconds, as long as the snapshot itself, so an expired `key` can be
+    revalidated instead of downloaded again.
+    """
+    set_cached_snapshots(
+        [(key, snapshot_id, value, tags, bits, validators)], ttl=ttl, snapshot_ttl=snapshot_ttl
+    )
+
+
+def set_cached_snapshots(
+    entries: Iterable[Tuple[str, str, Any, Iterable[str], Optional[bytes], Optional[Dict]]],
+    ttl: int = 300,
+    snapshot_ttl: Optional[int] = None,
+) -> bool:
+    """
+    `set_cached_snapshot` for many (key, snapshot_id, value, tags, bits,
+    validators) entries in a single pipeline. Returns False if Redis failed.
+    """
+    snapshot_ttl = max(ttl, snapshot_ttl or ttl)
+    try:
+        pipe = get_redis_client().pipeline(transaction=False)
+        for key, snapshot_id, value, tags, bits, validators in entries:
+            snapshot_key = f"{SNAPSHOT_KEY_PREFIX}{snapshot_id}"
+            pipe.set(snapshot_key, encode_value(value), ex=snapshot_ttl, nx=True)
+            pipe.expire(snapshot_key, snapshot_ttl)  # outlive the pointer written below
+            _pipe_snapshot_pointer(
+                pipe, key, snapshot_id, ttl, tags, bits, validators, snapshot_ttl
+            )
+        pipe.execute()
+    except redis.RedisError:
+        return False
+    return True
+
+
+def touch_cached_snapshot(
+    key: str,
+    snapshot_id: str,
+    ttl: int = 300,
+    tags: Iterable[str] = (),
+    validators: Optional[Dict[str, Any]] = None,
+    snapshot_ttl: Optional[int] = None,
+):
+    """
+    Point `key` at an already cached snapshot again and extend its TTL, without
+    transferring the snapshot.
+    """
+    snapshot_ttl = max(ttl, snapshot_ttl or ttl)
+    try:
+        pipe = get_redis_client().pipeline(transaction=False)
+        pipe.expire(f"{SNAPSHOT_KEY_PREFIX}{snapshot_id}", snapshot_ttl)
+        pipe.expire(f"{BITS_KEY_PREFIX}{snapshot_id}", snapshot_ttl)
+        _pipe_snapshot_pointer(
+            pipe, key, snapshot_id, ttl, tags, None, validators, snapshot_ttl
+        )
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def _pipe_snapshot_pointer(pipe, key, snapshot_id, ttl, tags, bits, validators, snapshot_ttl):
+    if bits is not None:
+        pipe.setex(f"{BITS_KEY_PREFIX}{snapshot_id}", snapshot_ttl, bits)
+    pipe.setex(key, ttl, encode_value({"snapshot_id": snapshot_id}))
+    if validators:
+        pipe.setex(
+            f"{key}{VALIDATORS_KEY_SUFFIX}",
+            snapshot_ttl,
+            encode_value({**validators, "snapshot_id": snapshot_id}),
+        )
+    for tag in tags:
+        tag_key = f"{TAG_KEY_PREFIX}{tag}"
+        pipe.sadd(tag_key, key)
+        pipe.expire(tag_key, ttl)
+
+
+def tag_cached_key(key: str, tags: Iterable[str], ttl: int = 300):
+    """
+    Record `key` under each tag so it can be deleted with `delete_tagged_keys`.
+    """
+    try:
+        pipe = get_redis_client().pipeline()
+        for tag in tags:
+            tag_key = f"{TAG_KEY_PREFIX}{tag}"
+            pipe.sadd(tag_key, key)
+            pipe.expire(tag_key, ttl)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def delete_tagged_keys(tag: str):
+    """
+    Delete every key recorded under `tag`, and the tag itself.
+    """
+    tag_key = f"{TAG_KEY_PREFIX}{tag}"
+    try:
+        client = get_redis_client()
+        keys = client.smembers(tag_key)
+        client.delete(tag_key, *keys)
+    except redis.RedisError:
+        pass
+
+
+def delete_keys_matching(pattern: str):
+    """
+    Delete every key matching `pattern`, using SCAN to avoid blocking Redis.
+    """
+    try:
+        client = get_redis_client()
+        pipe = client.pipeline()
+        for key in client.scan_iter(match=pattern, count=500):
+            pipe.delete(key)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def acquire_lock(key: str, ttl_ms: int = 5000) -> Optional[str]:
+    """
+    Try to take a short-lived Redis lock. Returns the lock token, or None when
+    another process holds it. If Redis is unavailable an empty token is returned
+    so callers carry on without cross-process coordination.
+    """
+    token = uuid.uuid4().hex
+    try:
+        if get_redis_client().set(key, token, nx=True, px=ttl_ms):
+            return token
+        return None
+    except redis.RedisError:
+        return ""
+
+
+def release_lock(key: str, token: str):
+    """
+    Release a lock taken with `acquire_lock`, only if it is still ours.
+    """
+    if not token:
+        return
+    try:
+        get_redis_client().eval(RELEASE_LOCK_SCRIPT, 1, key, token)
     except redis.RedisError:
         pass
 
@@ -60,6 +542,204 @@ def delete_cached_key(key: str):
     Delete a cache key.
     """
     try:
-        redis_client.delete(key)
+        get_redis_client().delete(key)
+    except redis.RedisError:
+        pass
+
+
+async def _await_on_shutdown(callback: Callable[[], Awaitable[Any]]):
+    try:
+        yield
+    finally:
+        try:
+            await callback()
+        except Exception as e:
+            logging.error(f"Failed to close a client on event loop shutdown: {e}")
+
+
+def on_loop_shutdown(callback: Callable[[], Awaitable[Any]]):
+    """
+    Await `callback()` when the running event loop shuts down its async
+    generators, which asyncio.run() and async_to_sync do before closing it.
+
+    Clients bound to a loop are closed this way; otherwise an async view served
+    under WSGI, on a new loop per request, would leak their sockets.
+    """
+    loop = asyncio.get_running_loop()
+    finalizer = _await_on_shutdown(callback)
+    # Run it up to its `yield`: the loop then tracks it and closes it on shutdown.
+    try:
+        finalizer.asend(None).send(None)
+    except StopIteration:
+        pass
+    _loop_finalizers.setdefault(loop, []).append(finalizer)
+
+
+async def _aclose_redis_client(loop, client):
+    if _async_redis_clients.get(loop) is client:
+        del _async_redis_clients[loop]
+    await client.aclose()
+
+
+def get_async_redis_client() -> "aioredis.Redis":
+    """
+    Return the redis.asyncio client for the running event loop, closed when
+    the loop shuts down.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_redis_clients.get(loop)
+    if client is None:
+        client = build_redis_client(asyncio_client=True)
+        _async_redis_clients[loop] = client
+        on_loop_shutdown(partial(_aclose_redis_client, loop, client))
+    return client
+
+
+async def aget_cached_json_with_ttl(
+    key: str,
+) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+    """
+    Async version of `get_cached_json_with_ttl`.
+    """
+    try:
+        async with get_async_redis_client().pipeline() as pipe:
+            pipe.get(key)
+            pipe.pttl(key)
+            value, pttl = await pipe.execute()
+    except redis.RedisError:
+        return None, None
+    if value:
+        try:
+            return decode_value(value), (pttl / 1000 if pttl and pttl > 0 else None)
+        except ValueError:
+            await adelete_cached_key(key)  # undecodable: drop it
+    return None, None
+
+
+async def aget_cached_json(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Async version of `get_cached_json`.
+    """
+    value, _ = await aget_cached_json_with_ttl(key)
+    return value
+
+
+async def aget_cached_bytes(key: str) -> Optional[bytes]:
+    """
+    Async version of `get_cached_bytes`.
+    """
+    try:
+        return await get_async_redis_client().get(key)
+    except redis.RedisError:
+        return None
+
+
+async def aset_cached_json(key: str, value: Dict[str, Any], ttl: int = 300):
+    """
+    Async version of `set_cached_json`.
+    """
+    try:
+        await get_async_redis_client().setex(key, ttl, encode_value(value))
+    except redis.RedisError:
+        pass
+
+
+async def aset_cached_snapshot(
+    key: str,
+    snapshot_id: str,
+    value: Any,
+    ttl: int = 300,
+    tags: Iterable[str] = (),
+    bits: Optional[bytes] = None,
+    validators: Optional[Dict[str, Any]] = None,
+    snapshot_ttl: Optional[int] = None,
+):
+    """
+    Async version of `set_cached_snapshot`.
+    """
+    snapshot_ttl = max(ttl, snapshot_ttl or ttl)
+    snapshot_key = f"{SNAPSHOT_KEY_PREFIX}{snapshot_id}"
+    try:
+        async with get_async_redis_client().pipeline(transaction=False) as pipe:
+            pipe.set(snapshot_key, encode_value(value), ex=snapshot_ttl, nx=True)
+            pipe.expire(snapshot_key, snapshot_ttl)
+            _pipe_snapshot_pointer(
+                pipe, key, snapshot_id, ttl, tags, bits, validators, snapshot_ttl
+            )
+            await pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+async def atouch_cached_snapshot(
+    key: str,
+    snapshot_id: str,
+    ttl: int = 300,
+    tags: Iterable[str] = (),
+    validators: Optional[Dict[str, Any]] = None,
+    snapshot_ttl: Optional[int] = None,
+):
+    """
+    Async version of `touch_cached_snapshot`.
+    """
+    snapshot_ttl = max(ttl, snapshot_ttl or ttl)
+    try:
+        async with get_async_redis_client().pipeline(transaction=False) as pipe:
+            pipe.expire(f"{SNAPSHOT_KEY_PREFIX}{snapshot_id}", snapshot_ttl)
+            pipe.expire(f"{BITS_KEY_PREFIX}{snapshot_id}", snapshot_ttl)
+            _pipe_snapshot_pointer(
+                pipe, key, snapshot_id, ttl, tags, None, validators, snapshot_ttl
+            )
+            await pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+async def atag_cached_key(key: str, tags: Iterable[str], ttl: int = 300):
+    """
+    Async version of `tag_cached_key`.
+    """
+    try:
+        async with get_async_redis_client().pipeline() as pipe:
+            for tag in tags:
+                tag_key = f"{TAG_KEY_PREFIX}{tag}"
+                pipe.sadd(tag_key, key)
+                pipe.expire(tag_key, ttl)
+            await pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+async def aacquire_lock(key: str, ttl_ms: int = 5000) -> Optional[str]:
+    """
+    Async version of `acquire_lock`.
+    """
+    token = uuid.uuid4().hex
+    try:
+        if await get_async_redis_client().set(key, token, nx=True, px=ttl_ms):
+            return token
+        return None
+    except redis.RedisError:
+        return ""
+
+
+async def arelease_lock(key: str, token: str):
+    """
+    Async version of `release_lock`.
+    """
+    if not token:
+        return
+    try:
+        await get_async_redis_client().eval(RELEASE_LOCK_SCRIPT, 1, key, token)
+    except redis.RedisError:
+        pass
+
+
+async def adelete_cached_key(key: str):
+    """
+    Async version of `delete_cached_key`.
+    """
+    try:
+        await get_async_redis_client().delete(key)
     except redis.RedisError:
         pass
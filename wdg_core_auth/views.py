@@ -1,3 +1,109 @@
-from django.shortcuts import render
+import ipaddress
 
-# Create your views here.
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import metrics
+from .constants import PermissionOption
+from .middleware import get_request_permissions
+from .serializers import PermissionCheckSerializer
+
+NOT_FOUND = "not_found"
+
+
+def get_snapshot(request):
+    return get_request_permissions(request).require_snapshot()
+
+
+class PermissionCheckView(APIView):
+    """
+    Decide many codenames in one request, against the caller's cached snapshot.
+
+    GET  ?codenames=product.read,product.update
+    POST {"codenames": ["product.read", "product.update"]}
+
+    Each codename maps to `allowed`, `approval_required`, `denied` or `not_found`.
+    Codenames are looked up, never added to the codename registry, so arbitrary
+    names cannot grow it.
+    """
+
+    def get(self, request, *args, **kwargs):
+        codenames = [
+            codename.strip()
+            for value in request.query_params.getlist("codenames")
+            for codename in value.split(",")
+            if codename.strip()
+        ]
+        return self.check(request, {"codenames": codenames})
+
+    def post(self, request, *args, **kwargs):
+        return self.check(request, request.data)
+
+    def check(self, request, data):
+        serializer = PermissionCheckSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        codenames = serializer.validated_data["codenames"]
+
+        snapshot = get_snapshot(request)
+        denied, approval, missing = snapshot.evaluate(codenames)
+
+        decisions = dict.fromkeys(codenames, PermissionOption.ALLOWED)
+        decisions.update(dict.fromkeys(approval, PermissionOption.APPROVAL_REQUIRED))
+        decisions.update(dict.fromkeys(denied, PermissionOption.DENIED))
+        decisions.update(dict.fromkeys(missing, NOT_FOUND))
+
+        return Response({"snapshot_id": snapshot.snapshot_id, "permissions": decisions})
+
+
+class EffectiveMenuView(APIView):
+    """
+    The menus the caller may see, with their effective types.
+
+    The projection is computed once per snapshot. The snapshot id doubles as an
+    ETag, so clients can revalidate with If-None-Match and get a 304.
+    """
+
+    def get(self, request, *args, **kwargs):
+        snapshot = get_snapshot(request)
+        etag = f'"{snapshot.snapshot_id}"' if snapshot.snapshot_id else None
+
+        if etag and etag in request.headers.get("If-None-Match", ""):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(
+                {"snapshot_id": snapshot.snapshot_id, "menu": snapshot.effective_menu}
+            )
+        if etag:
+            response["ETag"] = etag
+            response["Cache-Control"] = "private, no-cache"
+        return response
+
+
+def _is_metrics_client(request) -> bool:
+    """
+    Whether the client address is in AUTH_METRICS_ALLOWED_IPS (addresses or
+    networks, loopback only by default).
+    """
+    allowed = getattr(settings, "AUTH_METRICS_ALLOWED_IPS", ("127.0.0.1", "::1"))
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in allowed)
+
+
+def metrics_view(request):
+    """
+    Metrics in the Prometheus text format; 403 for clients outside
+    AUTH_METRICS_ALLOWED_IPS, 404 unless AUTH_METRICS_EXPORTER = "prometheus".
+    """
+    if not _is_metrics_client(request):
+        raise PermissionDenied()
+    exporter = metrics.get_exporter()
+    if not isinstance(exporter, metrics.PrometheusExporter):
+        raise Http404()
+    return HttpResponse(exporter.render(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
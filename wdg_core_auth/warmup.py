@@ -0,0 +1,322 @@
+import logging
+import re
+import string
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+
+from wdg_core_auth.breaker import OPEN
+from wdg_core_auth.clients import get_http_client
+from wdg_core_auth.selectors import FetchPermissionSelector
+from wdg_core_auth.snapshot import PermissionSnapshot, encode_permissions
+from wdg_core_auth.utils import get_redis_client, set_cached_snapshots
+
+# Formatted with the identity's claims. It must have a placeholder for every
+# cache key claim (see `FetchPermissionSelector.get_cache_key_claims`) the
+# identities carry, e.g.
+# "api/v1/companies/{company_id}/branches/{branch_id}/users/{user_id}/permissions".
+DEFAULT_PERMISSION_ENDPOINT = "api/v1/users/{user_id}/permissions?paging=false"
+DEFAULT_ROLE_USERS_ENDPOINT = "api/v1/roles/{role_id}/users?paging=false"
+
+
+class WarmupSelector(FetchPermissionSelector):
+    """
+    Fetches the permissions of one identity (a dict of token claims) with a
+    service token, and derives the same cache key and tags a request from that
+    identity would use.
+
+    The endpoint is formatted with the claims. Since the cache key covers the
+    user id and the cache key claims, each of those the identity carries must
+    be a placeholder of the endpoint (see `_get_endpoint_error`).
+    """
+
+    def __init__(self, claims: Dict[str, Any], token: str, endpoint: Optional[str] = None):
+        super().__init__(
+            request=SimpleNamespace(headers={"Authorization": f"Bearer {token}"}, user=None)
+        )
+        self._identity_claims = dict(claims)
+        self.endpoint = endpoint or getattr(
+            settings, "AUTH_WARMUP_PERMISSION_ENDPOINT", DEFAULT_PERMISSION_ENDPOINT
+        )
+
+    def _get_cache_key(self) -> Optional[str]:
+        user_id_claim = getattr(settings, "AUTH_PERMISSION_USER_ID_CLAIM", "user_id")
+        if self._identity_claims.get(user_id_claim) is None:
+            return None  # never fall back to the service token's key
+        return super()._get_cache_key()
+
+    def _get_endpoint(self) -> str:
+        return self.endpoint.format_map(self._identity_claims)
+
+    def _get_identity_error(self) -> Optional[str]:
+        """
+        Why this identity cannot be warmed, or None.
+
+        Every cache key claim must be given, as null when tokens do not carry
+        it: a claim left out would be keyed as null and never match the keys of
+        real tokens that carry it.
+        """
+        user_id_claim = getattr(settings, "AUTH_PERMISSION_USER_ID_CLAIM", "user_id")
+        if self._identity_claims.get(user_id_claim) is None:
+            return "missing user id"
+        missing = [
+            claim for claim in self.get_cache_key_claims() if claim not in self._identity_claims
+        ]
+        if missing:
+            return (
+                f"missing cache key claim(s) {', '.join(missing)} "
+                f"(pass null for claims tokens do not carry)"
+            )
+        return self._get_endpoint_error()
+
+    def _get_endpoint_error(self) -> Optional[str]:
+        """
+        Why the endpoint cannot fetch the permissions cached for this identity,
+        or None. A key claim the endpoint ignores (e.g. the company of a
+        per-company tree) would cache one scope's permissions under another's key.
+        """
+        fields = {
+            re.split(r"[.\[]", field)[0]
+            for _, field, _, _ in string.Formatter().parse(self.endpoint)
+            if field
+        }
+        missing = sorted(field for field in fields if self._identity_claims.get(field) is None)
+        if missing:
+            return f"missing claim(s) {', '.join(missing)} used by the endpoint"
+
+        user_id_claim = getattr(settings, "AUTH_PERMISSION_USER_ID_CLAIM", "user_id")
+        key_claims = self.get_cache_key_claims()
+        unused = [
+            claim
+            for claim in (user_id_claim, *key_claims)
+            if self._identity_claims.get(claim) is not None and claim not in fields
+        ]
+        if unused:
+            return (
+                f"endpoint {self.endpoint} does not use cache key claim(s) "
+                f"{', '.join(unused)}"
+            )
+        return None
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 1 / `rate` seconds apart across threads.
+    """
+
+    def __init__(self, rate: Optional[float] = None):
+        self.interval = 1 / rate if rate else 0
+        self._next_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class WarmupReport:
+    def __init__(self):
+        self.requested = 0
+        self.skipped = 0
+        self.fetched = 0
+        self.written = 0
+        self.empty = 0
+        self.failed = 0
+        self.write_errors = 0
+        self.aborted = False
+        self.failures: List[Dict[str, Any]] = []
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = self.elapsed
+        return {
+            "requested": self.requested,
+            "skipped": self.skipped,
+            "fetched": self.fetched,
+            "written": self.written,
+            "empty": self.empty,
+            "failed": self.failed,
+            "write_errors": self.write_errors,
+            "aborted": self.aborted,
+            "elapsed_s": round(elapsed, 3),
+            "fetches_per_s": round(self.fetched / elapsed, 1) if elapsed else None,
+        }
+
+
+def get_role_members(
+    role_id: Any, token: str, endpoint: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Identities (claim dicts) of the users holding `role_id`, listed by the auth
+    service at AUTH_WARMUP_ROLE_USERS_ENDPOINT.
+    """
+    base_url = WarmupSelector.AUTH_URL
+    endpoint = endpoint or getattr(
+        settings, "AUTH_WARMUP_ROLE_USERS_ENDPOINT", DEFAULT_ROLE_USERS_ENDPOINT
+    )
+    endpoint = endpoint.format(role_id=role_id)
+    url = f"{base_url.rstrip('/')}/{endpoint.lstrip('/')}"
+
+    response = get_http_client(base_url).get(
+        url, headers={"Authorization": f"Bearer {token}"}
+    )
+    response.raise_for_status()
+    data = response.json()
+    if isinstance(data, dict):
+        data = data.get("results", [])
+
+    user_id_claim = getattr(settings, "AUTH_PERMISSION_USER_ID_CLAIM", "user_id")
+    role_claim = getattr(settings, "AUTH_PERMISSION_ROLE_CLAIM", "role_id")
+    members = []
+    for user in data:
+        claims = dict(user)
+        if user_id_claim not in claims and "id" in claims:
+            claims[user_id_claim] = claims.pop("id")
+        claims.setdefault(role_claim, role_id)
+        members.append(claims)
+    return members
+
+
+def _cached_keys(keys: List[str]) -> set:
+    try:
+        pipe = get_redis_client().pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        return {key for key, exists in zip(keys, pipe.execute()) if exists}
+    except redis.RedisError:
+        return set()
+
+
+def _fetch(
+    selector: WarmupSelector, limiter: RateLimiter
+) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    limiter.wait()
+    return selector._fetch(selector._get_endpoint())
+
+
+def warm_permissions(
+    identities: Iterable[Dict[str, Any]],
+    token: str,
+    workers: int = 8,
+    rate: Optional[float] = None,
+    batch_size: int = 100,
+    force: bool = False,
+    endpoint: Optional[str] = None,
+    progress: Optional[Callable[[WarmupReport], None]] = None,
+) -> WarmupReport:
+    """
+    Pre-populate the Redis permission cache for `identities`.
+
+    Fetches run on a pool of `workers` threads, at most `rate` per second, with
+    no more than 2 * `workers` in flight; results are written `batch_size` at a
+    time in one pipeline. Identities already cached are skipped unless `force`.
+    The run stops early when the auth service's circuit breaker opens.
+
+    Identities that lack a cache key claim, or carry one the endpoint has no
+    placeholder for, fail without being fetched.
+    """
+    report = WarmupReport()
+    selectors = {}
+    for claims in identities:
+        selector = WarmupSelector(claims, token, endpoint)
+        error = selector._get_identity_error()
+        if error is not None:
+            report.failed += 1
+            report.failures.append({"identity": claims, "error": error})
+            continue
+        selectors.setdefault(selector._get_cache_key(), selector)
+    report.requested = len(selectors)
+
+    if not force:
+        keys = list(selectors)
+        for start in range(0, len(keys), batch_size):
+            for cache_key in _cached_keys(keys[start:start + batch_size]):
+                del selectors[cache_key]
+                report.skipped += 1
+
+    limiter = RateLimiter(rate)
+    pending_writes: List[Tuple] = []
+
+    def flush():
+        if pending_writes and set_cached_snapshots(
+            pending_writes,
+            ttl=FetchPermissionSelector.CACHE_TTL,
+            snapshot_ttl=FetchPermissionSelector.get_validators_ttl(),
+        ):
+            report.written += len(pending_writes)
+        else:
+            report.write_errors += len(pending_writes)
+        pending_writes.clear()
+        if progress is not None:
+            progress(report)
+
+    breaker = next(iter(selectors.values())).get_breaker() if selectors else None
+    queue = iter(selectors.items())
+    in_flight = {}
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="wdg-core-auth-warmup"
+    ) as executor:
+        while True:
+            if breaker is not None and breaker.state == OPEN:
+                report.aborted = True  # the auth service is down: stop submitting
+            while not report.aborted and len(in_flight) < workers * 2:
+                item = next(queue, None)
+                if item is None:
+                    break
+                cache_key, selector = item
+                in_flight[executor.submit(_fetch, selector, limiter)] = (cache_key, selector)
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                cache_key, selector = in_flight.pop(future)
+                try:
+                    permissions, validators = future.result()
+                    error = "fetch failed"
+                except Exception as e:
+                    logging.exception(f"Permission warm-up failed for {cache_key}")
+                    permissions, validators, error = None, None, str(e)
+                if permissions is None:
+                    report.failed += 1
+                    report.failures.append(
+                        {"identity": selector._identity_claims, "error": error}
+                    )
+                    continue
+                report.fetched += 1
+                if not permissions:
+                    report.empty += 1  # empty trees are not cached
+                    continue
+
+                _, snapshot_id = encode_permissions(permissions)
+                bits = PermissionSnapshot(permissions, snapshot_id).bits
+                pending_writes.append((
+                    cache_key,
+                    snapshot_id,
+                    permissions,
+                    selector._get_cache_tags(),
+                    bits.to_bytes() if bits else None,
+                    validators if selector.revalidation_enabled else None,
+                ))
+                if len(pending_writes) >= batch_size:
+                    flush()
+    flush()
+
+    report.finished_at = time.monotonic()
+    return report